@@ -0,0 +1,664 @@
+import asyncio
+import functools
+import os
+import ssl
+import sys
+import time
+from urllib.parse import urlparse, urljoin
+
+# Добавляем путь к текущей директории для импорта M3UScanner
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from M3UScanner import OnlineM3UScanner, ProbeResult, canonical_stream_url, parse_retry_after
+
+
+class AsyncM3UScanner:
+    """Асинхронный движок сканирования на asyncio.
+
+    Загрузка источников, HEAD проверки и ffprobe/ffmpeg выполняются в одном
+    цикле событий. Параллелизм ограничен семафорами на каждый этап и на хост,
+    поэтому тысячи проверок не требуют тысяч потоков. Поиск, сопоставление
+    каналов, кэши и запись плейлиста берутся из OnlineM3UScanner. Этап probe
+    ограничен тем же лимитом, что и ProbeProcessManager сканера
+    (max_probe_processes / probe_cpu_budget).
+    """
+
+    def __init__(self, scanner=None):
+        self.scanner = scanner or OnlineM3UScanner()
+
+        # Ограничения параллелизма по этапам
+        self.stage_limits = {
+            'fetch': 8,  # Загрузка плейлистов-источников
+            'search': 4,  # Поиск кандидатов (в потоках)
+            'head': 256,  # HEAD/GET проверки ссылок
+            'probe': None,  # Запуски ffprobe/ffmpeg: None - лимит probe_manager сканера
+        }
+        self.max_per_host = 4  # Одновременных запросов на один хост
+        self.channel_concurrency = 16  # Одновременно обрабатываемых каналов
+
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+
+        # Семафоры создаются внутри цикла событий
+        self._stage_semaphores = None
+        self._host_semaphores = {}
+        self._prefetch_task = None
+        self._verified = {}  # канонический URL -> задача проверки за текущий запуск
+
+    def _stage(self, name):
+        if self._stage_semaphores is None:
+            limits = dict(self.stage_limits)
+            limits['probe'] = limits['probe'] or self.scanner.probe_manager.max_processes
+            self._stage_semaphores = {stage: asyncio.Semaphore(limit) for stage, limit in limits.items()}
+        return self._stage_semaphores[name]
+
+    def _host(self, url):
+        host = urlparse(url).netloc.lower()
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_per_host)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    async def run_in_thread(self, func, *args, **kwargs):
+        """Выполняет блокирующую функцию сканера (диск, SQLite) в пуле потоков цикла событий"""
+        return await asyncio.get_event_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def http_request(self, url, method='HEAD', read_limit=0, timeout=None, max_redirects=5, headers=None):
+        """Минимальный асинхронный HTTP/1.1 запрос: (статус, заголовки, начало тела, итоговый URL)"""
+        extra_headers = headers or {}
+        if timeout is None:
+            timeout = self.scanner.timeout
+
+        for _ in range(max_redirects + 1):
+            parsed = urlparse(url)
+            is_https = parsed.scheme == 'https'
+            host = parsed.hostname
+            port = parsed.port or (443 if is_https else 80)
+            path = parsed.path or '/'
+            if parsed.query:
+                path += '?' + parsed.query
+
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    host, port,
+                    ssl=self.ssl_context if is_https else None,
+                    server_hostname=host if is_https else None
+                ),
+                timeout
+            )
+            try:
+                request_lines = [f"{method} {path} HTTP/1.1", f"Host: {parsed.netloc}"]
+                request_lines += [f"{key}: {value}" for key, value in self.scanner.REQUEST_HEADERS.items()]
+                request_lines += [f"{key}: {value}" for key, value in extra_headers.items()]
+                request_lines += ["Connection: close", "", ""]
+                writer.write("\r\n".join(request_lines).encode('latin-1', errors='ignore'))
+                await writer.drain()
+
+                status_line = await asyncio.wait_for(reader.readline(), timeout)
+                parts = status_line.decode('latin-1').split()
+                if len(parts) < 2 or not parts[1].isdigit():
+                    raise IOError(f"Некорректный ответ: {status_line[:50]!r}")
+                status = int(parts[1])
+
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), timeout)
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+
+                body = b''
+                if read_limit and method != 'HEAD' and headers.get('transfer-encoding', '').lower() == 'chunked':
+                    while len(body) < read_limit:
+                        size_line = await asyncio.wait_for(reader.readline(), timeout)
+                        size = int(size_line.split(b';')[0].strip() or b'0', 16)
+                        if size == 0:
+                            break
+                        body += await asyncio.wait_for(reader.readexactly(size), timeout)
+                        await asyncio.wait_for(reader.readline(), timeout)
+                elif read_limit and method != 'HEAD':
+                    while len(body) < read_limit:
+                        chunk = await asyncio.wait_for(reader.read(read_limit - len(body)), timeout)
+                        if not chunk:
+                            break
+                        body += chunk
+            finally:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except Exception:
+                    pass
+
+            if status in (301, 302, 303, 307, 308) and headers.get('location'):
+                url = urljoin(url, headers['location'])
+                continue
+            return status, headers, body, url
+
+        raise IOError("Слишком много перенаправлений")
+
+    async def request(self, url, method='HEAD', read_limit=0, max_retries=None, headers=None):
+        """HTTP запрос с повторными попытками и ограничением по хосту, None при ошибке"""
+        if max_retries is None:
+            max_retries = self.scanner.max_retries
+
+        limiter = self.scanner.rate_limiter
+        breaker = self.scanner.circuit_breaker
+        for attempt in range(max_retries):
+            if not breaker.allow(url):
+                break
+
+            # Очередь к хосту по token bucket; долгую паузу хоста не ждем
+            delay = limiter.reserve(url, max_wait=self.scanner.backoff_max)
+            if delay is None:
+                break
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            self.scanner.metrics.inc('total_requests')
+            try:
+                async with self._stage('head'), self._host(url):
+                    timeout = min(self.scanner.timeout * (attempt + 1), 30)
+                    with self.scanner.metrics.timer('head' if method == 'HEAD' else 'get', url):
+                        status, response_headers, body, final_url = await self.http_request(
+                            url, method, read_limit, timeout, headers=headers
+                        )
+            except Exception:
+                limiter.failure(url)
+                await self.run_in_thread(breaker.failure, url)
+                continue
+
+            await self.run_in_thread(breaker.success, url)
+            if status < 400:
+                limiter.success(url)
+                self.scanner.metrics.inc('successful_requests')
+                return status, response_headers, body, final_url
+
+            # 404, 403 и т.п. относятся к ссылке, а не к хосту: без паузы и без повтора
+            if status < 500 and status != 429:
+                break
+            retry_after = parse_retry_after(response_headers.get('retry-after')) if status in (429, 503) else None
+            limiter.failure(url, retry_after)
+
+        self.scanner.metrics.inc('failed_requests')
+        return None
+
+    async def probe_and_analyze(self, url):
+        """Проверка потока через asyncio.create_subprocess_exec: (поток жив, качество)"""
+        scanner = self.scanner
+        scanner.metrics.inc('quality_checks')
+
+        if not scanner.ffprobe_path and not scanner.ffmpeg_path:
+            return False, None
+
+        cached = await self.run_in_thread(scanner.load_cached_quality, url)
+        if cached is not None:
+            return True, cached
+
+        print(f"    📊 Анализ качества видео...")
+        cmd = scanner.get_probe_command(url)
+        manager = scanner.probe_manager
+        queued_at = time.time()
+        manager.enqueue()
+        async with self._stage('probe'):
+            # Время probe считается с момента получения слота, без ожидания в очереди
+            with scanner.metrics.timer('probe', url):
+                started_at = time.time()
+                manager.start(started_at - queued_at)
+                try:
+                    process = await asyncio.create_subprocess_exec(
+                        *cmd,
+                        stdin=asyncio.subprocess.DEVNULL,
+                        stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.PIPE,
+                        start_new_session=(os.name == 'posix')
+                    )
+                except OSError as e:
+                    manager.finish(time.time() - started_at, 'error')
+                    print(f"    ❌ Ошибка анализа: {str(e)[:50]}")
+                    scanner.metrics.inc('failed_quality_checks')
+                    return False, None
+
+                watcher = scanner.create_probe_watcher(cmd)
+                try:
+                    if watcher is None:
+                        stdout, stderr = await asyncio.wait_for(process.communicate(), scanner.check_timeout)
+                    else:
+                        stdout, stderr = await asyncio.wait_for(
+                            self.watch_probe_output(process, watcher), scanner.check_timeout
+                        )
+                except asyncio.TimeoutError:
+                    manager.kill(process)
+                    await process.wait()
+                    manager.finish(time.time() - started_at, 'timeout')
+                    print(f"    ⏰ Таймаут анализа качества")
+                    scanner.metrics.inc('failed_quality_checks')
+                    return False, None
+                except BaseException:
+                    # Отмена задачи или ошибка чтения: процесс не должен пережить проверку
+                    manager.kill(process)
+                    await process.wait()
+                    manager.finish(time.time() - started_at, 'error')
+                    raise
+                returncode = scanner.probe_returncode(watcher, process.returncode)
+                failed = returncode != 0 or (watcher is not None and watcher.failed)
+                manager.finish(time.time() - started_at, 'error' if failed else 'ok')
+
+        alive, quality_info = scanner.parse_probe_output(
+            cmd,
+            returncode,
+            stdout.decode('utf-8', errors='ignore'),
+            stderr.decode('utf-8', errors='ignore')
+        )
+        return await self.run_in_thread(scanner.finish_quality_analysis, url, alive, quality_info)
+
+    async def fetch_hls_playlist(self, url):
+        """Скачивает HLS плейлист: (текст, итоговый URL) или None"""
+        response = await self.request(url, 'GET', read_limit=self.scanner.hls_manifest_max_bytes, max_retries=1)
+        if not response or response[0] != 200:
+            return None
+        text = response[2].decode('utf-8', errors='ignore')
+        if '#EXTM3U' not in text[:1024]:
+            return None
+        return text, response[3]
+
+    async def probe_hls_manifest(self, url):
+        """Асинхронный аналог OnlineM3UScanner.probe_hls_manifest"""
+        scanner = self.scanner
+        result = {'reachable': False, 'alive': False, 'status': 'Не доступен',
+                  'variants': [], 'quality_info': None}
+
+        playlist = await self.fetch_hls_playlist(url)
+        if playlist is None:
+            return result
+        result['reachable'] = True
+
+        variants, segment_url = scanner.parse_hls_playlist(*playlist)
+        result['variants'] = variants
+        if variants:
+            best = max(variants, key=lambda v: (v['height'], v['bandwidth']))
+            result['quality_info'] = ProbeResult.from_hls_variants(variants).to_quality_info()
+            media = await self.fetch_hls_playlist(best['url'])
+            if media is None:
+                result['status'] = 'HLS вариант недоступен'
+                return result
+            _, segment_url = scanner.parse_hls_playlist(*media)
+
+        if not segment_url:
+            result['status'] = 'HLS без сегментов'
+            return result
+
+        probe_bytes = scanner.hls_segment_probe_bytes
+        response = await self.request(segment_url, 'GET', read_limit=probe_bytes, max_retries=1,
+                                      headers={'Range': f'bytes=0-{probe_bytes - 1}'})
+        if not response or response[0] not in (200, 206) or not response[2]:
+            result['status'] = 'HLS сегмент недоступен'
+            return result
+
+        result['alive'] = True
+        result['status'] = 'HLS проверен'
+        return result
+
+    async def watch_probe_output(self, process, watcher):
+        """Читает stderr ffmpeg частями и останавливает процесс, когда watcher доволен"""
+        stdout_task = asyncio.ensure_future(process.stdout.read())
+        try:
+            while True:
+                chunk = await process.stderr.read(4096)
+                if not chunk:
+                    break
+                if watcher.feed(chunk.decode('utf-8', errors='ignore')):
+                    self.scanner.probe_manager.kill(process)
+                    break
+            await process.wait()
+            stdout = await stdout_task
+        finally:
+            stdout_task.cancel()
+        return stdout, watcher.text().encode('utf-8')
+
+    async def check_stream(self, stream_info):
+        """Асинхронный аналог OnlineM3UScanner.check_single_stream_improved"""
+        url = stream_info.get('url', '')
+        if not url.startswith('http'):
+            return None
+
+        # Один поток проверяется один раз за запуск, повторные запросы ждут ту же задачу
+        key = canonical_stream_url(url)
+        task = self._verified.get(key)
+        if task is None:
+            task = self._verified[key] = asyncio.ensure_future(self.verify_stream(stream_info))
+        try:
+            check_fields = await asyncio.shield(task)
+        except Exception:
+            if self._verified.get(key) is task:
+                del self._verified[key]
+            raise
+        if check_fields is None:
+            return None
+        return {**stream_info, **check_fields}
+
+    async def verify_stream(self, stream_info):
+        """Поля результата проверки потока: из постоянного кэша или новой проверкой"""
+        url = stream_info['url']
+        settings = self.scanner.quality_settings_key()
+        cached = await self.run_in_thread(self.scanner.quality_cache.get, url, settings=settings)
+        if cached is not None:
+            print(f"    💾 Из кэша: {stream_info.get('name', 'Unknown')} - {url[:60]}...")
+            return cached
+
+        result = await self.run_stream_check(stream_info)
+        if not result:
+            return None
+        check_fields = {key: result[key] for key in self.scanner.CHECK_RESULT_FIELDS if key in result}
+        await self.run_in_thread(self.scanner.quality_cache.put, url, check_fields, result.get('working', False),
+                                 settings=settings)
+        return check_fields
+
+    async def run_stream_check(self, stream_info):
+        """Проверка работоспособности ссылки с анализом качества"""
+        scanner = self.scanner
+        try:
+            url = stream_info['url']
+            if not url.startswith('http'):
+                return None
+
+            print(f"    🔧 Проверка: {stream_info.get('name', 'Unknown')} - {url[:60]}...")
+
+            # YouTube ссылки
+            if 'youtube.com/watch' in url or 'youtu.be' in url:
+                response = await self.request(url, 'HEAD', max_retries=1)
+                if response and response[0] == 200:
+                    return {
+                        **stream_info,
+                        'working': True,
+                        'status': 'YouTube доступен',
+                        'quality': 'high',
+                        'stable': True,
+                        'quality_score': 70
+                    }
+                return {**stream_info, 'working': False, 'status': 'YouTube недоступен', 'quality': 'none', 'stable': False}
+
+            # M3U8 ссылки: сначала разбираем сам HLS плейлист, ffmpeg - только если нужно
+            elif '.m3u8' in url.lower():
+                hls = await self.probe_hls_manifest(url)
+                if hls['reachable']:
+                    if not hls['alive']:
+                        return {**stream_info, 'working': False, 'status': hls['status'], 'quality': 'none',
+                                'stable': False, 'quality_score': 0}
+
+                    status = 'HLS проверен'
+                    quality_info = hls['quality_info']
+                    if quality_info is not None:
+                        alive, quality_info = await self.run_in_thread(
+                            scanner.finish_quality_analysis, url, True, quality_info
+                        )
+                    elif (scanner.ffprobe_path or scanner.ffmpeg_path) and scanner.enable_deep_check:
+                        status = 'FFmpeg проверен'
+                        alive, quality_info = await self.probe_and_analyze(url)
+                        if not alive:
+                            quality_info = None
+
+                    return scanner.build_hls_check_result(stream_info, quality_info, status)
+
+            # M3U ссылки
+            elif '.m3u' in url.lower() and not url.endswith('.m3u8'):
+                response = await self.request(url, 'GET', read_limit=2048)
+                if response and response[0] == 200:
+                    if '#EXTM3U' in response[2].decode('utf-8', errors='ignore'):
+                        return {
+                            **stream_info,
+                            'working': True,
+                            'status': 'M3U валидный',
+                            'quality': 'medium',
+                            'stable': True,
+                            'quality_score': 40
+                        }
+
+            # Общая проверка
+            response = await self.request(url, 'HEAD')
+            if response and response[0] == 200:
+                content_type = response[1].get('content-type', '').lower()
+                if any(ct in content_type for ct in ['video/', 'audio/', 'application/']):
+                    return {
+                        **stream_info,
+                        'working': True,
+                        'status': 'Поток доступен',
+                        'quality': 'medium',
+                        'stable': False,
+                        'quality_score': 30
+                    }
+
+            return {
+                **stream_info,
+                'working': False,
+                'status': 'Не доступен',
+                'quality': 'none',
+                'stable': False,
+                'quality_score': 0
+            }
+
+        except Exception as e:
+            return {
+                **stream_info,
+                'working': False,
+                'status': f'Ошибка: {str(e)}',
+                'quality': 'none',
+                'stable': False,
+                'quality_score': 0
+            }
+
+    async def check_streams(self, streams, search_name):
+        """Проверяет найденные ссылки, все одновременно в пределах семафоров"""
+        if not streams:
+            return []
+
+        print(f"🔧 Проверка {len(streams)} найденных ссылок...")
+        print(f"   🎯 Фильтрация по: '{search_name}'")
+
+        relevant_streams = self.scanner.filter_relevant_streams(streams, search_name)
+
+        async def check_numbered(i, stream):
+            return i, await self.check_stream(stream)
+
+        checked = []
+        tasks = [check_numbered(i, stream) for i, stream in relevant_streams]
+        for task in asyncio.as_completed(tasks):
+            i, result = await task
+            if self.scanner.report_check_result(i, len(streams), result):
+                checked.append((i, result))
+
+        return self.scanner.rank_working_streams(checked, search_name)
+
+    async def prefetch_sources(self):
+        """Загружает и разбирает все плейлисты-источники один раз за запуск"""
+        if self._prefetch_task is None:
+            self._prefetch_task = asyncio.ensure_future(self._prefetch_sources())
+        await self._prefetch_task
+
+    async def _prefetch_sources(self):
+        urls = []
+        for source in self.scanner.get_iptv_sources():
+            urls.extend(self.scanner.get_source_playlist_urls(source))
+
+        async def fetch(url):
+            async with self._stage('fetch'), self._host(url):
+                await self.run_in_thread(self.scanner.get_playlist_index, url)
+
+        print(f"📥 Загрузка {len(urls)} плейлистов-источников...")
+        await asyncio.gather(*(fetch(url) for url in urls), return_exceptions=True)
+
+    async def search_in_online_sources(self, channel_name):
+        """Поиск кандидатов: источники уже разобраны, поиск по индексам в потоке"""
+        await self.prefetch_sources()
+        async with self._stage('search'):
+            return await self.run_in_thread(self.scanner.search_in_online_sources, channel_name)
+
+    async def prepare_channel_update(self, channel_name, existing_channels):
+        """Асинхронный аналог OnlineM3UScanner.prepare_channel_update"""
+        context = self.scanner.get_channel_context(channel_name, existing_channels)
+
+        start_time = time.time()
+        all_streams = await self.search_in_online_sources(context['name'])
+        working_streams = await self.check_streams(all_streams, context['name']) if all_streams else []
+        search_time = time.time() - start_time
+
+        return self.scanner.build_channel_update(context, all_streams, working_streams, search_time)
+
+    async def search_and_update_channel(self, channel_name):
+        """Поиск и обновление канала"""
+        print(f"\n🚀 Поиск (asyncio): '{channel_name}'")
+        existing_channels = self.scanner.load_existing_channels()
+        self._verified = {}
+
+        success, final_channel_name, new_streams = await self.prepare_channel_update(channel_name, existing_channels)
+        if new_streams is not None:
+            self.scanner.commit_channel_update(final_channel_name, new_streams)
+        self.scanner.export_metrics()
+        return success
+
+    async def run_channels(self, channel_names, worker, on_result):
+        """Обрабатывает каналы конкурентно, результаты применяются в одном месте"""
+        channel_semaphore = asyncio.Semaphore(self.channel_concurrency)
+
+        async def run_one(i, channel_name):
+            async with channel_semaphore:
+                try:
+                    return i, channel_name, await worker(i, channel_name), None
+                except Exception as e:
+                    return i, channel_name, None, e
+
+        tasks = [run_one(i, name) for i, name in enumerate(channel_names, 1)]
+        for task in asyncio.as_completed(tasks):
+            on_result(*(await task))
+
+    async def search_from_channels_list(self):
+        """Поиск по списку из Channels.txt"""
+        scanner = self.scanner
+        if not scanner.channels_list:
+            print("❌ Файл Channels.txt пуст или не найден")
+            return
+
+        print(f"🎯 ПОИСК ПО СПИСКУ ИЗ {len(scanner.channels_list)} КАНАЛОВ (asyncio)...")
+        counters = {'success': 0, 'failed': 0}
+        existing_channels = scanner.load_existing_channels()
+        snapshot = {name: list(streams) for name, streams in existing_channels.items()}
+
+        await self.prefetch_sources()
+        self._verified = {}
+        await self.run_in_thread(scanner.prepare_batch_search, scanner.channels_list)
+
+        async def search_channel(i, channel_name):
+            print(f"📺 [{i}/{len(scanner.channels_list)}] ПОИСК: {channel_name}")
+            return await self.prepare_channel_update(channel_name, snapshot)
+
+        def apply_result(i, channel_name, result, error):
+            if error is not None:
+                print(f"💥 ОШИБКА: {channel_name}: {error}")
+                counters['failed'] += 1
+                return
+
+            success, final_channel_name, new_streams = result
+            if new_streams is not None:
+                scanner.update_channel_in_playlist(final_channel_name, new_streams, flush=False)
+
+            counters['success' if success else 'failed'] += 1
+            print(f"{'✅ УСПЕХ' if success else '❌ НЕ УДАЛОСЬ'}: {channel_name}")
+
+        await self.run_channels(scanner.channels_list, search_channel, apply_result)
+        scanner.flush_playlist()
+
+        print(f"\n🎉 ПОИСК ЗАВЕРШЕН!")
+        print(f"✅ Найдено: {counters['success']} каналов")
+        print(f"❌ Не найдено: {counters['failed']} каналов")
+        scanner.export_metrics()
+
+    async def refresh_all_channels(self):
+        """Обновляет все каналы"""
+        scanner = self.scanner
+        print("🔄 ОБНОВЛЕНИЕ ВСЕХ КАНАЛОВ (asyncio)...")
+        existing_channels = scanner.load_existing_channels()
+
+        if not existing_channels:
+            print("❌ Нет каналов для обновления")
+            return
+
+        print(f"📊 Найдено каналов: {len(existing_channels)}")
+        counters = {'updated': 0, 'failed': 0}
+        channel_names = list(existing_channels.keys())
+        snapshot = {name: list(streams) for name, streams in existing_channels.items()}
+
+        await self.prefetch_sources()
+        self._verified = {}
+        await self.run_in_thread(scanner.prepare_batch_search, channel_names)
+
+        async def refresh_channel(i, channel_name):
+            print(f"🔄 [{i}/{len(channel_names)}] ОБНОВЛЕНИЕ: {channel_name}")
+            context = scanner.get_channel_context(channel_name, snapshot)
+            group = scanner.get_channel_category(channel_name)
+
+            all_streams = await self.search_in_online_sources(channel_name)
+            unique_streams = []
+            seen_urls = set()
+            for stream in all_streams:
+                if stream['url'] not in seen_urls:
+                    stream['name'] = channel_name
+                    stream['group'] = group
+                    unique_streams.append(stream)
+                    seen_urls.add(stream['url'])
+
+            working_streams = await self.check_streams(unique_streams, channel_name)
+
+            # Восстанавливаем оригинальную информацию канала
+            for stream in working_streams:
+                stream['name'] = channel_name
+                stream['group'] = context['group']
+                if context['tvg_id']:
+                    stream['tvg_id'] = context['tvg_id']
+                if context['tvg_logo']:
+                    stream['tvg_logo'] = context['tvg_logo']
+
+            return working_streams, context['group']
+
+        def apply_result(i, channel_name, result, error):
+            if error is not None:
+                print(f"💥 ОШИБКА: {channel_name}: {error}")
+                counters['failed'] += 1
+                return
+
+            working_streams, original_group = result
+            scanner.update_channel_in_playlist(channel_name, working_streams, flush=False)
+            if working_streams:
+                counters['updated'] += 1
+                print(f"✅ ОБНОВЛЕН: {channel_name} (группа: {original_group})")
+            else:
+                counters['failed'] += 1
+                print(f"❌ УДАЛЕН: {channel_name}")
+
+        await self.run_channels(channel_names, refresh_channel, apply_result)
+
+        if scanner.flush_playlist():
+            print(f"\n🎉 ОБНОВЛЕНИЕ ЗАВЕРШЕНО!")
+            print(f"✅ Обновлено: {counters['updated']}")
+            print(f"❌ Удалено: {counters['failed']}")
+        scanner.export_metrics()
+
+
+def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == 'refresh':
+        asyncio.run(AsyncM3UScanner().refresh_all_channels())
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'list':
+        asyncio.run(AsyncM3UScanner().search_from_channels_list())
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'search':
+        asyncio.run(AsyncM3UScanner().search_and_update_channel(' '.join(sys.argv[2:])))
+    else:
+        print("🌐 Smart M3U Scanner - асинхронный движок")
+        print("Использование:")
+        print("  python AsyncM3UScanner.py search <канал>  - Поиск одного канала")
+        print("  python AsyncM3UScanner.py list            - Поиск по Channels.txt")
+        print("  python AsyncM3UScanner.py refresh         - Обновить все каналы")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,500 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Добавляем путь к текущей директории для импорта M3UScanner
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from M3UScanner import OnlineM3UScanner, HostRateLimiter, percentile
+from AsyncM3UScanner import AsyncM3UScanner
+
+BENCHMARKS = ('extract', 'search', 'check', 'full', 'full_async')
+
+# Названия каналов для поиска; при большем --channels добавляются "Эфир N"
+TARGET_CHANNELS = [
+    'Россия 1', 'Первый канал', 'НТВ', 'СТС', 'ТНТ', 'Пятница', 'Матч ТВ', 'Звезда',
+    'Рен ТВ', 'Домашний', 'Карусель', 'Мир', 'Спас', 'Россия 24', 'Культура', 'ТВ Центр',
+]
+NAME_VARIANTS = ['{name}', '{name} HD', '{name} FHD', '{name} (1080p)', '{name} +2', '{name} 720p']
+FILLER_WORDS = [
+    'Северный', 'Южный', 'Музыкальный', 'Детский', 'Кино', 'Новости', 'Спорт', 'Регион',
+    'Погода', 'Сериал', 'Природа', 'История', 'Наука', 'Путешествия', 'Мода', 'Кухня',
+]
+
+# Пустой MPEG-TS (null пакеты) - если ffmpeg не используется
+SYNTHETIC_TS = (bytes([0x47, 0x1f, 0xff, 0x10]) + b'\xff' * 184) * 64
+
+
+class SyntheticSources:
+    """Синтетические плейлисты-источники и потоки для локального сервера.
+
+    Каждый канал из списка встречается streams_per_channel раз (с вариантами
+    названия) в разных источниках, остальное - случайные каналы-заполнители.
+    Доля failure_rate потоков отвечает 404, потоки распределены по хостам.
+    """
+
+    def __init__(self, channels, sources, entries, streams_per_channel, failure_rate, seed):
+        self.rng = random.Random(seed)
+        self.channel_names = [
+            TARGET_CHANNELS[i] if i < len(TARGET_CHANNELS) else f"Эфир {i + 1}"
+            for i in range(channels)
+        ]
+        self.source_count = sources
+        self.entries = entries
+        self.streams_per_channel = streams_per_channel
+        self.failure_rate = failure_rate
+        self.dead = set()
+        self.payload = SYNTHETIC_TS
+        self.hosts = []
+        self.sources = []
+
+    def build(self, hosts):
+        """Генерирует тексты источников для списка базовых URL хостов"""
+        self.hosts = hosts
+        self.dead = set()
+        per_source = [[] for _ in range(self.source_count)]
+        next_id = 0
+
+        def stream_url(stream_id):
+            host = hosts[stream_id % len(hosts)]
+            if stream_id % 2:
+                return f"{host}/hls/{stream_id}.m3u8"
+            return f"{host}/live/{stream_id}.ts"
+
+        for name in self.channel_names:
+            for k in range(self.streams_per_channel):
+                title = NAME_VARIANTS[k % len(NAME_VARIANTS)].format(name=name)
+                per_source[(next_id + k) % self.source_count].append((title, 'Общие', next_id))
+                next_id += 1
+
+        for entries in per_source:
+            while len(entries) < self.entries:
+                title = f"{self.rng.choice(FILLER_WORDS)} {self.rng.choice(FILLER_WORDS)} {next_id}"
+                entries.append((title, self.rng.choice(FILLER_WORDS), next_id))
+                next_id += 1
+            self.rng.shuffle(entries)
+
+        for stream_id in range(next_id):
+            if self.rng.random() < self.failure_rate:
+                self.dead.add(stream_id)
+
+        self.sources = []
+        for entries in per_source:
+            lines = ['#EXTM3U']
+            for title, group, stream_id in entries:
+                lines.append(f'#EXTINF:-1 tvg-id="ch{stream_id}" group-title="{group}",{title}')
+                lines.append(stream_url(stream_id))
+            self.sources.append('\n'.join(lines) + '\n')
+
+    def source_urls(self):
+        return [f"{self.hosts[0]}/source/{i}.m3u" for i in range(self.source_count)]
+
+    def media_playlist(self, stream_id):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+        for k in range(3):
+            lines.append('#EXTINF:4.0,')
+            lines.append(f"/seg/{stream_id}/{k}.ts")
+        return '\n'.join(lines) + '\n'
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Отдает источники, потоки и HLS плейлисты из SyntheticSources"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body):
+        fixture = self.server.fixture
+        if self.server.latency:
+            time.sleep(self.server.latency * random.uniform(0.5, 1.5))
+
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        body = None
+        content_type = 'video/mp2t'
+        try:
+            if parts[0] == 'source':
+                body = fixture.sources[int(parts[1].split('.')[0])].encode('utf-8')
+                content_type = 'audio/x-mpegurl'
+            elif parts[0] in ('live', 'hls'):
+                stream_id = int(parts[1].split('.')[0])
+                if stream_id not in fixture.dead:
+                    if parts[0] == 'hls':
+                        body = fixture.media_playlist(stream_id).encode('utf-8')
+                        content_type = 'application/vnd.apple.mpegurl'
+                    else:
+                        body = fixture.payload
+            elif parts[0] == 'seg':
+                if int(parts[1]) not in fixture.dead:
+                    body = fixture.payload
+        except (IndexError, ValueError):
+            body = None
+
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        status = 200
+        byte_range = self.headers.get('Range', '')
+        if byte_range.startswith('bytes=') and content_type == 'video/mp2t':
+            start, _, end = byte_range[len('bytes='):].partition('-')
+            if start.isdigit():
+                end = int(end) if end.isdigit() else len(body) - 1
+                body = body[int(start):end + 1]
+                status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+
+class FixtureServers:
+    """Локальные HTTP серверы: по одному порту на "хост" (лимиты хостов считаются по host:port)"""
+
+    def __init__(self, fixture, hosts=4, latency=0.0):
+        self.fixture = fixture
+        self.servers = []
+        for _ in range(hosts):
+            server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+            server.daemon_threads = True
+            server.fixture = fixture
+            server.latency = latency
+            self.servers.append(server)
+
+    def __enter__(self):
+        for server in self.servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.fixture.build([f"http://127.0.0.1:{server.server_address[1]}" for server in self.servers])
+        return self
+
+    def __exit__(self, *exc):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+
+def make_ffmpeg_payload(workdir, duration=4):
+    """Тестовый поток 720p25 H.264/AAC в MPEG-TS через ffmpeg (None, если ffmpeg нет)"""
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return None
+    output = os.path.join(workdir, 'sample.ts')
+    cmd = [
+        ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=25',
+        '-f', 'lavfi', '-i', 'sine=frequency=1000',
+        '-t', str(duration),
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', '1500k',
+        '-c:a', 'aac', '-f', 'mpegts', output
+    ]
+    try:
+        subprocess.run(cmd, capture_output=True, timeout=120, check=True)
+        with open(output, 'rb') as f:
+            return f.read()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def process_peak_rss_mb():
+    """Пиковая память всего процесса в МБ на текущий момент (None, если модуль resource недоступен).
+
+    ru_maxrss только растет: это пик за все замеры до этого, а не память одного
+    замера, поэтому значение справочное и с базовым замером не сравнивается.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux - килобайты, macOS - байты
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+@contextmanager
+def quiet():
+    """Подавляет вывод сканера на время замера"""
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, redirect_stdout(devnull):
+        yield
+
+
+def summarize(samples, items, total_time, **extra):
+    return {
+        'samples': len(samples),
+        'items': items,
+        'total_seconds': round(total_time, 4),
+        'throughput': round(items / total_time, 2) if total_time > 0 else 0.0,
+        'p50': round(percentile(samples, 0.5), 4),
+        'p95': round(percentile(samples, 0.95), 4),
+        'process_peak_rss_mb': process_peak_rss_mb(),
+        **extra
+    }
+
+
+class BenchmarkRunner:
+    """Замеры этапов сканера на локальных источниках"""
+
+    def __init__(self, fixture, workdir, args):
+        self.fixture = fixture
+        self.workdir = workdir
+        self.args = args
+        self.found = {}  # канал -> найденные ссылки (этап search, вход для check)
+
+    def make_scanner(self, name):
+        """Новый сканер со своими кэшами, чтобы замеры не влияли друг на друга"""
+        base = os.path.join(self.workdir, name)
+        files_dir = os.path.join(base, 'files')
+        os.makedirs(files_dir, exist_ok=True)
+        with open(os.path.join(files_dir, 'site.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(self.fixture.source_urls()) + '\n')
+        with open(os.path.join(files_dir, 'Channels.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(self.fixture.channel_names) + '\n')
+        with open(os.path.join(files_dir, 'cartolog.txt'), 'w', encoding='utf-8') as f:
+            f.write('')
+
+        with quiet():
+            scanner = OnlineM3UScanner(cache_dir=os.path.join(base, 'cache'), files_dir=files_dir)
+        scanner.playlist_file = os.path.join(base, 'playlist', 'playlist.m3u')
+        if self.args.workers:
+            scanner.max_workers = self.args.workers
+        if self.args.channel_workers:
+            scanner.channel_workers = self.args.channel_workers
+        if self.args.host_rate:
+            scanner.rate_limiter = HostRateLimiter(
+                rate=self.args.host_rate,
+                burst=max(scanner.host_request_burst, int(self.args.host_rate)),
+                backoff_max=scanner.backoff_max
+            )
+        if self.args.ffmpeg:
+            scanner.ffmpeg_path = shutil.which('ffmpeg')
+            scanner.ffprobe_path = shutil.which('ffprobe')
+            scanner.enable_deep_check = bool(scanner.ffmpeg_path or scanner.ffprobe_path)
+        else:
+            scanner.enable_deep_check = False
+        return scanner
+
+    def bench_extract(self):
+        """extract_channels_from_playlist: разбор и поиск по тексту источника"""
+        scanner = self.make_scanner('extract')
+        samples = []
+        entries = 0
+        matches = 0
+        started = time.perf_counter()
+        with quiet():
+            for _ in range(self.args.repeat):
+                for content in self.fixture.sources:
+                    for channel_name in self.fixture.channel_names:
+                        t0 = time.perf_counter()
+                        matches += len(scanner.extract_channels_from_playlist(content, channel_name))
+                        samples.append(time.perf_counter() - t0)
+                        entries += self.fixture.entries
+        return summarize(samples, entries, time.perf_counter() - started, unit='записей/с', matches=matches)
+
+    def bench_search(self):
+        """search_in_online_sources: загрузка источников и все этапы поиска"""
+        scanner = self.make_scanner('search')
+        samples = []
+        started = time.perf_counter()
+        with quiet():
+            for channel_name in self.fixture.channel_names:
+                t0 = time.perf_counter()
+                self.found[channel_name] = scanner.search_in_online_sources(channel_name)
+                samples.append(time.perf_counter() - t0)
+        streams = sum(len(streams) for streams in self.found.values())
+        return summarize(samples, len(samples), time.perf_counter() - started,
+                         unit='каналов/с', streams_found=streams)
+
+    def bench_check(self):
+        """check_streams: проверка найденных ссылок (HEAD/HLS/ffmpeg)"""
+        if not self.found:
+            self.bench_search()
+        scanner = self.make_scanner('check')
+        samples = []
+        checked = 0
+        working = 0
+        started = time.perf_counter()
+        with quiet():
+            for channel_name in self.fixture.channel_names:
+                streams = [dict(stream) for stream in self.found.get(channel_name, [])]
+                t0 = time.perf_counter()
+                working += len(scanner.check_streams(streams, channel_name))
+                samples.append(time.perf_counter() - t0)
+                checked += len(streams)
+        return summarize(samples, checked, time.perf_counter() - started, unit='ссылок/с', working=working)
+
+    def bench_full(self):
+        """search_from_channels_list: полный запуск по Channels.txt с записью плейлиста"""
+        samples = []
+        for run in range(self.args.full_runs):
+            scanner = self.make_scanner(f'full-{run}')
+            t0 = time.perf_counter()
+            with quiet():
+                counters = scanner.search_from_channels_list()
+            samples.append(time.perf_counter() - t0)
+        stages = {stage: summary['sum'] for stage, summary in scanner.metrics.snapshot()['stages'].items()}
+        return summarize(samples, len(self.fixture.channel_names) * len(samples), sum(samples),
+                         unit='каналов/с', found=(counters or {}).get('success', 0), stage_seconds=stages)
+
+    def bench_full_async(self):
+        """AsyncM3UScanner.search_from_channels_list: тот же запуск на asyncio"""
+        samples = []
+        for run in range(self.args.full_runs):
+            scanner = self.make_scanner(f'full-async-{run}')
+            t0 = time.perf_counter()
+            with quiet():
+                asyncio.run(AsyncM3UScanner(scanner).search_from_channels_list())
+            samples.append(time.perf_counter() - t0)
+        return summarize(samples, len(self.fixture.channel_names) * len(samples), sum(samples), unit='каналов/с')
+
+    def run(self, names):
+        results = {}
+        for name in names:
+            print(f"⏱️  {name}...")
+            results[name] = getattr(self, f'bench_{name}')()
+            self.print_result(name, results[name])
+        return results
+
+    @staticmethod
+    def print_result(name, result):
+        rss = result['process_peak_rss_mb']
+        rss = f"{rss} МБ" if rss is not None else 'н/д'
+        print(f"   📊 {name}: {result['throughput']} {result['unit']}, "
+              f"p50 {result['p50'] * 1000:.1f} мс, p95 {result['p95'] * 1000:.1f} мс, "
+              f"замеров {result['samples']}, пик памяти процесса {rss}")
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Список регрессий относительно сохраненного базового замера"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        if base['p50'] > 0 and result['p50'] > base['p50'] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {base['p50'] * 1000:.1f} -> {result['p50'] * 1000:.1f} мс")
+        if base['p95'] > 0 and result['p95'] > base['p95'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95'] * 1000:.1f} -> {result['p95'] * 1000:.1f} мс")
+        if base['throughput'] > 0 and result['throughput'] < base['throughput'] / (1 + tolerance):
+            regressions.append(f"{name}: {base['throughput']} -> {result['throughput']} {result['unit']}")
+    return regressions
+
+
+def positive_int(value):
+    """Тип argparse: целое число не меньше 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"нужно число не меньше 1: {value}")
+    return number
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='Benchmark.py',
+        description='Замеры производительности сканера на локальных синтетических источниках.'
+    )
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='какие замеры выполнить (по умолчанию все)')
+    parser.add_argument('--channels', type=int, default=16, help='каналов в Channels.txt')
+    parser.add_argument('--sources', type=int, default=3, help='плейлистов-источников')
+    parser.add_argument('--entries', type=int, default=2000, help='записей в каждом источнике')
+    parser.add_argument('--streams-per-channel', type=int, default=4, help='ссылок на каждый искомый канал')
+    parser.add_argument('--failure-rate', type=float, default=0.2, help='доля нерабочих ссылок (404)')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='задержка ответа сервера, мс')
+    parser.add_argument('--hosts', type=int, default=4, help='число хостов (портов) с потоками')
+    parser.add_argument('--repeat', type=positive_int, default=3, help='повторов замера extract')
+    parser.add_argument('--full-runs', type=positive_int, default=1, help='повторов полного запуска')
+    parser.add_argument('--ffmpeg', action='store_true',
+                        help='отдавать настоящий поток, созданный ffmpeg, и включить глубокую проверку')
+    parser.add_argument('--workers', type=int, help='параллельных проверок ссылок')
+    parser.add_argument('--channel-workers', type=int, help='параллельно обрабатываемых каналов')
+    parser.add_argument('--host-rate', type=float, help='запросов в секунду на хост (по умолчанию - как в сканере)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help='файл базового замера')
+    parser.add_argument('--save-baseline', action='store_true', help='сохранить результаты как базовый замер')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='допустимое ухудшение (0.25 = 25%%)')
+    parser.add_argument('--json', help='записать результаты в JSON файл')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    names = args.only or list(BENCHMARKS)
+    config = {
+        key: getattr(args, key)
+        for key in ('channels', 'sources', 'entries', 'streams_per_channel', 'failure_rate', 'latency_ms',
+                    'hosts', 'repeat', 'full_runs', 'ffmpeg', 'workers', 'channel_workers', 'host_rate', 'seed')
+    }
+
+    fixture = SyntheticSources(args.channels, args.sources, args.entries, args.streams_per_channel,
+                               args.failure_rate, args.seed)
+
+    with tempfile.TemporaryDirectory(prefix='m3u-bench-') as workdir:
+        if args.ffmpeg:
+            payload = make_ffmpeg_payload(workdir)
+            if payload:
+                fixture.payload = payload
+                print(f"🎬 Тестовый поток ffmpeg: {len(payload) // 1024} КБ")
+            else:
+                print("⚠️  ffmpeg не найден или не смог создать поток - используется синтетический MPEG-TS")
+
+        with FixtureServers(fixture, hosts=args.hosts, latency=args.latency_ms / 1000):
+            print(f"🧪 Источников: {args.sources} x {args.entries} записей, каналов: {args.channels}, "
+                  f"хостов: {args.hosts}, нерабочих: {len(fixture.dead)}")
+            results = BenchmarkRunner(fixture, workdir, args).run(names)
+
+    report = {'config': config, 'python': sys.version.split()[0], 'created': time.time(), 'results': results}
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Базовый замер сохранен: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"ℹ️  Базовый замер {args.baseline} не найден (сохранить: --save-baseline)")
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('config') != config:
+        print(f"⚠️  Параметры отличаются от базового замера {args.baseline} - сравнение пропущено")
+        return 0
+
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"❌ Регрессии относительно {args.baseline} (допуск {args.tolerance:.0%}):")
+        for regression in regressions:
+            print(f"   {regression}")
+        return 1
+    print(f"✅ Без регрессий относительно {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
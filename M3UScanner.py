@@ -6,24 +6,1793 @@ import sys
 import os
 import ssl
 import json
-from urllib.parse import urlparse, urljoin, quote
+import argparse
+import io
+import codecs
+import hashlib
+import zlib
+import random
+from urllib.parse import urlparse, urljoin, quote, parse_qsl, urlencode
 import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import subprocess
+import signal
+import sqlite3
+import stat
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple, deque
+from contextlib import contextmanager, redirect_stdout
+from email.utils import parsedate_to_datetime
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    import urllib3
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+except ImportError:
+    requests = None
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+# Сжатие, которое умеем распаковывать (br - только если установлен brotli)
+ACCEPT_ENCODING = 'gzip, deflate, br' if brotli is not None else 'gzip, deflate'
 
 # Отключаем SSL проверку
 ssl._create_default_https_context = ssl._create_unverified_context
 
-class OnlineM3UScanner:
+
+class PlaylistCache:
+    """Кэш содержимого плейлистов на время запуска (ключ - URL, ограничение по размеру и TTL)"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items = OrderedDict()  # url -> (время сохранения, размер, значение)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def estimate_size(value):
+        """Оценивает размер значения в байтах"""
+        if hasattr(value, 'size_bytes'):
+            return value.size_bytes
+        if isinstance(value, (str, bytes)):
+            return len(value)
+        return sys.getsizeof(value)
+
+    def get(self, url):
+        """Возвращает значение из кэша или None"""
+        with self._lock:
+            item = self._items.get(url)
+            if item is None:
+                self.misses += 1
+                return None
+            stored_at, size, value = item
+            if time.time() - stored_at > self.ttl:
+                del self._items[url]
+                self._size -= size
+                self.misses += 1
+                return None
+            self._items.move_to_end(url)
+            self.hits += 1
+            return value
+
+    def put(self, url, value):
+        """Сохраняет значение, вытесняя самые старые записи при превышении лимита"""
+        size = self.estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if url in self._items:
+                self._size -= self._items.pop(url)[1]
+            self._items[url] = (time.time(), size, value)
+            self._size += size
+            while self._size > self.max_bytes and self._items:
+                _, (_, old_size, _) = self._items.popitem(last=False)
+                self._size -= old_size
+
+    def clear(self):
+        """Очищает кэш"""
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def size_bytes(self):
+        return self._size
+
+
+class ContentDecoder:
+    """Потоковая распаковка тела ответа по Content-Encoding (gzip, deflate, br)"""
+
+    SUPPORTED = ('gzip', 'x-gzip', 'deflate', 'br') if brotli is not None else ('gzip', 'x-gzip', 'deflate')
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self._started = False
+        if encoding == 'br':
+            self._obj = brotli.Decompressor()
+        elif encoding in ('gzip', 'x-gzip'):
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._obj = zlib.decompressobj()
+
+    def decompress(self, data):
+        """Распаковывает очередную часть тела"""
+        if self.encoding == 'br':
+            process = getattr(self._obj, 'process', None) or self._obj.decompress
+            return process(data)
+        try:
+            result = self._obj.decompress(data)
+        except zlib.error:
+            # Некоторые серверы отдают deflate без zlib-заголовка
+            if self.encoding != 'deflate' or self._started:
+                raise
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            result = self._obj.decompress(data)
+        self._started = True
+        return result
+
+    def flush(self):
+        """Остаток распакованных данных в конце тела"""
+        if self.encoding == 'br':
+            return b''
+        return self._obj.flush()
+
+
+class HttpResponse:
+    """Ответ HTTP клиента с явным управлением соединением"""
+
+    def __init__(self, raw, status, headers, url, requests_response=None):
+        self.raw = raw
+        self.status = status
+        self.headers = headers
+        self.url = url
+        self._requests_response = requests_response
+        self._closed = False
+
+        # requests/urllib3 распаковывают сами, для urllib - свой декодер
+        self._decoder = None
+        self._decoder_done = False
+        if requests_response is None and headers is not None:
+            encoding = (headers.get('Content-Encoding') or '').strip().lower()
+            if encoding in ContentDecoder.SUPPORTED:
+                self._decoder = ContentDecoder(encoding)
+
+    def getcode(self):
+        return self.status
+
+    def read(self, amt=None):
+        """Читает тело ответа (все или около amt байт), распаковывая gzip/deflate/br"""
+        if self._requests_response is not None:
+            return self.raw.read(amt, decode_content=True)
+        if self._decoder is None:
+            return self.raw.read() if amt is None else self.raw.read(amt)
+        if self._decoder_done:
+            return b''
+
+        if amt is None:
+            self._decoder_done = True
+            return self._decoder.decompress(self.raw.read()) + self._decoder.flush()
+
+        # Читаем сжатые части, пока не получим распакованные данные или конец тела
+        while True:
+            chunk = self.raw.read(amt)
+            if not chunk:
+                self._decoder_done = True
+                return self._decoder.flush()
+            data = self._decoder.decompress(chunk)
+            if data:
+                return data
+
+    def iter_chunks(self, chunk_size=65536):
+        """Отдает тело ответа частями, не загружая его целиком"""
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def iter_lines(self, chunk_size=65536, encoding='utf-8'):
+        """Отдает тело ответа построчно с потоковым декодированием"""
+        decoder = codecs.getincrementaldecoder(encoding)(errors='ignore')
+        tail = ''
+        for chunk in self.iter_chunks(chunk_size):
+            text = tail + decoder.decode(chunk)
+            lines = text.split('\n')
+            tail = lines.pop()
+            for line in lines:
+                yield line
+        tail += decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+    def close(self):
+        """Возвращает соединение в пул (или закрывает его)"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._requests_response is not None:
+                self._requests_response.close()
+            else:
+                self.raw.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class HttpClient:
+    """HTTP клиент с пулом keep-alive соединений для каждого хоста.
+
+    Использует requests/urllib3, если они установлены, иначе urllib без пула.
+    """
+
+    def __init__(self, headers, pool_connections=32, pool_maxsize=8):
+        self.headers = dict(headers)
+        self.headers.setdefault('Accept-Encoding', ACCEPT_ENCODING)
+        self.session = None
+        if requests is not None:
+            self.session = requests.Session()
+            self.session.headers.update(self.headers)
+            self.session.verify = False
+            adapter = HTTPAdapter(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                max_retries=0,
+                pool_block=False
+            )
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
+    def request(self, url, method='GET', timeout=15, headers=None):
+        """Выполняет запрос и возвращает HttpResponse (тело читается лениво)"""
+        if self.session is not None:
+            response = self.session.request(
+                method.upper(),
+                url,
+                headers=headers,
+                timeout=timeout,
+                stream=True,
+                allow_redirects=True
+            )
+            return HttpResponse(response.raw, response.status_code, response.headers,
+                                response.url, requests_response=response)
+
+        request_headers = dict(self.headers)
+        if headers:
+            request_headers.update(headers)
+        req = urllib.request.Request(url, headers=request_headers, method=method.upper())
+        try:
+            response = urllib.request.urlopen(req, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            # Ошибочный статус тоже возвращаем как ответ - решение принимает вызывающий код
+            response = e
+        return HttpResponse(response, response.getcode(), response.headers, response.geturl())
+
+    def close(self):
+        """Закрывает все соединения пула"""
+        if self.session is not None:
+            self.session.close()
+
+
+class StreamCheckCache:
+    """Постоянный кэш результатов проверки потоков (SQLite) с TTL и вытеснением LRU.
+
+    Вместе с результатом хранится отпечаток настроек проверки: запись,
+    сделанная при других настройках, считается промахом.
+    """
+
+    def __init__(self, db_path, positive_ttl=6 * 3600, negative_ttl=1800, max_entries=20000):
+        self.db_path = db_path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+
+        try:
+            os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️  Кэш проверок недоступен ({e}) - используется память")
+            self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+
+        with self._lock:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS stream_checks ('
+                'kind TEXT NOT NULL, url TEXT NOT NULL, result TEXT NOT NULL, '
+                'working INTEGER NOT NULL, checked_at REAL NOT NULL, last_access REAL NOT NULL, '
+                'PRIMARY KEY (kind, url))'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS stream_checks_access ON stream_checks (last_access)'
+            )
+            columns = {row[1] for row in self._conn.execute('PRAGMA table_info(stream_checks)')}
+            if 'settings' not in columns:
+                self._conn.execute("ALTER TABLE stream_checks ADD COLUMN settings TEXT NOT NULL DEFAULT ''")
+            self._conn.commit()
+
+    def get(self, url, kind='check', settings=''):
+        """Возвращает сохраненный результат или None, если его нет, он устарел или сделан при других настройках"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT result, working, checked_at, settings FROM stream_checks WHERE kind = ? AND url = ?',
+                (kind, url)
+            ).fetchone()
+            if row is None or row[3] != settings:
+                self.misses += 1
+                return None
+
+            result, working, checked_at, _ = row
+            ttl = self.positive_ttl if working else self.negative_ttl
+            if now - checked_at > ttl:
+                self._conn.execute('DELETE FROM stream_checks WHERE kind = ? AND url = ?', (kind, url))
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                'UPDATE stream_checks SET last_access = ? WHERE kind = ? AND url = ?',
+                (now, kind, url)
+            )
+            self._conn.commit()
+            self.hits += 1
+
+        try:
+            return json.loads(result)
+        except ValueError:
+            return None
+
+    def put(self, url, result, working, kind='check', settings=''):
+        """Сохраняет результат проверки вместе с отпечатком настроек"""
+        now = time.time()
+        payload = json.dumps(result, ensure_ascii=False, default=str)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO stream_checks '
+                '(kind, url, result, working, checked_at, last_access, settings) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (kind, url, payload, 1 if working else 0, now, now, settings)
+            )
+            self._puts_since_evict += 1
+            if self._puts_since_evict >= 100:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Удаляет давно не использованные записи сверх лимита"""
+        self._puts_since_evict = 0
+        count = self._conn.execute('SELECT COUNT(*) FROM stream_checks').fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                'DELETE FROM stream_checks WHERE rowid IN ('
+                'SELECT rowid FROM stream_checks ORDER BY last_access LIMIT ?)',
+                (count - self.max_entries,)
+            )
+
+    def clear(self):
+        """Очищает кэш"""
+        with self._lock:
+            self._conn.execute('DELETE FROM stream_checks')
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM stream_checks').fetchone()[0]
+
+
+class SourceValidatorStore:
+    """Валидаторы источников (ETag, Last-Modified, хэш содержимого) и их локальные копии.
+
+    Метаданные хранятся в SQLite, копии - отдельными файлами в data_dir:
+    текст страницы ('text') или уже разобранные записи плейлиста ('index').
+    """
+
+    def __init__(self, db_path, data_dir):
+        self.db_path = db_path
+        self.data_dir = data_dir
+        self.hits = 0  # Ответов 304
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        try:
+            os.makedirs(data_dir, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️  Хранилище валидаторов недоступно ({e}) - используется память")
+            self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+
+        with self._lock:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS source_validators ('
+                'kind TEXT NOT NULL, url TEXT NOT NULL, etag TEXT, last_modified TEXT, '
+                'content_hash TEXT NOT NULL, fetched_at REAL NOT NULL, '
+                'PRIMARY KEY (kind, url))'
+            )
+            self._conn.commit()
+
+    def _data_path(self, url, kind):
+        digest = hashlib.sha1(f"{kind}:{url}".encode('utf-8')).hexdigest()
+        return os.path.join(self.data_dir, f"{digest}.{'json' if kind == 'index' else 'txt'}")
+
+    def _row(self, url, kind):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT etag, last_modified, content_hash FROM source_validators WHERE kind = ? AND url = ?',
+                (kind, url)
+            ).fetchone()
+
+    def conditional_headers(self, url, kind):
+        """Заголовки If-None-Match / If-Modified-Since, если есть локальная копия"""
+        row = self._row(url, kind)
+        if row is None or not os.path.exists(self._data_path(url, kind)):
+            return {}
+        etag, last_modified, _ = row
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def load(self, url, kind):
+        """Локальная копия источника (после ответа 304) или None"""
+        try:
+            with open(self._data_path(url, kind), 'r', encoding='utf-8') as f:
+                data = json.load(f) if kind == 'index' else f.read()
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def store(self, url, kind, headers, data, content_hash):
+        """Сохраняет валидаторы ответа и копию; файл не переписывается, если хэш не изменился"""
+        row = self._row(url, kind)
+        path = self._data_path(url, kind)
+        try:
+            if row is None or row[2] != content_hash or not os.path.exists(path):
+                fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    if kind == 'index':
+                        json.dump(data, f, ensure_ascii=False)
+                    else:
+                        f.write(data)
+                os.replace(tmp_path, path)
+        except OSError:
+            return
+
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO source_validators '
+                '(kind, url, etag, last_modified, content_hash, fetched_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (kind, url, headers.get('ETag'), headers.get('Last-Modified'), content_hash, time.time())
+            )
+            self._conn.commit()
+
+    def forget(self, url, kind):
+        """Удаляет валидаторы и копию одного источника (следующий запрос будет полным)"""
+        with self._lock:
+            self._conn.execute('DELETE FROM source_validators WHERE kind = ? AND url = ?', (kind, url))
+            self._conn.commit()
+        try:
+            os.remove(self._data_path(url, kind))
+        except OSError:
+            pass
+
+    def clear(self):
+        """Удаляет валидаторы и локальные копии"""
+        with self._lock:
+            self._conn.execute('DELETE FROM source_validators')
+            self._conn.commit()
+        for name in os.listdir(self.data_dir) if os.path.isdir(self.data_dir) else []:
+            try:
+                os.remove(os.path.join(self.data_dir, name))
+            except OSError:
+                pass
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM source_validators').fetchone()[0]
+
+
+class PlaylistModel:
+    """Плейлист в памяти: загружается заново, только если файл изменили извне"""
+
+    def __init__(self, static_content, channels, file_mtime=None):
+        self.static_content = static_content
+        self.channels = channels  # имя канала -> список ссылок
+        self.dirty = False
+        self.last_flush = time.time()
+        self.file_mtime = file_mtime  # st_mtime_ns файла при загрузке или последней записи
+        self.lock = threading.RLock()
+
+    def snapshot(self):
+        """Копия каналов для чтения без блокировки"""
+        with self.lock:
+            return {name: list(streams) for name, streams in self.channels.items()}
+
+
+class HostConcurrencyLimiter:
+    """Ограничивает число одновременных запросов к одному хосту"""
+
+    def __init__(self, max_per_host=2):
+        self.max_per_host = max_per_host
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _get_semaphore(self, host):
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.max_per_host)
+                self._semaphores[host] = semaphore
+            return semaphore
+
+    @contextmanager
+    def slot(self, url):
+        """Занимает слот хоста на время выполнения блока"""
+        semaphore = self._get_semaphore(urlparse(url).netloc.lower())
+        semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+def parse_retry_after(value):
+    """Секунды ожидания из заголовка Retry-After (число или HTTP-дата), None если не разобрать"""
+    if not value:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+class HostRateLimiter:
+    """Token bucket на каждый хост с экспоненциальной паузой после ошибок.
+
+    reserve() не блокирует: забирает токен и возвращает, сколько секунд
+    нужно подождать перед запросом. Так лимитер работает и из потоков,
+    и из asyncio. Запросы к разным хостам друг друга не ждут. Если ждать
+    пришлось бы дольше max_wait, токен не забирается и возвращается None.
+    """
+
+    def __init__(self, rate=5.0, burst=5, backoff_base=1.0, backoff_max=60.0):
+        self.rate = rate  # Запросов в секунду на хост
+        self.burst = burst
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._hosts = {}  # хост -> [токены, время обновления, пауза до, ошибок подряд]
+        self._lock = threading.Lock()
+
+    def _state(self, url, now):
+        host = urlparse(url).netloc.lower()
+        state = self._hosts.get(host)
+        if state is None:
+            state = [float(self.burst), now, 0.0, 0]
+            self._hosts[host] = state
+        return state
+
+    def reserve(self, url, max_wait=None):
+        """Забирает токен хоста и возвращает задержку перед запросом в секундах (None - отказ)"""
+        now = time.time()
+        with self._lock:
+            state = self._state(url, now)
+            state[0] = min(float(self.burst), state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+            tokens = state[0] - 1
+            delay = max(-tokens / self.rate if tokens < 0 else 0.0, state[2] - now)
+            if max_wait is not None and delay > max_wait:
+                return None
+            state[0] = tokens
+            return delay
+
+    def acquire(self, url, max_wait=None):
+        """Ждет своей очереди к хосту. False, если ждать пришлось бы дольше max_wait"""
+        delay = self.reserve(url, max_wait)
+        if delay is None:
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+    def success(self, url):
+        """Сбрасывает счетчик ошибок хоста"""
+        with self._lock:
+            self._state(url, time.time())[3] = 0
+
+    def failure(self, url, retry_after=None):
+        """Откладывает запросы к хосту: Retry-After или экспоненциальная пауза с jitter"""
+        now = time.time()
+        with self._lock:
+            state = self._state(url, now)
+            state[3] += 1
+            if retry_after is not None:
+                delay = retry_after
+            else:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (state[3] - 1))
+                delay *= random.uniform(0.5, 1.0)
+            state[2] = max(state[2], now + delay)
+            return delay
+
+
+class HostCircuitBreaker:
+    """Размыкатель для недоступных хостов (состояние сохраняется в SQLite).
+
+    После failure_threshold ошибок соединения подряд хост считается мертвым
+    на cooldown секунд: запросы к нему сразу завершаются неудачей. После
+    паузы цепь полуоткрыта: пропускается один пробный запрос, остальные
+    отклоняются, пока он не завершится. Успех замыкает цепь, ошибка снова
+    размыкает ее. Если о пробе не сообщили за probe_timeout секунд,
+    пропускается следующая.
+    """
+
+    def __init__(self, db_path, failure_threshold=3, cooldown=600, probe_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self.rejected = 0
+        self._hosts = {}  # хост -> [ошибок подряд, разомкнут до, проба начата]
+        self._lock = threading.Lock()
+
+        try:
+            os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️  Состояние хостов не сохраняется ({e})")
+            self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+
+        with self._lock:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS host_circuits ('
+                'host TEXT PRIMARY KEY, failures INTEGER NOT NULL, open_until REAL NOT NULL)'
+            )
+            # Хосты, пауза которых еще не закончилась с прошлого запуска
+            now = time.time()
+            self._conn.execute('DELETE FROM host_circuits WHERE open_until <= ?', (now,))
+            self._conn.commit()
+            for host, failures, open_until in self._conn.execute(
+                    'SELECT host, failures, open_until FROM host_circuits'):
+                self._hosts[host] = [failures, open_until, 0.0]
+
+    @staticmethod
+    def _host(url):
+        return urlparse(url).netloc.lower()
+
+    def allow(self, url):
+        """Можно ли обращаться к хосту сейчас (в полуоткрытом состоянии - только одной пробе)"""
+        now = time.time()
+        with self._lock:
+            state = self._hosts.get(self._host(url))
+            if state is None or not state[1]:
+                return True
+            if state[1] <= now and now - state[2] >= self.probe_timeout:
+                state[2] = now
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self, url):
+        """Хост ответил - замыкаем цепь"""
+        host = self._host(url)
+        with self._lock:
+            state = self._hosts.pop(host, None)
+            if state is not None and state[1]:
+                self._conn.execute('DELETE FROM host_circuits WHERE host = ?', (host,))
+                self._conn.commit()
+
+    def failure(self, url):
+        """Ошибка соединения с хостом. True, если цепь разомкнулась"""
+        host = self._host(url)
+        now = time.time()
+        with self._lock:
+            state = self._hosts.setdefault(host, [0, 0.0, 0.0])
+            state[0] += 1
+            if state[0] < self.failure_threshold or state[1] > now:
+                return False
+            state[1] = now + self.cooldown
+            state[2] = 0.0
+            self._conn.execute(
+                'INSERT OR REPLACE INTO host_circuits (host, failures, open_until) VALUES (?, ?, ?)',
+                (host, state[0], state[1])
+            )
+            self._conn.commit()
+            return True
+
+    def open_hosts(self):
+        """Хосты, к которым сейчас запросы не выполняются"""
+        now = time.time()
+        with self._lock:
+            return [host for host, state in self._hosts.items() if state[1] > now]
+
+    def clear(self):
+        """Сбрасывает состояние всех хостов"""
+        with self._lock:
+            self._hosts.clear()
+            self._conn.execute('DELETE FROM host_circuits')
+            self._conn.commit()
+
+
+def replacement_file_mode(path):
+    """Права для файла, который заменяется через mkstemp + os.replace: как у текущего или по umask"""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def percentile(values, fraction):
+    """Перцентиль списка чисел (0 для пустого списка)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class ScanMetrics:
+    """Потокобезопасные счетчики и гистограммы времени по этапам и хостам.
+
+    Этапы: fetch (загрузка источника), parse, match, head/get (HTTP запросы),
+    probe (ffprobe/ffmpeg), write (запись плейлиста). Гистограммы хранят
+    корзины для Prometheus и последние sample_size значений для перцентилей.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    STAGE_NAMES = {
+        'fetch': 'Загрузка источников', 'parse': 'Разбор плейлистов', 'match': 'Сопоставление',
+        'head': 'HEAD запросы', 'get': 'GET запросы', 'probe': 'FFmpeg', 'write': 'Запись плейлиста'
+    }
+
+    def __init__(self, sample_size=1000):
+        self.sample_size = sample_size
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}  # (этап, хост или '') -> [число, сумма, корзины, последние значения]
+
+    def inc(self, name, value=1):
+        """Увеличивает счетчик"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def observe(self, stage, seconds, url=None):
+        """Добавляет время этапа (и хоста, если передан url)"""
+        keys = [(stage, '')]
+        if url:
+            keys.append((stage, urlparse(url).netloc.lower()))
+        with self._lock:
+            for key in keys:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = [0, 0.0, [0] * len(self.BUCKETS), deque(maxlen=self.sample_size)]
+                    self._histograms[key] = histogram
+                histogram[0] += 1
+                histogram[1] += seconds
+                for i, bound in enumerate(self.BUCKETS):
+                    if seconds <= bound:
+                        histogram[2][i] += 1
+                histogram[3].append(seconds)
+
+    @contextmanager
+    def timer(self, stage, url=None):
+        """Замеряет время блока как этап stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, url)
+
+    def totals(self, stages):
+        """Суммарные (число, время) по списку этапов"""
+        with self._lock:
+            histograms = [self._histograms.get((stage, '')) for stage in stages]
+        return (sum(h[0] for h in histograms if h), sum(h[1] for h in histograms if h))
+
+    def snapshot(self):
+        """Счетчики и сводка по этапам/хостам: число, сумма, среднее, p50, p95"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (h[0], h[1], list(h[3])) for key, h in self._histograms.items()}
+
+        stages = {}
+        hosts = {}
+        for (stage, host), (count, total, samples) in sorted(histograms.items()):
+            summary = {
+                'count': count,
+                'sum': round(total, 4),
+                'avg': round(total / count, 4) if count else 0.0,
+                'p50': round(percentile(samples, 0.5), 4),
+                'p95': round(percentile(samples, 0.95), 4)
+            }
+            if host:
+                hosts.setdefault(stage, {})[host] = summary
+            else:
+                stages[stage] = summary
+        return {'counters': counters, 'stages': stages, 'hosts': hosts}
+
+    def to_prometheus(self, prefix='m3u_scanner'):
+        """Текстовый формат Prometheus (для node_exporter textfile collector)"""
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (h[0], h[1], list(h[2]))) for key, h in self._histograms.items())
+
+        lines = []
+        for name, value in counters:
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+
+        for metric, with_host in (('stage', False), ('host', True)):
+            name = f"{prefix}_{metric}_duration_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            for (stage, host), (count, total, buckets) in histograms:
+                if bool(host) != with_host:
+                    continue
+                labels = f'stage="{label(stage)}"' + (f',host="{label(host)}"' if host else '')
+                for bound, bucket_count in zip(self.BUCKETS, buckets):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {bucket_count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{{labels}}} {total:.6f}')
+                lines.append(f'{name}_count{{{labels}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Атомарно сохраняет метрики: .prom/.txt - Prometheus, иначе JSON"""
+        if path.endswith(('.prom', '.txt')):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+            # mkstemp создает файл с правами 0600 - экспортер под другим пользователем его не прочтет
+            os.chmod(tmp_path, replacement_file_mode(path))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class ProbeProcessManager:
+    """Запуск ffprobe/ffmpeg с общим ограничением числа процессов.
+
+    Лимит считается от числа ядер и доли CPU, которую можно отдать под
+    проверки (cpu_budget). Лишние запросы ждут в очереди, процесс убивается
+    по истечении таймаута. Для статистики хранятся глубина очереди и время
+    ожидания/выполнения последних проверок.
+    """
+
+    def __init__(self, max_processes=None, cpu_budget=0.75):
+        self.cpu_budget = cpu_budget
+        self.max_processes = max_processes or max(1, int((os.cpu_count() or 1) * cpu_budget))
+        self._semaphore = threading.BoundedSemaphore(self.max_processes)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.failures = 0
+        self._waits = deque(maxlen=1000)
+        self._latencies = deque(maxlen=1000)
+
+    def enqueue(self):
+        """Учитывает запрос, ожидающий свободного слота"""
+        with self._lock:
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+
+    def start(self, wait_time):
+        """Запрос получил слот после wait_time секунд ожидания"""
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self._waits.append(wait_time)
+
+    def finish(self, latency, outcome):
+        """Процесс завершен: outcome - 'ok', 'timeout' или 'error'"""
+        with self._lock:
+            self.running -= 1
+            self._latencies.append(latency)
+            if outcome == 'timeout':
+                self.timeouts += 1
+            elif outcome == 'error':
+                self.failures += 1
+            else:
+                self.completed += 1
+
+    def run(self, cmd, timeout, watcher=None, on_finish=None):
+        """Запускает процесс в пределах лимита: (код возврата, stdout, stderr).
+
+        watcher (FfmpegOutputWatcher) получает stderr частями по мере вывода;
+        если feed() вернул True, процесс останавливается досрочно, а при
+        watcher.failed запуск считается ошибкой. По истечении timeout процесс
+        убивается и выбрасывается subprocess.TimeoutExpired. on_finish получает
+        время выполнения без ожидания в очереди.
+        """
+        queued_at = time.time()
+        self.enqueue()
+        self._semaphore.acquire()
+        started_at = time.time()
+        self.start(started_at - queued_at)
+        outcome = 'error'
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=(os.name == 'posix')
+            )
+            if watcher is not None:
+                returncode, stdout, stderr, outcome = self.watch(process, timeout, watcher)
+                if outcome == 'timeout':
+                    raise subprocess.TimeoutExpired(cmd, timeout, stdout, stderr)
+                return returncode, stdout, stderr
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+                stdout = stdout.decode('utf-8', errors='ignore')
+                stderr = stderr.decode('utf-8', errors='ignore')
+            except subprocess.TimeoutExpired:
+                outcome = 'timeout'
+                self.kill(process)
+                process.communicate()
+                raise
+            except BaseException:
+                self.kill(process)
+                process.communicate()
+                raise
+            outcome = 'ok' if process.returncode == 0 else 'error'
+            return process.returncode, stdout, stderr
+        finally:
+            latency = time.time() - started_at
+            self.finish(latency, outcome)
+            self._semaphore.release()
+            if on_finish is not None:
+                on_finish(latency)
+
+    def watch(self, process, timeout, watcher):
+        """Читает stderr частями до конца или досрочной остановки: (код, stdout, stderr, исход)"""
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            self.kill(process)
+
+        stdout_parts = []
+        stdout_reader = threading.Thread(target=lambda: stdout_parts.append(process.stdout.read()), daemon=True)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        stdout_reader.start()
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+
+        stderr_parts = []
+        stopped = False
+        try:
+            # Читаем то, что уже есть в канале: прогресс ffmpeg идет через \r без перевода строки
+            while True:
+                chunk = process.stderr.read1(4096)
+                if not chunk:
+                    break
+                text = decoder.decode(chunk)
+                stderr_parts.append(text)
+                if watcher.feed(text):
+                    stopped = True
+                    self.kill(process)
+                    break
+        finally:
+            timer.cancel()
+            if stopped or expired.is_set():
+                self.kill(process)
+            process.wait()
+            stdout_reader.join()
+            process.stderr.close()
+
+        if expired.is_set() and not stopped:
+            outcome = 'timeout'
+        elif watcher.failed:
+            outcome = 'error'
+        else:
+            outcome = 'ok' if stopped or process.returncode == 0 else 'error'
+        stdout = b''.join(stdout_parts).decode('utf-8', errors='ignore')
+        return process.returncode, stdout, ''.join(stderr_parts), outcome
+
+    @staticmethod
+    def kill(process):
+        """Убивает процесс вместе с его дочерними процессами"""
+        try:
+            if os.name == 'posix':
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except (OSError, ProcessLookupError):
+            pass
+
+    def stats(self):
+        """Метрики: лимит, очередь, завершенные процессы и перцентили времени"""
+        with self._lock:
+            waits = list(self._waits)
+            latencies = list(self._latencies)
+            return {
+                'max_processes': self.max_processes,
+                'running': self.running,
+                'queued': self.queued,
+                'max_queue_depth': self.max_queue_depth,
+                'completed': self.completed,
+                'timeouts': self.timeouts,
+                'failures': self.failures,
+                'wait_p50': percentile(waits, 0.5),
+                'wait_p95': percentile(waits, 0.95),
+                'latency_p50': percentile(latencies, 0.5),
+                'latency_p95': percentile(latencies, 0.95),
+            }
+
+
+# Один вариант потока (для HLS - один из master плейлиста), битрейт в kbps
+ProbeVariant = namedtuple('ProbeVariant', [
+    'width', 'height', 'bitrate', 'video_codec', 'audio_codec', 'fps'
+])
+
+
+def parse_frame_rate(value):
+    """FPS из записи вида '25/1' или '29.97' (None, если не разобрать)"""
+    if not value:
+        return None
+    num, _, den = str(value).partition('/')
+    try:
+        fps = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return round(fps, 2) if fps > 0 else None
+
+
+def parse_bitrate(value):
+    """Битрейт в kbps из значения в бит/с (None, если не разобрать)"""
+    if value and str(value).isdigit() and int(value) > 0:
+        return int(value) // 1000
+    return None
+
+
+class ProbeResult:
+    """Результат анализа потока: варианты с разрешением, битрейтом и кодеками.
+
+    Строится из JSON ffprobe (-show_programs -show_streams -show_format),
+    из лога ffmpeg или из вариантов HLS плейлиста. to_quality_info() дает
+    словарь в привычном формате quality_info (лучший вариант + все варианты),
+    from_dict() восстанавливает результат из него или из кэша.
+    """
+
+    def __init__(self, variants, duration=None, source='ffprobe'):
+        self.variants = [variant for variant in variants if variant.width and variant.height]
+        self.duration = duration
+        self.source = source
+
+    def best(self):
+        """Лучший вариант: по разрешению, затем по битрейту"""
+        if not self.variants:
+            return None
+        return max(self.variants, key=lambda v: (v.width * v.height, v.bitrate or 0))
+
+    @classmethod
+    def from_ffprobe_json(cls, data):
+        """Разбирает JSON ffprobe; для HLS каждая программа - отдельный вариант"""
+        streams = data.get('streams') or []
+        fmt = data.get('format') or {}
+        programs = [program for program in data.get('programs') or [] if program.get('streams')]
+
+        groups = [(program.get('streams'), program.get('tags') or {}) for program in programs] or [(streams, {})]
+        variants = []
+        for group_streams, program_tags in groups:
+            video = next((st for st in group_streams if st.get('codec_type') == 'video' and st.get('width')), None)
+            if not video:
+                continue
+            audio = next((st for st in group_streams if st.get('codec_type') == 'audio'), None)
+
+            bitrate = None
+            for raw_bitrate in (video.get('bit_rate'), (video.get('tags') or {}).get('variant_bitrate'),
+                                program_tags.get('variant_bitrate'), None if programs else fmt.get('bit_rate')):
+                bitrate = parse_bitrate(raw_bitrate)
+                if bitrate:
+                    break
+
+            variant = ProbeVariant(
+                width=int(video['width']),
+                height=int(video['height']),
+                bitrate=bitrate,
+                video_codec=video.get('codec_name'),
+                audio_codec=audio.get('codec_name') if audio else None,
+                fps=parse_frame_rate(video.get('avg_frame_rate')) or parse_frame_rate(video.get('r_frame_rate'))
+            )
+            if variant not in variants:
+                variants.append(variant)
+
+        duration = None
+        try:
+            if fmt.get('duration'):
+                duration = int(float(fmt['duration']))
+        except ValueError:
+            pass
+        return cls(variants, duration, 'ffprobe')
+
+    @classmethod
+    def from_ffmpeg_log(cls, output):
+        """Разбирает заголовок потоков в логе ffmpeg построчно (каждая программа - вариант)"""
+        groups = [{'bitrate': None, 'video': None, 'audio': None}]
+        duration = None
+        container_bitrate = None
+
+        for line in output.splitlines():
+            line = line.strip()
+            if line.startswith('Output #'):
+                break
+            if line.startswith('Program '):
+                if groups[-1]['video'] or groups[-1]['bitrate']:
+                    groups.append({'bitrate': None, 'video': None, 'audio': None})
+            elif line.startswith('variant_bitrate'):
+                groups[-1]['bitrate'] = parse_bitrate(line.partition(':')[2].strip())
+            elif line.startswith('Duration:'):
+                match = re.match(r'Duration:\s*(\d{2}):(\d{2}):(\d{2})', line)
+                if match:
+                    hours, minutes, seconds = map(int, match.groups())
+                    duration = hours * 3600 + minutes * 60 + seconds
+                match = re.search(r'bitrate:\s*(\d+)\s*kb/s', line)
+                if match:
+                    container_bitrate = int(match.group(1))
+            elif line.startswith('Stream #') and 'Video:' in line and not groups[-1]['video']:
+                groups[-1]['video'] = line.split('Video:', 1)[1]
+            elif line.startswith('Stream #') and 'Audio:' in line and not groups[-1]['audio']:
+                groups[-1]['audio'] = line.split('Audio:', 1)[1]
+
+        variants = []
+        for group in groups:
+            video = group['video']
+            if not video:
+                continue
+            resolution = re.search(r'\b(\d{2,5})x(\d{2,5})\b', video)
+            if not resolution:
+                continue
+            fps = re.search(r'(\d+(?:\.\d+)?)\s*fps', video) or re.search(r'(\d+(?:\.\d+)?)\s*tbr', video)
+            stream_bitrate = re.search(r'(\d+)\s*kb/s', video)
+            bitrate = group['bitrate'] or (int(stream_bitrate.group(1)) if stream_bitrate else None)
+            if bitrate is None and len(groups) == 1:
+                bitrate = container_bitrate
+            variants.append(ProbeVariant(
+                width=int(resolution.group(1)),
+                height=int(resolution.group(2)),
+                bitrate=bitrate,
+                video_codec=video.split()[0].strip(',') if video.split() else None,
+                audio_codec=group['audio'].split()[0].strip(',') if group['audio'] and group['audio'].split() else None,
+                fps=float(fps.group(1)) if fps else None
+            ))
+        return cls(variants, duration, 'ffmpeg')
+
+    @classmethod
+    def from_hls_variants(cls, hls_variants):
+        """Строит результат из атрибутов #EXT-X-STREAM-INF (см. parse_hls_playlist)"""
+        codec_names = {
+            'avc1': 'h264', 'avc3': 'h264', 'hvc1': 'hevc', 'hev1': 'hevc',
+            'vp09': 'vp9', 'av01': 'av1', 'mp4a': 'aac', 'ac-3': 'ac3', 'ec-3': 'eac3', 'opus': 'opus'
+        }
+        variants = []
+        for hls_variant in hls_variants:
+            video_codec = None
+            audio_codec = None
+            for codec in hls_variant['codecs'].split(','):
+                name = codec_names.get(codec.strip().lower().split('.')[0])
+                if name in ('aac', 'ac3', 'eac3', 'opus'):
+                    audio_codec = audio_codec or name
+                elif name:
+                    video_codec = video_codec or name
+            variants.append(ProbeVariant(
+                width=hls_variant['width'],
+                height=hls_variant['height'],
+                bitrate=hls_variant['bandwidth'] // 1000 if hls_variant['bandwidth'] else None,
+                video_codec=video_codec,
+                audio_codec=audio_codec,
+                fps=hls_variant['fps']
+            ))
+        return cls(variants, None, 'hls')
+
+    def to_dict(self):
+        """Компактное представление для кэша и JSON"""
+        return {
+            'source': self.source,
+            'duration': self.duration,
+            'variants': [list(variant) for variant in self.variants]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Восстанавливает результат из to_dict() или quality_info"""
+        return cls(
+            [ProbeVariant(*variant) for variant in data.get('variants') or []],
+            data.get('duration'),
+            data.get('source', 'ffprobe')
+        )
+
+    def to_quality_info(self):
+        """quality_info по лучшему варианту (None, если видео не найдено)"""
+        best = self.best()
+        if best is None:
+            return None
+        quality_info = {
+            'resolution': f"{best.width}x{best.height}",
+            'resolution_width': best.width,
+            'resolution_height': best.height,
+            'pixels': best.width * best.height,
+            'bitrate': best.bitrate,
+            'video_codec': best.video_codec,
+            'audio_codec': best.audio_codec,
+            'fps': best.fps,
+            'streams': [],
+            'variant_count': len(self.variants),
+        }
+        if self.duration is not None:
+            quality_info['duration_seconds'] = self.duration
+        quality_info.update(self.to_dict())
+        return quality_info
+
+
+class FfmpegOutputWatcher:
+    """Следит за выводом ffmpeg и решает, когда проверку можно остановить.
+
+    Вывод подается частями (feed). Проверка завершена, когда в заголовке
+    потока появились кодек, разрешение и FPS и (если нужно) декодирован
+    первый кадр; провалена - если до появления видео пришла фатальная ошибка.
+    """
+
+    FATAL_MARKERS = (
+        'Server returned 4', 'Server returned 5', 'Connection refused', 'Connection timed out',
+        'Invalid data found when processing input', 'Failed to resolve hostname',
+        'No such file or directory', 'Input/output error'
+    )
+
+    def __init__(self, wait_first_frame=True):
+        self.wait_first_frame = wait_first_frame
+        self.output = []
+        self.has_video = False
+        self.has_fps = False
+        self.frame_started = False
+        self.complete = False
+        self.failed = False
+        self._tail = ''
+
+    def feed(self, text):
+        """Принимает очередную часть stderr. True - процесс можно останавливать"""
+        self.output.append(text)
+        lines = re.split(r'[\r\n]', self._tail + text)
+        self._tail = lines.pop()
+        for line in lines:
+            self.check_line(line)
+        return self.complete or self.failed
+
+    def check_line(self, line):
+        """Разбирает одну строку вывода ffmpeg"""
+        if 'Video:' in line and re.search(r'\d{2,5}x\d{2,5}', line):
+            self.has_video = True
+            self.has_fps = self.has_fps or bool(re.search(r'(\d+(?:\.\d+)?)\s*(fps|tbr)', line))
+        elif not self.has_video and any(marker in line for marker in self.FATAL_MARKERS):
+            self.failed = True
+        elif re.match(r'\s*frame=\s*[1-9]', line):
+            self.frame_started = True
+
+        if self.has_video and self.has_fps and (self.frame_started or not self.wait_first_frame):
+            self.complete = True
+
+    def text(self):
+        """Весь полученный вывод"""
+        return ''.join(self.output)
+
+
+# Компактная запись канала из плейлиста
+PlaylistEntry = namedtuple('PlaylistEntry', [
+    'name', 'url', 'group', 'tvg_id', 'tvg_logo', 'quality_score', 'stability_score'
+])
+
+
+def normalize_title(title):
+    """Нормализует название канала для сравнения"""
+    title = title.lower().strip()
+    title = re.sub(r'[^\w\s]', ' ', title)
+    return re.sub(r'\s+', ' ', title).strip()
+
+
+def drop_query_params(*names):
+    """Правило эквивалентности: параметры names (одноразовые токены хоста) не различаются"""
+    names = {name.lower() for name in names}
+
+    def rule(host, path, query):
+        return host, path, [(key, value) for key, value in query if key.lower() not in names]
+    return rule
+
+
+def github_equivalence(host, path, query):
+    """github.com/.../blob/... и raw.githubusercontent.com/... - один файл"""
+    if host == 'github.com' and '/blob/' in path:
+        return 'raw.githubusercontent.com', path.replace('/blob/', '/', 1), query
+    return host, path, query
+
+
+def youtube_equivalence(host, path, query):
+    """youtu.be/<id> и youtube.com/watch?v=<id> - одно видео"""
+    if host == 'youtu.be' and path.strip('/'):
+        return 'youtube.com', '/watch', [('v', path.strip('/'))]
+    if host in ('youtube.com', 'm.youtube.com') and path == '/watch':
+        return 'youtube.com', path, [(key, value) for key, value in query if key == 'v']
+    return host, path, query
+
+
+# Правила эквивалентности по хостам: (хост, функция(хост, путь, параметры) -> то же).
+# Токены в запросе и разные имена HLS плейлиста считаются одним потоком только
+# здесь - для хостов, про которые это известно; на других они выбирают поток.
+URL_EQUIVALENCE_RULES = [
+    ('github.com', github_equivalence),
+    ('raw.githubusercontent.com', drop_query_params('token')),
+    ('youtu.be', youtube_equivalence),
+    ('youtube.com', youtube_equivalence),
+    ('m.youtube.com', youtube_equivalence),
+]
+
+
+def canonical_stream_url(url):
+    """Канонический ключ ссылки на поток для поиска дубликатов.
+
+    Не различаются только регистр хоста, www. и порт по умолчанию; схема,
+    путь и запрос сохраняются. Остальное - правила URL_EQUIVALENCE_RULES.
+    """
+    try:
+        parsed = urlparse(url.strip())
+        port = parsed.port
+    except ValueError:
+        return url
+    scheme = parsed.scheme.lower()
+    if scheme not in ('http', 'https') or not parsed.hostname:
+        return url
+
+    host = parsed.hostname.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    path = parsed.path or '/'
+    query = parsed.query
+
+    for rule_host, rule in URL_EQUIVALENCE_RULES:
+        if host == rule_host:
+            host, path, pairs = rule(host, path, parse_qsl(query, keep_blank_values=True))
+            query = urlencode(pairs)
+
+    if port and port != {'http': 80, 'https': 443}[scheme]:
+        host = f"{host}:{port}"
+    canonical = f"{scheme}://{host}{path}"
+    if query:
+        canonical += '?' + query
+    return canonical
+
+
+class CandidateSet:
+    """Найденные потоки без дубликатов по каноническому URL.
+
+    Для повторной ссылки на тот же поток остается вариант с лучшей
+    стабильностью/качеством, а недостающие поля (группа, tvg-id, логотип)
+    дополняются из другого варианта.
+    """
+
+    MERGED_FIELDS = ('group', 'tvg_id', 'tvg_logo', 'video_info')
+
     def __init__(self):
+        self._streams = OrderedDict()  # канонический URL -> поток
+        self.duplicates = 0
+
+    @staticmethod
+    def rank(stream):
+        return stream.get('stability_score', 0), stream.get('quality_score', 0)
+
+    def add(self, stream):
+        """Добавляет поток; False, если такой поток уже есть"""
+        url = stream.get('url', '')
+        if not url:
+            return False
+        key = canonical_stream_url(url)
+        existing = self._streams.get(key)
+        if existing is None:
+            self._streams[key] = stream
+            return True
+
+        self.duplicates += 1
+        best, other = (stream, existing) if self.rank(stream) > self.rank(existing) else (existing, stream)
+        for field in self.MERGED_FIELDS:
+            if not best.get(field) and other.get(field):
+                best[field] = other[field]
+        self._streams[key] = best
+        return False
+
+    def extend(self, streams):
+        """Добавляет потоки, возвращает число новых"""
+        return sum(1 for stream in streams if self.add(stream))
+
+    def __contains__(self, url):
+        return canonical_stream_url(url) in self._streams
+
+    def __len__(self):
+        return len(self._streams)
+
+    def streams(self):
+        """Потоки в порядке первого появления"""
+        return list(self._streams.values())
+
+
+class VerificationMemo:
+    """Результаты проверки потоков за один запуск по каноническому URL.
+
+    Один и тот же поток часто находится для нескольких каналов: он
+    проверяется один раз, а параллельные запросы той же ссылки ждут
+    уже идущую проверку вместо запуска своей.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}  # канонический URL -> Future с полями проверки
+        self.hits = 0
+        self.coalesced = 0
+
+    def get_or_run(self, url, check):
+        """Возвращает результат проверки url, вызывая check() не более одного раза"""
+        key = canonical_stream_url(url)
+        with self._lock:
+            future = self._results.get(key)
+            if future is None:
+                future = self._results[key] = concurrent.futures.Future()
+                owner = True
+            else:
+                owner = False
+                if future.done():
+                    self.hits += 1
+                else:
+                    self.coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = check()
+        except BaseException as e:
+            # Неудачную проверку можно повторить позже
+            with self._lock:
+                self._results.pop(key, None)
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def clear(self):
+        """Начинает новый запуск"""
+        with self._lock:
+            self._results = {}
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for future in self._results.values() if future.done())
+
+
+class ChannelMatcher:
+    """Скомпилированное условие поиска канала для набора паттернов.
+
+    Повторяет логику exact_match/fuzzy_match: все варианты паттернов
+    раскрываются заранее и объединяются в одно регулярное выражение.
+    Название канала передается уже нормализованным (normalize_title).
+    """
+
+    def __init__(self, search_patterns):
+        single = set()  # Достаточно одной подстроки
+        multi = set()  # Нужны все подстроки
+        self.always = False
+
+        search_name = search_patterns[0].lower().strip() if search_patterns else ""
+        if len(search_name.split()) == 1:
+            single.add(search_name)
+
+        for pattern in search_patterns:
+            pattern = pattern.lower().strip()
+            words = tuple(pattern.split())
+            if not words:
+                # Пустой паттерн совпадает с любым названием
+                self.always = True
+            elif len(words) == 1:
+                single.add(words[0])
+            else:
+                multi.add(words)
+
+            # Варианты нечеткого сравнения (fuzzy_match)
+            if len(pattern) < 4:
+                if pattern:
+                    single.add(pattern)
+            else:
+                for variant in (
+                    pattern,
+                    pattern.replace(' ', ''),
+                    pattern.replace(' ', '.'),
+                    pattern.replace(' ', '-'),
+                    pattern.replace('тв', 'tv'),
+                    pattern.replace('tv', 'тв'),
+                ):
+                    if len(variant) > 2:
+                        single.add(variant)
+
+        # Убираем варианты, которые следуют из более коротких
+        self.literals = sorted(
+            (lit for lit in single if not any(other != lit and other in lit for other in single)),
+            key=len, reverse=True
+        )
+        self.clauses = [
+            words for words in multi
+            if not any(lit in word for word in words for lit in self.literals)
+        ]
+        self.regex = re.compile('|'.join(re.escape(lit) for lit in self.literals)) if self.literals else None
+
+    def matches(self, title):
+        """Проверяет нормализованное название канала"""
+        if self.always:
+            return True
+        if self.regex is not None and self.regex.search(title):
+            return True
+        return any(all(word in title for word in words) for words in self.clauses)
+
+    def index_keys(self):
+        """Слова для поиска кандидатов в PlaylistIndex или None, если нужен полный просмотр"""
+        if self.always:
+            return None
+        keys = set()
+        for required in [[lit] for lit in self.literals] + [list(words) for words in self.clauses]:
+            fragments = [fragment for part in required for fragment in re.findall(r'\w+', part)]
+            if not fragments:
+                return None
+            keys.add(max(fragments, key=len))
+        return keys
+
+
+class AhoCorasick:
+    """Автомат Ахо-Корасик: все подстроки из набора за один проход по тексту"""
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for word_id, word in enumerate(words):
+            state = 0
+            for char in word:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append(word_id)
+
+        # Суффиксные ссылки строятся обходом в ширину
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def search(self, text):
+        """Номера слов, встречающихся в тексте"""
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+class BatchChannelMatcher:
+    """Набор ChannelMatcher для многих каналов сразу.
+
+    Подстроки всех запросов собираются в один автомат, поэтому каждое
+    название из плейлиста просматривается один раз для всего списка каналов.
+    """
+
+    def __init__(self, matchers):
+        self.matchers = matchers  # запрос -> ChannelMatcher
+        self.always = set()
+        words = {}
+        self.literal_owners = []  # Совпадение подстроки окончательное
+        self.clause_owners = []  # Нужна проверка всех слов условия
+
+        def word_id(word):
+            if word not in words:
+                words[word] = len(words)
+                self.literal_owners.append(set())
+                self.clause_owners.append(set())
+            return words[word]
+
+        for query, matcher in matchers.items():
+            if matcher.always or '' in matcher.literals:
+                self.always.add(query)
+                continue
+            for literal in matcher.literals:
+                self.literal_owners[word_id(literal)].add(query)
+            for clause in matcher.clauses:
+                # Самое длинное слово условия - необходимый признак совпадения
+                self.clause_owners[word_id(max(clause, key=len))].add(query)
+
+        self.automaton = AhoCorasick(list(words))
+
+    def match(self, title):
+        """Запросы, которым соответствует нормализованное название"""
+        matched = set(self.always)
+        to_verify = set()
+        for found_id in self.automaton.search(title):
+            matched.update(self.literal_owners[found_id])
+            to_verify.update(self.clause_owners[found_id])
+        for query in to_verify - matched:
+            if self.matchers[query].matches(title):
+                matched.add(query)
+        return matched
+
+
+class PlaylistIndex:
+    """Разобранный плейлист с инвертированным индексом по словам названий"""
+
+    # Версия формата сохраненных записей: увеличивается при изменении разбора
+    FORMAT_VERSION = 1
+
+    def __init__(self):
+        self.entries = []
+        self.titles = []  # Нормализованные названия
+        self.token_index = {}  # слово -> номера записей
+        self.batch_matches = {}  # запрос -> номера записей (пакетный поиск)
+        self.size_bytes = 0
+        self._probe_cache = {}
+        self._lock = threading.Lock()
+
+    def add(self, entry):
+        """Добавляет запись в индекс"""
+        entry_id = len(self.entries)
+        title = normalize_title(entry.name)
+        self.entries.append(entry)
+        self.titles.append(title)
+        for token in set(title.split()):
+            self.token_index.setdefault(token, []).append(entry_id)
+        self.size_bytes += len(entry.name) + len(entry.url) + len(entry.group) + len(title) + 200
+
+    def probe(self, key):
+        """Номера записей, в названии которых есть слово, содержащее key"""
+        with self._lock:
+            cached = self._probe_cache.get(key)
+        if cached is not None:
+            return cached
+
+        ids = set(self.token_index.get(key, ()))
+        for token, token_ids in self.token_index.items():
+            if key in token:
+                ids.update(token_ids)
+        ids = frozenset(ids)
+
+        with self._lock:
+            self._probe_cache[key] = ids
+        return ids
+
+    def candidates(self, keys):
+        """Записи-кандидаты для набора ключей (по возрастанию номера)"""
+        if keys is None:
+            return range(len(self.entries))
+        ids = set()
+        for key in keys:
+            ids.update(self.probe(key))
+        return sorted(ids)
+
+    def route_batch(self, batch):
+        """Один проход по плейлисту: каждая запись раздается всем подходящим запросам"""
+        routed = {query: [] for query in batch.matchers}
+        for entry_id, title in enumerate(self.titles):
+            for query in batch.match(title):
+                routed[query].append(entry_id)
+        with self._lock:
+            self.batch_matches.update(routed)
+
+    @classmethod
+    def from_entries(cls, data):
+        """Восстанавливает индекс из сохраненных записей (to_entries), ValueError при другом формате"""
+        if (not isinstance(data, dict) or data.get('version') != cls.FORMAT_VERSION
+                or data.get('fields') != list(PlaylistEntry._fields)):
+            raise ValueError('playlist index format mismatch')
+        index = cls()
+        for row in data['entries']:
+            index.add(PlaylistEntry(*row))
+        return index
+
+    def to_entries(self):
+        """Записи плейлиста в виде, пригодном для JSON, вместе с версией формата"""
+        return {
+            'version': self.FORMAT_VERSION,
+            'fields': list(PlaylistEntry._fields),
+            'entries': [list(entry) for entry in self.entries],
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class OnlineM3UScanner:
+    # Поля результата проверки, которые сохраняются в кэше
+    CHECK_RESULT_FIELDS = ('working', 'status', 'quality', 'stable', 'quality_score', 'video_info')
+
+    REQUEST_HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+        'Accept': '*/*',
+        'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8',
+    }
+
+    def __init__(self, cache_dir="cache", files_dir="files"):
         self.timeout = 15
         self.playlist_file = "playlist/playlist.m3u"
-        self.sites_file = "files/site.txt"
-        self.cartolog_file = "files/cartolog.txt"
-        self.channels_file = "files/Channels.txt"
-        self.max_workers = 3
+        self.playlist_flush_interval = 30  # Секунд между сохранениями при пакетной работе
+        self.playlist_model = None
+        self._playlist_model_guard = threading.Lock()
+        self.sites_file = os.path.join(files_dir, "site.txt")
+        self.cartolog_file = os.path.join(files_dir, "cartolog.txt")
+        self.channels_file = os.path.join(files_dir, "Channels.txt")
+        self.max_workers = 3  # Параллельных проверок потоков
+        self.channel_workers = 4  # Параллельно обрабатываемых каналов
+        self.max_streams_per_host = 2  # Одновременных проверок на один хост
         self.max_sites_per_search = 20
         self.max_retries = 3
+        self.http_pool_connections = 32  # Хостов в пуле соединений
+        self.http_pool_maxsize = 8  # Соединений на один хост
 
         # Настройки расширенной проверки качества
         self.enable_deep_check = True  # Включить глубокую проверку
@@ -32,6 +1801,15 @@ class OnlineM3UScanner:
         self.min_video_resolution = 480  # Минимальное разрешение (pixels)
         self.required_fps = 25  # Минимальный FPS
         self.check_timeout = 30  # Таймаут проверки
+        self.probe_analyze_duration = 3  # Секунд анализа потока в ffprobe
+        # Лимит процессов ffprobe/ffmpeg; при изменении этих настроек менеджер пересоздается
+        self._probe_cpu_budget = 0.75  # Доля ядер под процессы ffprobe/ffmpeg
+        self._max_probe_processes = None  # None - считать от числа ядер
+        self.rebuild_probe_manager()
+        self.probe_early_exit = True  # Останавливать ffmpeg, как только параметры потока известны
+        self.probe_wait_first_frame = True  # ...и декодирован первый кадр
+        self.hls_manifest_max_bytes = 512 * 1024  # Предел размера HLS плейлиста
+        self.hls_segment_probe_bytes = 2048  # Сколько байт сегмента запрашивать (Range)
 
         # Настройки анализа качества
         self.quality_weights = {
@@ -41,9 +1819,75 @@ class OnlineM3UScanner:
             'fps': 0.15
         }
 
-        # Кэш результатов проверки
-        self.quality_cache = {}
+        # Кэш результатов проверки (сохраняется между запусками)
+        self.cache_dir = cache_dir
+        self.quality_cache_positive_ttl = 6 * 3600  # Рабочие потоки, секунд
+        self.quality_cache_negative_ttl = 30 * 60  # Нерабочие потоки, секунд
+        self.quality_cache_max_entries = 20000
+        self.quality_cache = StreamCheckCache(
+            os.path.join(self.cache_dir, 'stream_checks.db'),
+            positive_ttl=self.quality_cache_positive_ttl,
+            negative_ttl=self.quality_cache_negative_ttl,
+            max_entries=self.quality_cache_max_entries
+        )
+
+        # Проверки потоков в рамках текущего запуска (один поток - одна проверка)
+        self.verification_memo = VerificationMemo()
+
+        # Валидаторы источников для условных запросов (ETag / Last-Modified)
+        self.source_validators = SourceValidatorStore(
+            os.path.join(self.cache_dir, 'sources.db'),
+            os.path.join(self.cache_dir, 'sources')
+        )
+
+        # HTTP клиент с пулом соединений
+        self.http = HttpClient(
+            self.REQUEST_HEADERS,
+            pool_connections=self.http_pool_connections,
+            pool_maxsize=self.http_pool_maxsize
+        )
+
+        # Ограничение параллельных запросов к одному хосту
+        self.host_limiter = HostConcurrencyLimiter(self.max_streams_per_host)
+
+        # Недоступные хосты пропускаются на время паузы (и между запусками)
+        self.circuit_failure_threshold = 3  # Ошибок соединения подряд
+        self.circuit_cooldown = 600  # Секунд
+        self.circuit_breaker = HostCircuitBreaker(
+            os.path.join(self.cache_dir, 'hosts.db'),
+            failure_threshold=self.circuit_failure_threshold,
+            cooldown=self.circuit_cooldown
+        )
+
+        # Частота запросов к одному хосту и паузы после ошибок
+        self.host_request_rate = 5.0  # Запросов в секунду на хост
+        self.host_request_burst = 5
+        self.backoff_max = 60  # Максимальная пауза хоста (секунд)
+        self.host_max_wait = 5  # Дольше очереди к хосту поток не ждет - запрос пропускается
+        self.rate_limiter = HostRateLimiter(
+            rate=self.host_request_rate,
+            burst=self.host_request_burst,
+            backoff_max=self.backoff_max
+        )
+
+        # Кэш скачанных плейлистов на время запуска
+        self.playlist_cache_max_mb = 256
+        self.playlist_cache_ttl = 3600  # Секунд
+        self.playlist_cache = PlaylistCache(
+            max_bytes=self.playlist_cache_max_mb * 1024 * 1024,
+            ttl=self.playlist_cache_ttl
+        )
+        self._source_locks = {}
+        self._source_locks_guard = threading.Lock()
+        self._matcher_cache = OrderedDict()
+        self._matcher_lock = threading.Lock()
+        # Разобранные плейлисты (индексы) по URL
+        self.playlist_index_cache = PlaylistCache(
+            max_bytes=self.playlist_cache_max_mb * 1024 * 1024,
+            ttl=self.playlist_cache_ttl
+        )
         self.ffmpeg_path = None
+        self.ffprobe_path = None
 
         # Автоматически добавляем ffmpeg в PATH
         self.setup_ffmpeg_path()
@@ -56,16 +1900,85 @@ class OnlineM3UScanner:
         # Кэш для хранения найденных каналов
         self.channels_cache = {}
 
-        # Статистика
-        self.stats = {
-            'total_requests': 0,
-            'successful_requests': 0,
-            'failed_requests': 0,
-            'avg_response_time': 0,
-            'quality_checks': 0,
-            'failed_quality_checks': 0
+        # Статистика: счетчики и время по этапам/хостам (из любых потоков)
+        self.metrics = ScanMetrics()
+        self.metrics_file = None  # Куда сохранять метрики после запуска (.prom или .json)
+
+        # Получатель событий выполнения: callback(событие, поля) - для CLI
+        self.progress_callback = None
+
+        # Счетчики текущего пакетного запуска (итог при прерывании) и флаг Ctrl-C
+        self.run_counters = {}
+        self.interrupted = threading.Event()
+
+    @property
+    def probe_cpu_budget(self):
+        """Доля ядер под процессы ffprobe/ffmpeg (если max_probe_processes не задан)"""
+        return self._probe_cpu_budget
+
+    @probe_cpu_budget.setter
+    def probe_cpu_budget(self, value):
+        self._probe_cpu_budget = value
+        self.rebuild_probe_manager()
+
+    @property
+    def max_probe_processes(self):
+        """Лимит одновременных процессов ffprobe/ffmpeg (None - считать от числа ядер)"""
+        return self._max_probe_processes
+
+    @max_probe_processes.setter
+    def max_probe_processes(self, value):
+        self._max_probe_processes = value
+        self.rebuild_probe_manager()
+
+    def rebuild_probe_manager(self):
+        """Создает ProbeProcessManager по текущим настройкам (идущие проверки доработают в старом)"""
+        self.probe_manager = ProbeProcessManager(self._max_probe_processes, self._probe_cpu_budget)
+
+    @property
+    def stats(self):
+        """Сводные счетчики запросов и проверок качества (изменяются через self.metrics)"""
+        count, total = self.metrics.totals(('head', 'get'))
+        return {
+            'total_requests': self.metrics.counter('total_requests'),
+            'successful_requests': self.metrics.counter('successful_requests'),
+            'failed_requests': self.metrics.counter('failed_requests'),
+            'avg_response_time': total / count if count else 0,
+            'quality_checks': self.metrics.counter('quality_checks'),
+            'failed_quality_checks': self.metrics.counter('failed_quality_checks')
         }
 
+    def export_metrics(self):
+        """Сохраняет метрики в metrics_file, если он задан"""
+        if not self.metrics_file:
+            return
+        try:
+            self.metrics.write(self.metrics_file)
+            print(f"📈 Метрики сохранены: {self.metrics_file}")
+        except OSError as e:
+            print(f"⚠️  Не удалось сохранить метрики: {e}")
+
+    def print_metrics(self, top_hosts=5):
+        """Выводит время по этапам и хосты, на которые ушло больше всего времени"""
+        snapshot = self.metrics.snapshot()
+        if not snapshot['stages']:
+            return
+        print("   ⏱️  Этапы (вызовов, всего, p50/p95):")
+        for stage, summary in snapshot['stages'].items():
+            print(f"      {ScanMetrics.STAGE_NAMES.get(stage, stage)}: {summary['count']}, "
+                  f"{summary['sum']:.1f}с, {summary['p50']:.3f}/{summary['p95']:.3f}с")
+
+        # fetch включает свой GET, поэтому хосты считаются только по запросам и FFmpeg
+        host_totals = {}
+        for stage in ('head', 'get', 'probe'):
+            for host, summary in snapshot['hosts'].get(stage, {}).items():
+                count, total = host_totals.get(host, (0, 0.0))
+                host_totals[host] = (count + summary['count'], total + summary['sum'])
+        if host_totals:
+            print("   🐢 Самые медленные хосты (запросов и проверок, всего):")
+            for host, (count, total) in sorted(host_totals.items(), key=lambda item: -item[1][1])[:top_hosts]:
+                print(f"      {host}: {count}, {total:.1f}с")
+
     def setup_ffmpeg_path(self):
         """Автоматически добавляет ffmpeg в PATH если он есть в папке проекта"""
         ffmpeg_paths = [
@@ -77,6 +1990,7 @@ class OnlineM3UScanner:
             if os.path.exists(path):
                 os.environ['PATH'] = path + os.pathsep + os.environ['PATH']
                 self.ffmpeg_path = self.find_ffmpeg()
+                self.ffprobe_path = self.find_ffprobe()
                 print(f"✅ FFmpeg добавлен в PATH: {path}")
                 return
         print("ℹ️  FFmpeg не найден в папке проекта")
@@ -101,6 +2015,30 @@ class OnlineM3UScanner:
         print("❌ FFmpeg не найден")
         return None
 
+    def find_ffprobe(self):
+        """Ищет ffprobe рядом с ffmpeg и в стандартных местах"""
+        possible_paths = []
+        if self.ffmpeg_path and os.path.dirname(self.ffmpeg_path):
+            ffmpeg_dir, ffmpeg_name = os.path.split(self.ffmpeg_path)
+            possible_paths.append(os.path.join(ffmpeg_dir, ffmpeg_name.replace('ffmpeg', 'ffprobe')))
+        possible_paths.extend([
+            "./ffmpeg/bin/ffprobe.exe",
+            "./ffmpeg-2025-11-17-git-e94439e49b-full_build/bin/ffprobe.exe",
+            "./ffprobe.exe",
+            "ffprobe"
+        ])
+
+        for path in possible_paths:
+            try:
+                result = subprocess.run([path, '-version'], capture_output=True, timeout=5)
+                if result.returncode == 0:
+                    print(f"✅ FFprobe найден: {path}")
+                    return path
+            except:
+                continue
+        print("ℹ️  FFprobe не найден - анализ через FFmpeg")
+        return None
+
     def load_custom_sites(self):
         """Загружает список сайтов из files/site.txt"""
         sites = []
@@ -233,185 +2171,190 @@ class OnlineM3UScanner:
         """Определяет категорию для канала из cartolog.txt"""
         return self.get_channel_category_improved(channel_name)
 
-    def make_request(self, url, method='GET', max_retries=None):
-        """HTTP запрос с повторными попытками"""
+    def make_request(self, url, method='GET', max_retries=None, headers=None):
+        """HTTP запрос с повторными попытками (соединения берутся из пула).
+
+        Возвращает HttpResponse, который вызывающий код должен закрыть.
+        """
         if max_retries is None:
             max_retries = self.max_retries
 
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': '*/*',
-            'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8',
-        }
-
         for attempt in range(max_retries):
-            self.stats['total_requests'] += 1
-            start_time = time.time()
+            # Хост недоступен или на паузе (backoff, Retry-After) - не блокируем поток и слот хоста
+            if not self.circuit_breaker.allow(url) or not self.rate_limiter.acquire(url, max_wait=self.host_max_wait):
+                self.metrics.inc('failed_requests')
+                return None
 
-            try:
-                if method.upper() == 'HEAD':
-                    req = urllib.request.Request(url, headers=headers, method='HEAD')
-                else:
-                    req = urllib.request.Request(url, headers=headers)
+            self.metrics.inc('total_requests')
 
+            try:
                 current_timeout = min(self.timeout * (attempt + 1), 30)
-                response = urllib.request.urlopen(req, timeout=current_timeout)
-                response_time = time.time() - start_time
-
-                self.stats['successful_requests'] += 1
-                self.stats['avg_response_time'] = (
-                                                          self.stats['avg_response_time'] * (self.stats['successful_requests'] - 1) + response_time
-                                                  ) / self.stats['successful_requests']
-
+                with self.metrics.timer('head' if method == 'HEAD' else 'get', url):
+                    response = self.http.request(url, method, timeout=current_timeout, headers=headers)
+                self.circuit_breaker.success(url)
+                status = response.getcode()
+                if status >= 400:
+                    response.close()
+                    # 404, 403 и т.п. относятся к ссылке, а не к хосту: без паузы и без повтора
+                    if status < 500 and status != 429:
+                        self.metrics.inc('failed_requests')
+                        return None
+                    retry_after = None
+                    if status in (429, 503):
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    self.rate_limiter.failure(url, retry_after)
+                    if attempt == max_retries - 1:
+                        self.metrics.inc('failed_requests')
+                        return None
+                    continue
+                self.rate_limiter.success(url)
+                self.metrics.inc('successful_requests')
                 return response
 
             except Exception as e:
+                # Ошибка соединения или таймаут - пауза для хоста перед повтором
+                self.rate_limiter.failure(url)
+                if self.circuit_breaker.failure(url):
+                    print(f"    🔌 Хост недоступен, пропускаем на {self.circuit_cooldown // 60} мин: {urlparse(url).netloc}")
                 if attempt == max_retries - 1:
-                    self.stats['failed_requests'] += 1
+                    self.metrics.inc('failed_requests')
                     return None
-                time.sleep(1)
 
         return None
 
     def analyze_stream_quality(self, url):
-        """Анализ качества видео потока с помощью FFmpeg"""
-        self.stats['quality_checks'] += 1
+        """Анализ качества видео потока с помощью FFprobe/FFmpeg"""
+        alive, quality_info = self.probe_and_analyze(url)
+        return quality_info
 
-        if not self.ffmpeg_path:
+    def probe_and_analyze(self, url):
+        """Одна проверка потока: (поток жив, информация о качестве)"""
+        self.metrics.inc('quality_checks')
+
+        if not self.ffprobe_path and not self.ffmpeg_path:
             print("    ℹ️  FFmpeg не найден - пропускаем анализ качества")
-            return None
+            return False, None
 
-        if url in self.quality_cache:
-            return self.quality_cache[url]
+        cached = self.load_cached_quality(url)
+        if cached is not None:
+            return True, cached
 
         print(f"    📊 Анализ качества видео...")
 
         try:
-            # Команда для получения информации о потоке
-            cmd = [
-                self.ffmpeg_path,
-                '-i', url,
-                '-t', str(self.check_duration),  # Проверяем N секунд
-                '-f', 'null', '-',
-                '-hide_banner',
-                '-loglevel', 'info'
-            ]
-
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                timeout=self.check_timeout,
-                text=True,
-                errors='ignore'
-            )
-
-            output = result.stderr + result.stdout
-
-            # Парсим информацию о качестве
-            quality_info = self.parse_ffmpeg_output(output)
-
-            # Проверяем минимальные требования
-            if quality_info:
-                meets_requirements = self.check_quality_requirements(quality_info)
-                quality_info['meets_requirements'] = meets_requirements
-                quality_info['quality_score'] = self.calculate_quality_score(quality_info)
-
-                # Кэшируем результат
-                self.quality_cache[url] = quality_info
-
-                # Выводим информацию
-                self.print_quality_info(quality_info)
-
-                return quality_info
-            else:
-                print("    ❌ Не удалось проанализировать качество")
-                return None
+            alive, quality_info = self.probe_stream(url)
+            return self.finish_quality_analysis(url, alive, quality_info)
 
         except subprocess.TimeoutExpired:
             print(f"    ⏰ Таймаут анализа качества")
-            self.stats['failed_quality_checks'] += 1
-            return None
+            self.metrics.inc('failed_quality_checks')
+            return False, None
         except Exception as e:
             print(f"    ❌ Ошибка анализа: {str(e)[:50]}")
-            self.stats['failed_quality_checks'] += 1
-            return None
-
-    def parse_ffmpeg_output(self, output):
-        """Парсит вывод FFmpeg для получения информации о качестве"""
-        quality_info = {
-            'resolution': None,
-            'bitrate': None,
-            'video_codec': None,
-            'audio_codec': None,
-            'fps': None,
-            'duration': None,
-            'streams': []
-        }
+            self.metrics.inc('failed_quality_checks')
+            return False, None
 
-        # Ищем информацию о видео потоке
-        video_patterns = [
-            r'Stream.*Video:.*(\d+)x(\d+)',
-            r'Video:.*(\d+)x(\d+)',
-            r'(\d+)x(\d+).*Video:'
-        ]
-
-        for pattern in video_patterns:
-            match = re.search(pattern, output, re.IGNORECASE)
-            if match:
-                width = int(match.group(1))
-                height = int(match.group(2))
-                quality_info['resolution'] = f"{width}x{height}"
-                quality_info['resolution_width'] = width
-                quality_info['resolution_height'] = height
-                quality_info['pixels'] = width * height
-                break
-
-        # Ищем битрейт
-        bitrate_patterns = [
-            r'bitrate:\s*(\d+)\s*kb/s',
-            r'bitrate:\s*(\d+)\s*kbps',
-            r'bitrate\s*(\d+)\s*k',
-            r'(\d+)\s*kb/s'
-        ]
-
-        for pattern in bitrate_patterns:
-            match = re.search(pattern, output)
-            if match:
-                quality_info['bitrate'] = int(match.group(1))
-                break
-
-        # Ищем FPS
-        fps_patterns = [
-            r'(\d+(?:\.\d+)?)\s*fps',
-            r'fps:\s*(\d+(?:\.\d+)?)',
-            r'(\d+(?:\.\d+)?)\s*tbr'
+    def load_cached_quality(self, url):
+        """quality_info из кэша анализа, восстановленный через ProbeResult (None - нет или старый формат)"""
+        cached = self.quality_cache.get(url, kind='quality', settings=self.quality_settings_key())
+        if cached is None:
+            return None
+        try:
+            quality_info = ProbeResult.from_dict(cached).to_quality_info()
+        except (TypeError, ValueError, AttributeError):
+            return None
+        if quality_info is None:
+            return None
+        # Требования и балл посчитаны при тех же настройках (см. quality_settings_key)
+        for key in ('meets_requirements', 'quality_score'):
+            if key in cached:
+                quality_info[key] = cached[key]
+        return quality_info
+
+    def finish_quality_analysis(self, url, alive, quality_info):
+        """Проверяет требования, считает балл и кэширует результат анализа"""
+        if quality_info:
+            meets_requirements = self.check_quality_requirements(quality_info)
+            quality_info['meets_requirements'] = meets_requirements
+            quality_info['quality_score'] = self.calculate_quality_score(quality_info)
+
+            # Кэшируем результат
+            if alive:
+                self.quality_cache.put(url, quality_info, True, kind='quality',
+                                        settings=self.quality_settings_key())
+
+            # Выводим информацию
+            self.print_quality_info(quality_info)
+
+            return alive, quality_info
+        else:
+            print("    ❌ Не удалось проанализировать качество")
+            return alive, None
+
+    def get_probe_command(self, url):
+        """Команда проверки потока: ffprobe, а если его нет - ffmpeg"""
+        if self.ffprobe_path:
+            return [
+                self.ffprobe_path,
+                '-v', 'error',
+                '-hide_banner',
+                '-analyzeduration', str(self.probe_analyze_duration * 1000000),
+                '-print_format', 'json',
+                '-show_programs',
+                '-show_streams',
+                '-show_format',
+                url
+            ]
+        return [
+            self.ffmpeg_path,
+            '-i', url,
+            '-t', str(self.check_duration),  # Проверяем N секунд
+            '-f', 'null', '-',
+            '-hide_banner',
+            '-loglevel', 'info'
         ]
 
-        for pattern in fps_patterns:
-            match = re.search(pattern, output)
-            if match:
-                quality_info['fps'] = float(match.group(1))
-                break
-
-        # Ищем кодеки
-        codec_patterns = {
-            'video': r'Video:\s*([^\s,]+)',
-            'audio': r'Audio:\s*([^\s,]+)'
-        }
+    def parse_probe_output(self, cmd, returncode, stdout, stderr):
+        """Разбирает вывод команды из get_probe_command: (поток жив, информация о качестве)"""
+        if self.ffprobe_path and cmd[0] == self.ffprobe_path:
+            quality_info = self.parse_ffprobe_output(stdout)
+            return returncode == 0 and quality_info is not None, quality_info
+        return returncode == 0, self.parse_ffmpeg_output(stderr + stdout)
+
+    def probe_stream(self, url):
+        """Запускает ffprobe (или ffmpeg, если ffprobe нет) один раз для потока"""
+        cmd = self.get_probe_command(url)
+        watcher = self.create_probe_watcher(cmd)
+        # Время probe считается с момента получения слота, без ожидания в очереди
+        returncode, stdout, stderr = self.probe_manager.run(
+            cmd, self.check_timeout, watcher,
+            on_finish=lambda seconds: self.metrics.observe('probe', seconds, url)
+        )
+        return self.parse_probe_output(cmd, self.probe_returncode(watcher, returncode), stdout, stderr)
+
+    def create_probe_watcher(self, cmd):
+        """FfmpegOutputWatcher для досрочной остановки ffmpeg (для ffprobe не нужен)"""
+        if not self.probe_early_exit or (self.ffprobe_path and cmd[0] == self.ffprobe_path):
+            return None
+        return FfmpegOutputWatcher(self.probe_wait_first_frame)
 
-        for stream_type, pattern in codec_patterns.items():
-            match = re.search(pattern, output, re.IGNORECASE)
-            if match:
-                quality_info[f'{stream_type}_codec'] = match.group(1)
+    def probe_returncode(self, watcher, returncode):
+        """Код возврата с учетом досрочной остановки: остановленный после проверки ffmpeg - успех"""
+        if watcher is not None and watcher.complete:
+            return 0
+        return returncode
 
-        # Ищем длительность
-        duration_pattern = r'Duration:\s*(\d{2}):(\d{2}):(\d{2})\.\d+'
-        match = re.search(duration_pattern, output)
-        if match:
-            hours, minutes, seconds = map(int, match.groups())
-            quality_info['duration_seconds'] = hours * 3600 + minutes * 60 + seconds
+    def parse_ffprobe_output(self, output):
+        """Разбирает JSON вывод ffprobe в информацию о качестве"""
+        try:
+            data = json.loads(output or '{}')
+        except ValueError:
+            return None
+        return ProbeResult.from_ffprobe_json(data).to_quality_info()
 
-        return quality_info if quality_info['resolution'] else None
+    def parse_ffmpeg_output(self, output):
+        """Парсит вывод FFmpeg для получения информации о качестве"""
+        return ProbeResult.from_ffmpeg_log(output).to_quality_info()
 
     def check_quality_requirements(self, quality_info):
         """Проверяет, соответствует ли поток минимальным требованиям"""
@@ -472,7 +2415,7 @@ class OnlineM3UScanner:
                 score += 10 * self.quality_weights['bitrate']
 
         # Оценка кодеков
-        video_codec = quality_info.get('video_codec', '').lower()
+        video_codec = (quality_info.get('video_codec') or '').lower()
         if 'h265' in video_codec or 'hevc' in video_codec:
             score += 100 * self.quality_weights['codec']
         elif 'h264' in video_codec or 'avc' in video_codec:
@@ -532,16 +2475,7 @@ class OnlineM3UScanner:
         print("   📡 Поиск в IPTV источниках...")
         streams = []
 
-        # Фильтруем IPTV источники
-        iptv_sources = []
-        for site in self.custom_sites:
-            if any(keyword in site.lower() for keyword in [
-                'iptv', 'm3u', 'github.com/iptv', 'stream', 'live',
-                'iptv-org', 'raw.githubusercontent.com', '.m3u'
-            ]):
-                iptv_sources.append(site)
-
-        iptv_sources = iptv_sources[:15]  # Ограничиваем количество
+        iptv_sources = self.get_iptv_sources()
 
         print(f"      📊 Обрабатываем {len(iptv_sources)} IPTV источников")
 
@@ -552,9 +2486,9 @@ class OnlineM3UScanner:
 
                 # Прямые M3U ссылки
                 if any(ext in source.lower() for ext in ['.m3u', '.m3u8']):
-                    content = self.download_playlist(source)
-                    if content:
-                        found = self.extract_channels_from_playlist(content, channel_name)
+                    index = self.get_playlist_index(source)
+                    if index:
+                        found = self.find_in_playlist_index(index, channel_name)
                         streams.extend(found)
                         if found:
                             print(f"      ✅ Найдено {len(found)} потоков")
@@ -563,9 +2497,9 @@ class OnlineM3UScanner:
                 elif 'github.com' in source.lower():
                     github_urls = self.scan_github_for_m3u(source, channel_name)
                     for m3u_url in github_urls:
-                        content = self.download_playlist(m3u_url)
-                        if content:
-                            found = self.extract_channels_from_playlist(content, channel_name)
+                        index = self.get_playlist_index(m3u_url)
+                        if index:
+                            found = self.find_in_playlist_index(index, channel_name)
                             streams.extend(found)
                             if found:
                                 print(f"      ✅ Найдено в {m3u_url.split('/')[-1]}")
@@ -578,13 +2512,72 @@ class OnlineM3UScanner:
                     if valid_streams:
                         print(f"      ✅ Найдено {len(valid_streams)} потоков")
 
-                time.sleep(0.5)
-
             except Exception as e:
                 continue
 
         return streams
 
+    def get_iptv_sources(self):
+        """IPTV источники из site.txt"""
+        iptv_sources = []
+        for site in self.custom_sites:
+            if any(keyword in site.lower() for keyword in [
+                'iptv', 'm3u', 'github.com/iptv', 'stream', 'live',
+                'iptv-org', 'raw.githubusercontent.com', '.m3u'
+            ]):
+                iptv_sources.append(site)
+
+        return iptv_sources[:15]  # Ограничиваем количество
+
+    def get_source_playlist_urls(self, source):
+        """Прямые ссылки на плейлисты для IPTV источника (без сканирования сайтов)"""
+        if any(ext in source.lower() for ext in ['.m3u', '.m3u8']):
+            return [source]
+        if 'github.com' in source.lower():
+            return self.scan_github_for_m3u(source, '')
+        return []
+
+    def get_batch_queries(self, channel_names):
+        """Запросы, которые search_in_online_sources выполнит для списка каналов"""
+        queries = set()
+        for channel_name in channel_names:
+            if not channel_name.strip():
+                continue
+            queries.add(channel_name)
+            queries.update(keyword for keyword in channel_name.lower().split() if len(keyword) >= 3)
+        return queries
+
+    def prepare_batch_search(self, channel_names):
+        """Пакетный поиск: каждый плейлист-источник просматривается один раз для всех каналов"""
+        channel_names = list(dict.fromkeys(list(channel_names) + list(self.channel_categories)))
+        queries = self.get_batch_queries(channel_names)
+        if not queries:
+            return
+
+        matchers = {
+            query: self.get_channel_matcher(tuple(self.generate_exact_search_patterns(query)))
+            for query in queries
+        }
+        batch = BatchChannelMatcher(matchers)
+
+        urls = []
+        for source in self.get_iptv_sources():
+            urls.extend(self.get_source_playlist_urls(source))
+        urls = list(dict.fromkeys(urls))
+
+        print(f"📥 Пакетный поиск: {len(queries)} запросов, {len(urls)} плейлистов")
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, self.channel_workers)) as executor:
+            indexes = list(executor.map(self.get_playlist_index, urls))
+
+        entries = 0
+        for index in indexes:
+            if index:
+                with self.metrics.timer('match'):
+                    index.route_batch(batch)
+                entries += len(index)
+        print(f"   ✅ Разобрано {entries} записей за {time.time() - start_time:.1f} сек")
+
     def search_on_search_engines(self, channel_name):
         """Поиск через поисковые системы из site.txt"""
         search_urls = []
@@ -602,7 +2595,8 @@ class OnlineM3UScanner:
                     search_url = f"https://yandex.ru/search/?text={quote(channel_name + ' m3u8 live stream')}"
                     response = self.make_request(search_url)
                     if response:
-                        content = response.read().decode('utf-8', errors='ignore')
+                        with response:
+                            content = response.read().decode('utf-8', errors='ignore')
                         m3u_urls = re.findall(r'https?://[^\s"<>]+\.m3u8?', content)
                         search_urls.extend(m3u_urls[:3])
 
@@ -610,7 +2604,8 @@ class OnlineM3UScanner:
                     search_url = f"https://www.google.com/search?q={quote(channel_name + ' m3u8 iptv live')}"
                     response = self.make_request(search_url)
                     if response:
-                        content = response.read().decode('utf-8', errors='ignore')
+                        with response:
+                            content = response.read().decode('utf-8', errors='ignore')
                         m3u_urls = re.findall(r'https?://[^\s"<>]+\.m3u8?', content)
                         search_urls.extend(m3u_urls[:3])
 
@@ -621,38 +2616,23 @@ class OnlineM3UScanner:
 
     def exact_match(self, channel_title, search_patterns):
         """Поиск канала по части названия"""
-        channel_title = channel_title.lower().strip()
-        channel_title = re.sub(r'[^\w\s]', ' ', channel_title)
-        channel_title = re.sub(r'\s+', ' ', channel_title).strip()
-
-        search_name = search_patterns[0].lower().strip() if search_patterns else ""
-
-        # Если ищем по одному слову, ищем частичное совпадение
-        if len(search_name.split()) == 1:
-            # Ищем слово целиком
-            if re.search(r'\b' + re.escape(search_name) + r'\b', channel_title):
-                return True
-            # Ищем слово в составе других слов
-            if search_name in channel_title:
-                return True
-
-        # Для многословных запросов проверяем точнее
-        for pattern in search_patterns:
-            pattern = pattern.lower().strip()
-
-            # Точное совпадение
-            if channel_title == pattern:
-                return True
-
-            # Все слова запроса должны быть в названии канала
-            if all(word in channel_title for word in pattern.split()):
-                return True
-
-            # Нечеткое сравнение
-            if self.fuzzy_match(channel_title, pattern):
-                return True
-
-        return False
+        matcher = self.get_channel_matcher(tuple(search_patterns))
+        return matcher.matches(normalize_title(channel_title))
+
+    def get_channel_matcher(self, search_patterns):
+        """Скомпилированный ChannelMatcher для набора паттернов (кэшируется)"""
+        with self._matcher_lock:
+            matcher = self._matcher_cache.get(search_patterns)
+            if matcher is not None:
+                self._matcher_cache.move_to_end(search_patterns)
+                return matcher
+
+        matcher = ChannelMatcher(list(search_patterns))
+        with self._matcher_lock:
+            self._matcher_cache[search_patterns] = matcher
+            while len(self._matcher_cache) > 1024:
+                self._matcher_cache.popitem(last=False)
+        return matcher
 
     def generate_exact_search_patterns(self, channel_name):
         """Генерирует паттерны для поиска (расширенный поиск)"""
@@ -798,7 +2778,8 @@ class OnlineM3UScanner:
         print(f"🌐 Поиск канала: '{channel_name}'")
         print(f"   🔍 Режим: Расширенный поиск (все каналы с '{channel_name}')")
 
-        all_streams = []
+        # Дубликаты отсеиваются сразу, на всех этапах
+        candidates = CandidateSet()
 
         # 1. Точный поиск по полному названию
         print("   🔍 Этап 1: Точный поиск...")
@@ -812,7 +2793,7 @@ class OnlineM3UScanner:
         for stream in exact_streams:
             stream['name'] = channel_name
 
-        all_streams.extend(exact_streams)
+        candidates.extend(exact_streams)
         print(f"      ✅ Найдено {len(exact_streams)} точных совпадений")
 
         # 2. Поиск по ключевым словам (расширенный)
@@ -831,7 +2812,7 @@ class OnlineM3UScanner:
                         if keyword in stream_name:
                             # Заменяем имя на оригинальное название
                             stream['name'] = channel_name
-                            all_streams.append(stream)
+                            candidates.add(stream)
                     if keyword_streams:
                         print(f"      ✅ По '{keyword}': найдено {len(keyword_streams)}")
                 except:
@@ -843,22 +2824,14 @@ class OnlineM3UScanner:
         for keyword in keywords[:2]:  # Используем 2 основных ключевых слова
             if len(keyword) >= 3:
                 urls = self.search_on_search_engines(keyword)
-                search_urls.extend(urls)
+                search_urls.extend(url for url in urls if url not in candidates)
 
         search_streams = self.quick_check_urls(search_urls, channel_name)
-        all_streams.extend(search_streams)
+        candidates.extend(search_streams)
         print(f"      ✅ Найдено {len(search_streams)} потоков с поисковиков")
 
-        # Удаляем дубликаты по URL
-        unique_streams = []
-        seen_urls = set()
-        for stream in all_streams:
-            url = stream.get('url', '')
-            if url and url not in seen_urls:
-                unique_streams.append(stream)
-                seen_urls.add(url)
-
-        print(f"   📊 ИТОГО: {len(unique_streams)} уникальных потоков")
+        unique_streams = candidates.streams()
+        print(f"   📊 ИТОГО: {len(unique_streams)} уникальных потоков (дубликатов отсеяно: {candidates.duplicates})")
 
         return unique_streams[:50]  # Ограничиваем количество
 
@@ -882,10 +2855,8 @@ class OnlineM3UScanner:
         """Сканирует сайт на наличие M3U плейлистов"""
         found_urls = set()
         try:
-            response = self.make_request(site_url)
-            if response:
-                content = response.read().decode('utf-8', errors='ignore')
-
+            content = self.fetch_source_text(site_url, max_retries=self.max_retries)
+            if content is not None:
                 # Ищем M3U8 ссылки
                 m3u8_urls = re.findall(r'https?://[^\s"\'<>]+\.m3u8', content)
                 found_urls.update(m3u8_urls[:10])
@@ -909,12 +2880,37 @@ class OnlineM3UScanner:
         return list(found_urls)
 
     def download_playlist(self, url):
-        """Скачивает плейлист"""
+        """Скачивает плейлист (повторные запросы берутся из кэша)"""
+        cached = self.playlist_cache.get(url)
+        if cached is not None:
+            return cached
+
+        content = self.fetch_source_text(url)
+        if content is not None:
+            self.playlist_cache.put(url, content)
+        return content
+
+    def fetch_source_text(self, url, max_retries=2):
+        """Текст источника через условный GET: при 304 используется локальная копия"""
+        with self.metrics.timer('fetch', url):
+            return self.download_source_text(url, max_retries)
+
+    def download_source_text(self, url, max_retries):
         try:
-            response = self.make_request(url, 'GET', max_retries=2)
-            if response and response.getcode() == 200:
-                return response.read().decode('utf-8', errors='ignore')
-            return None
+            conditional = self.source_validators.conditional_headers(url, 'text')
+            response = self.make_request(url, 'GET', max_retries=max_retries, headers=conditional)
+            if not response:
+                return None
+            with response:
+                if response.getcode() == 304:
+                    return self.source_validators.load(url, 'text')
+                if response.getcode() != 200:
+                    return None
+                body = response.read()
+                headers = response.headers
+            content = body.decode('utf-8', errors='ignore')
+            self.source_validators.store(url, 'text', headers, content, hashlib.sha1(body).hexdigest())
+            return content
         except:
             return None
 
@@ -950,6 +2946,10 @@ class OnlineM3UScanner:
     def quick_check_urls(self, urls, channel_name):
         """Быстрая проверка URL"""
         valid_streams = []
+        unique_urls = {}
+        for url in urls:
+            unique_urls.setdefault(canonical_stream_url(url), url)
+        urls = list(unique_urls.values())
 
         def check_url(url):
             try:
@@ -966,6 +2966,8 @@ class OnlineM3UScanner:
                 # M3U8 ссылки
                 elif '.m3u8' in url.lower():
                     response = self.make_request(url, 'HEAD', max_retries=1)
+                    if response:
+                        response.close()
                     if response and response.getcode() == 200:
                         return {
                             'name': channel_name,
@@ -978,8 +2980,10 @@ class OnlineM3UScanner:
                 # M3U ссылки
                 elif '.m3u' in url.lower():
                     response = self.make_request(url, 'GET', max_retries=1)
+                    if response:
+                        with response:
+                            content = response.read(1024).decode('utf-8', errors='ignore')
                     if response and response.getcode() == 200:
-                        content = response.read(1024).decode('utf-8', errors='ignore')
                         if '#EXTM3U' in content:
                             return {
                                 'name': channel_name,
@@ -1006,35 +3010,155 @@ class OnlineM3UScanner:
 
     def extract_channels_from_playlist(self, playlist_content, channel_name):
         """Извлекает каналы из плейлиста"""
-        streams = []
-        lines = playlist_content.split('\n')
-        search_patterns = self.generate_exact_search_patterns(channel_name)
+        index = self.build_playlist_index(playlist_content)
+        return self.find_in_playlist_index(index, channel_name)
+
+    def build_playlist_index(self, playlist_content):
+        """Разбирает плейлист один раз и строит индекс для быстрого поиска.
+
+        Принимает текст плейлиста или итератор строк (например, HttpResponse.iter_lines()).
+        """
+        with self.metrics.timer('parse'):
+            return self.parse_playlist_index(playlist_content)
+
+    def parse_playlist_index(self, playlist_content):
+        if isinstance(playlist_content, str):
+            playlist_content = io.StringIO(playlist_content)
+
+        index = PlaylistIndex()
+        for channel_info, url in self.iter_playlist_entries(playlist_content):
+            if url.startswith('http') and self.is_high_quality_channel(channel_info):
+                index.add(PlaylistEntry(
+                    name=channel_info.get('name', ''),
+                    url=url,
+                    group=channel_info.get('group-title', 'Общие'),
+                    tvg_id=channel_info.get('tvg-id', ''),
+                    tvg_logo=channel_info.get('tvg-logo', ''),
+                    quality_score=self.calculate_name_quality_score(channel_info),
+                    stability_score=self.calculate_stability_score(channel_info, url)
+                ))
+
+        return index
+
+    def iter_playlist_entries(self, lines):
+        """Потоковый разбор M3U: пары (данные EXTINF, URL).
+
+        Строки #EXTVLCOPT, #EXTGRP и другие директивы между #EXTINF и URL пропускаются,
+        #EXTGRP используется как группа, если в EXTINF нет group-title.
+        """
+        pending = None
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
 
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
             if line.startswith('#EXTINF:'):
-                channel_info = self.parse_extinf_line(line)
-                channel_title = channel_info.get('name', '').lower()
-
-                if self.exact_match(channel_title, search_patterns):
-                    if i + 1 < len(lines):
-                        url = lines[i + 1].strip()
-                        if url and not url.startswith('#') and url.startswith('http'):
-                            if self.is_high_quality_channel(channel_info):
-                                stability_score = self.calculate_stability_score(channel_info, url)
-                                streams.append({
-                                    'name': channel_name,
-                                    'url': url,
-                                    'source': 'playlist',
-                                    'group': channel_info.get('group-title', 'Общие'),
-                                    'tvg_id': channel_info.get('tvg-id', ''),
-                                    'tvg_logo': channel_info.get('tvg-logo', ''),
-                                    'quality_score': self.calculate_quality_score(channel_info),
-                                    'stability_score': stability_score
-                                })
-                                i += 1
-            i += 1
+                pending = self.parse_extinf_line(line)
+            elif line.startswith('#'):
+                if pending is not None and line.startswith('#EXTGRP:') and 'group-title' not in pending:
+                    pending['group-title'] = line[len('#EXTGRP:'):].strip()
+            elif pending is not None:
+                yield pending, line
+                pending = None
+
+    def get_playlist_index(self, url):
+        """Возвращает индекс плейлиста по URL (строится один раз за запуск)"""
+        index = self.playlist_index_cache.get(url)
+        if index is not None:
+            return index
+
+        # Параллельные каналы ждут одну загрузку источника, а не качают его заново
+        with self.get_source_lock(url):
+            index = self.playlist_index_cache.get(url)
+            if index is not None:
+                return index
+
+            with self.metrics.timer('fetch', url):
+                index = self.download_playlist_index(url)
+            if index is None:
+                return None
+
+            self.playlist_index_cache.put(url, index)
+            return index
+
+    def download_playlist_index(self, url):
+        """Скачивает и разбирает плейлист-источник (условный GET), None при ошибке"""
+        # Плейлист разбирается по мере загрузки, без копии всего текста в памяти
+        # (поэтому время parse для источника входит и во время fetch)
+        try:
+            conditional = self.source_validators.conditional_headers(url, 'index')
+            while True:
+                response = self.make_request(url, 'GET', max_retries=2, headers=conditional)
+                if not response:
+                    return None
+                with response:
+                    if response.getcode() == 304:
+                        # Источник не изменился - берем сохраненный разобранный плейлист
+                        try:
+                            return PlaylistIndex.from_entries(self.source_validators.load(url, 'index'))
+                        except (TypeError, ValueError):
+                            pass
+                        # Копии нет или она в старом формате - забываем валидаторы и качаем заново
+                        self.source_validators.forget(url, 'index')
+                        if not conditional:
+                            return None
+                        conditional = {}
+                        continue
+                    if response.getcode() != 200:
+                        return None
+                    # Версия формата входит в хэш: после ее смены копия перезаписывается
+                    content_hash = hashlib.sha1(f"index-v{PlaylistIndex.FORMAT_VERSION}\n".encode('utf-8'))
+                    index = self.build_playlist_index(
+                        self.hash_lines(response.iter_lines(), content_hash)
+                    )
+                    self.source_validators.store(
+                        url, 'index', response.headers, index.to_entries(), content_hash.hexdigest()
+                    )
+                    return index
+        except Exception:
+            return None
+
+    def hash_lines(self, lines, content_hash):
+        """Пропускает строки дальше, добавляя их в хэш содержимого"""
+        for line in lines:
+            content_hash.update(line.encode('utf-8', errors='ignore'))
+            content_hash.update(b'\n')
+            yield line
+
+    def get_source_lock(self, url):
+        """Блокировка на загрузку конкретного источника"""
+        with self._source_locks_guard:
+            lock = self._source_locks.get(url)
+            if lock is None:
+                lock = threading.Lock()
+                self._source_locks[url] = lock
+            return lock
+
+    def find_in_playlist_index(self, index, channel_name):
+        """Ищет канал в разобранном плейлисте"""
+        with self.metrics.timer('match'):
+            return self.match_playlist_index(index, channel_name)
+
+    def match_playlist_index(self, index, channel_name):
+        streams = []
+        entry_ids = index.batch_matches.get(channel_name)
+        if entry_ids is None:
+            matcher = self.get_channel_matcher(tuple(self.generate_exact_search_patterns(channel_name)))
+            entry_ids = [entry_id for entry_id in index.candidates(matcher.index_keys())
+                         if matcher.matches(index.titles[entry_id])]
+
+        for entry_id in entry_ids:
+            entry = index.entries[entry_id]
+            streams.append({
+                'name': channel_name,
+                'url': entry.url,
+                'source': 'playlist',
+                'group': entry.group,
+                'tvg_id': entry.tvg_id,
+                'tvg_logo': entry.tvg_logo,
+                'quality_score': entry.quality_score,
+                'stability_score': entry.stability_score
+            })
 
         streams.sort(key=lambda x: (x.get('stability_score', 0), x.get('quality_score', 0)), reverse=True)
         return streams[:10]
@@ -1092,8 +3216,8 @@ class OnlineM3UScanner:
 
         return max(1, min(10, score))
 
-    def calculate_quality_score(self, channel_info):
-        """Рассчитывает качество"""
+    def calculate_name_quality_score(self, channel_info):
+        """Рассчитывает качество по названию и атрибутам записи плейлиста"""
         score = 0
         name = channel_info.get('name', '').lower()
 
@@ -1127,6 +3251,39 @@ class OnlineM3UScanner:
         return info
 
     def check_single_stream_improved(self, stream_info):
+        """Проверка работоспособности ссылки с анализом качества (с учетом кэша)"""
+        url = stream_info.get('url', '')
+        if not url.startswith('http'):
+            return None
+
+        check_fields = self.verification_memo.get_or_run(url, lambda: self.verify_stream(stream_info))
+        if check_fields is None:
+            return None
+        return {**stream_info, **check_fields}
+
+    def quality_settings_key(self):
+        """Отпечаток настроек, от которых зависит результат проверки (сверяется с кэшем)"""
+        settings = [self.enable_deep_check, self.check_duration, self.required_bitrate,
+                    self.min_video_resolution, self.required_fps, sorted(self.quality_weights.items())]
+        return hashlib.sha1(json.dumps(settings).encode('utf-8')).hexdigest()[:16]
+
+    def verify_stream(self, stream_info):
+        """Поля результата проверки потока: из постоянного кэша или новой проверкой"""
+        url = stream_info['url']
+        cached = self.quality_cache.get(url, settings=self.quality_settings_key())
+        if cached is not None:
+            print(f"    💾 Из кэша: {stream_info.get('name', 'Unknown')} - {url[:60]}...")
+            return cached
+
+        result = self.run_stream_check(stream_info)
+        if not result:
+            return None
+        check_fields = {key: result[key] for key in self.CHECK_RESULT_FIELDS if key in result}
+        self.quality_cache.put(url, check_fields, result.get('working', False),
+                               settings=self.quality_settings_key())
+        return check_fields
+
+    def run_stream_check(self, stream_info):
         """Проверка работоспособности ссылки с анализом качества"""
         try:
             url = stream_info['url']
@@ -1140,6 +3297,8 @@ class OnlineM3UScanner:
             # YouTube ссылки
             if 'youtube.com/watch' in url or 'youtu.be' in url:
                 response = self.make_request(url, 'HEAD', max_retries=1)
+                if response:
+                    response.close()
                 if response and response.getcode() == 200:
                     # Для YouTube оцениваем качество по названию
                     quality_score = 70  # Базовая оценка для YouTube
@@ -1154,53 +3313,37 @@ class OnlineM3UScanner:
                 else:
                     return {**stream_info, 'working': False, 'status': 'YouTube недоступен', 'quality': 'none', 'stable': False}
 
-            # M3U8 ссылки
+            # M3U8 ссылки: сначала разбираем сам HLS плейлист, ffmpeg - только если нужно
             elif '.m3u8' in url.lower():
-                response = self.make_request(url, 'HEAD')
-                if response and response.getcode() == 200:
-                    # Проверка через FFmpeg если доступен
-                    if self.ffmpeg_path and self.enable_deep_check:
+                hls = self.probe_hls_manifest(url)
+                if hls['reachable']:
+                    if not hls['alive']:
+                        return {**stream_info, 'working': False, 'status': hls['status'], 'quality': 'none',
+                                'stable': False, 'quality_score': 0}
+
+                    status = 'HLS проверен'
+                    quality_info = hls['quality_info']
+                    if quality_info is not None:
+                        # Разрешение и битрейт объявлены в master плейлисте
+                        alive, quality_info = self.finish_quality_analysis(url, True, quality_info)
+                    elif (self.ffprobe_path or self.ffmpeg_path) and self.enable_deep_check:
+                        status = 'FFmpeg проверен'
                         try:
-                            # Базовая проверка доступности
-                            cmd = [self.ffmpeg_path, '-i', url, '-t', '3', '-f', 'null', '-', '-hide_banner', '-loglevel', 'error']
-                            result = subprocess.run(cmd, capture_output=True, timeout=10)
-                            if result.returncode == 0:
-                                # Расширенный анализ качества
-                                quality_info = self.analyze_stream_quality(url)
-
-                                if quality_info and quality_info.get('meets_requirements', False):
-                                    quality_score = quality_info.get('quality_score', 50)
-                                    quality_level = "high" if quality_score >= 70 else "medium" if quality_score >= 50 else "low"
-
-                                    return {
-                                        **stream_info,
-                                        'working': True,
-                                        'status': 'FFmpeg проверен',
-                                        'quality': quality_level,
-                                        'stable': True,
-                                        'quality_score': quality_score,
-                                        'video_info': quality_info
-                                    }
+                            alive, quality_info = self.probe_and_analyze(url)
+                            if not alive:
+                                quality_info = None
                         except:
-                            pass
+                            quality_info = None
 
-                    # Базовая проверка
-                    content_type = response.headers.get('Content-Type', '').lower()
-                    if any(ct in content_type for ct in ['video', 'application', 'mpegurl']):
-                        return {
-                            **stream_info,
-                            'working': True,
-                            'status': 'M3U8 доступен',
-                            'quality': 'medium',
-                            'stable': True,
-                            'quality_score': 50
-                        }
+                    return self.build_hls_check_result(stream_info, quality_info, status)
 
             # M3U ссылки
             elif '.m3u' in url.lower() and not url.endswith('.m3u8'):
                 response = self.make_request(url, 'GET')
+                if response:
+                    with response:
+                        content = response.read(2048).decode('utf-8', errors='ignore')
                 if response and response.getcode() == 200:
-                    content = response.read(2048).decode('utf-8', errors='ignore')
                     if '#EXTM3U' in content:
                         return {
                             **stream_info,
@@ -1213,6 +3356,8 @@ class OnlineM3UScanner:
 
             # Общая проверка
             response = self.make_request(url, 'HEAD')
+            if response:
+                response.close()
             if response and response.getcode() == 200:
                 content_type = response.headers.get('Content-Type', '').lower()
                 if any(ct in content_type for ct in ['video/', 'audio/', 'application/']):
@@ -1244,6 +3389,141 @@ class OnlineM3UScanner:
                 'quality_score': 0
             }
 
+    def build_hls_check_result(self, stream_info, quality_info, status):
+        """Результат проверки живого HLS потока (с качеством, если оно известно)"""
+        if quality_info and quality_info.get('meets_requirements', False):
+            quality_score = quality_info.get('quality_score', 50)
+            quality_level = "high" if quality_score >= 70 else "medium" if quality_score >= 50 else "low"
+            return {
+                **stream_info,
+                'working': True,
+                'status': status,
+                'quality': quality_level,
+                'stable': True,
+                'quality_score': quality_score,
+                'video_info': quality_info
+            }
+
+        # Базовая проверка: плейлист и первый сегмент доступны
+        return {
+            **stream_info,
+            'working': True,
+            'status': 'M3U8 доступен',
+            'quality': 'medium',
+            'stable': True,
+            'quality_score': 50
+        }
+
+    def probe_hls_manifest(self, url):
+        """Легкая проверка HLS без ffmpeg: плейлист, варианты и первые байты сегмента.
+
+        Возвращает словарь: reachable (плейлист получен), alive (сегмент отдается),
+        status, variants и quality_info (если в master плейлисте объявлено разрешение).
+        """
+        result = {'reachable': False, 'alive': False, 'status': 'Не доступен',
+                  'variants': [], 'quality_info': None}
+
+        playlist = self.fetch_hls_playlist(url)
+        if playlist is None:
+            return result
+        result['reachable'] = True
+
+        text, base_url = playlist
+        variants, segment_url = self.parse_hls_playlist(text, base_url)
+        result['variants'] = variants
+
+        best = None
+        if variants:
+            best = max(variants, key=lambda v: (v['height'], v['bandwidth']))
+            result['quality_info'] = ProbeResult.from_hls_variants(variants).to_quality_info()
+            # Master плейлист: сегменты лежат в плейлисте варианта
+            media = self.fetch_hls_playlist(best['url'])
+            if media is None:
+                result['status'] = 'HLS вариант недоступен'
+                return result
+            _, segment_url = self.parse_hls_playlist(*media)
+
+        if not segment_url:
+            result['status'] = 'HLS без сегментов'
+            return result
+
+        if not self.fetch_segment_head(segment_url):
+            result['status'] = 'HLS сегмент недоступен'
+            return result
+
+        result['alive'] = True
+        result['status'] = 'HLS проверен'
+        return result
+
+    def fetch_hls_playlist(self, url):
+        """Скачивает HLS плейлист: (текст, итоговый URL) или None"""
+        response = self.make_request(url, 'GET', max_retries=1)
+        if not response:
+            return None
+        with response:
+            if response.getcode() != 200:
+                return None
+            body = b''
+            for chunk in response.iter_chunks(16384):
+                body += chunk
+                if len(body) >= self.hls_manifest_max_bytes:
+                    break
+            final_url = response.url or url
+
+        text = body.decode('utf-8', errors='ignore')
+        if '#EXTM3U' not in text[:1024]:
+            return None
+        return text, final_url
+
+    def fetch_segment_head(self, url):
+        """Запрашивает первые байты сегмента (Range); True, если данные пришли"""
+        response = self.make_request(url, 'GET', max_retries=1,
+                                     headers={'Range': f'bytes=0-{self.hls_segment_probe_bytes - 1}'})
+        if not response:
+            return False
+        with response:
+            if response.getcode() not in (200, 206):
+                return False
+            return bool(response.read(self.hls_segment_probe_bytes))
+
+    def parse_hls_playlist(self, text, base_url):
+        """Разбирает HLS плейлист: (варианты из #EXT-X-STREAM-INF, URL первого сегмента)"""
+        variants = []
+        segment_url = None
+        pending_variant = None
+
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('#EXT-X-STREAM-INF:'):
+                attributes = dict(
+                    (key, value.strip('"'))
+                    for key, value in re.findall(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', line.split(':', 1)[1])
+                )
+                width, _, height = attributes.get('RESOLUTION', '').partition('x')
+                try:
+                    frame_rate = float(attributes.get('FRAME-RATE', 0))
+                except ValueError:
+                    frame_rate = 0
+                pending_variant = {
+                    'bandwidth': int(attributes['BANDWIDTH']) if attributes.get('BANDWIDTH', '').isdigit() else 0,
+                    'width': int(width) if width.isdigit() else 0,
+                    'height': int(height) if height.isdigit() else 0,
+                    'codecs': attributes.get('CODECS', ''),
+                    'fps': frame_rate or None
+                }
+            elif line.startswith('#'):
+                continue
+            elif pending_variant is not None:
+                pending_variant['url'] = urljoin(base_url, line)
+                variants.append(pending_variant)
+                pending_variant = None
+            elif not variants and segment_url is None:
+                segment_url = urljoin(base_url, line)
+
+        return variants, segment_url
+
     def check_streams(self, streams, search_name):
         """Проверяет все найденные ссылки"""
         if not streams:
@@ -1252,12 +3532,37 @@ class OnlineM3UScanner:
         print(f"🔧 Проверка {len(streams)} найденных ссылок...")
         print(f"   🎯 Фильтрация по: '{search_name}'")
 
-        working_streams = []
-        search_lower = search_name.lower()
-
-        # Разбиваем поисковый запрос на слова
-        search_words = search_lower.split()
+        relevant_streams = self.filter_relevant_streams(streams, search_name)
 
+        def check_with_host_limit(stream):
+            if self.interrupted.is_set():
+                return None
+            with self.host_limiter.slot(stream['url']):
+                return self.check_single_stream_improved(stream)
+
+        # Проверяем работоспособность параллельно
+        checked = []
+        if relevant_streams:
+            workers = max(1, min(self.max_workers, len(relevant_streams)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(check_with_host_limit, stream): i for i, stream in relevant_streams}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"  [{i}/{len(streams)}] ❌ Ошибка проверки - {e}")
+                        continue
+                    if self.report_check_result(i, len(streams), result):
+                        checked.append((i, result))
+
+        return self.rank_working_streams(checked, search_name)
+
+    def filter_relevant_streams(self, streams, search_name):
+        """Оставляет ссылки, название которых соответствует запросу: [(номер, ссылка)]"""
+        search_words = search_name.lower().split()
+
+        relevant_streams = []
         for i, stream in enumerate(streams, 1):
             # Проверяем, содержит ли название канала поисковые слова
             stream_name = stream.get('name', '').lower()
@@ -1280,19 +3585,41 @@ class OnlineM3UScanner:
                 print(f"  [{i}/{len(streams)}] ⏭️  Пропуск: '{stream_title}' не соответствует '{search_name}'")
                 continue
 
-            # Проверяем работоспособность
-            result = self.check_single_stream_improved(stream)
-            if result:
-                if result['working']:
-                    working_streams.append(result)
-                    stability_icon = '🟢' if result.get('stable') else '🟡'
-                    quality_icon = '🟢' if result.get('quality') == 'high' else '🟡' if result.get('quality') == 'medium' else '🔴'
-                    print(f"  [{i}/{len(streams)}] ✅ {quality_icon}{stability_icon} РАБОТАЕТ - {result['status']}")
-                else:
-                    print(f"  [{i}/{len(streams)}] ❌ Не работает - {result['status']}")
+            relevant_streams.append((i, stream))
+
+        return relevant_streams
+
+    def report_check_result(self, i, total, result):
+        """Выводит результат проверки, возвращает True для рабочей ссылки"""
+        if not result:
+            return False
+        self.report_progress('stream', url=result.get('url'), name=result.get('name'),
+                             working=result['working'], status=result.get('status'),
+                             quality_score=result.get('quality_score'))
+        if result['working']:
+            stability_icon = '🟢' if result.get('stable') else '🟡'
+            quality_icon = '🟢' if result.get('quality') == 'high' else '🟡' if result.get('quality') == 'medium' else '🔴'
+            print(f"  [{i}/{total}] ✅ {quality_icon}{stability_icon} РАБОТАЕТ - {result['status']}")
+            return True
+        print(f"  [{i}/{total}] ❌ Не работает - {result['status']}")
+        return False
+
+    def report_progress(self, event, **fields):
+        """Передает событие выполнения в progress_callback, если он задан"""
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback(event, fields)
+        except Exception as e:
+            print(f"⚠️  Ошибка обработчика событий: {e}")
+
+    def rank_working_streams(self, checked, search_name):
+        """Сортирует рабочие ссылки [(номер, результат)] по релевантности и качеству"""
+        search_lower = search_name.lower()
+        search_words = search_lower.split()
 
-            if i < len(streams):
-                time.sleep(1)
+        # Восстанавливаем исходный порядок, чтобы сортировка была детерминированной
+        working_streams = [result for _, result in sorted(checked, key=lambda item: item[0])]
 
         # Сортируем по релевантности и качеству
         if working_streams:
@@ -1345,54 +3672,87 @@ class OnlineM3UScanner:
 
         # Загружаем существующие каналы
         existing_channels = self.load_existing_channels()
+        self.verification_memo.clear()
+
+        success, final_channel_name, new_streams = self.prepare_channel_update(channel_name, existing_channels)
+        if new_streams is not None:
+            self.commit_channel_update(final_channel_name, new_streams)
+        self.report_progress('channel', index=1, total=1, name=final_channel_name,
+                             status='found' if success else 'not_found',
+                             streams=len(new_streams or []))
+        self.export_metrics()
+        return success
+
+    def prepare_channel_update(self, channel_name, existing_channels):
+        """Ищет и проверяет ссылки канала, не изменяя плейлист.
+
+        Возвращает (успех, имя канала в плейлисте, новые ссылки).
+        Новые ссылки равны None, если плейлист менять не нужно,
+        и пустому списку, если канал нужно удалить.
+        """
+        context = self.get_channel_context(channel_name, existing_channels)
 
-        # Ищем существующий канал и сохраняем его оригинальные данные
-        final_channel_name = channel_name
-        old_streams = []
-        original_group = None
-        original_tvg_id = None
-        original_tvg_logo = None
+        # Поиск новых ссылок
+        start_time = time.time()
+        all_streams = self.search_in_online_sources(context['name'])
+
+        # Проверка работоспособности с анализом качества
+        working_streams = self.check_streams(all_streams, context['name']) if all_streams else []
+        search_time = time.time() - start_time
+
+        return self.build_channel_update(context, all_streams, working_streams, search_time)
+
+    def get_channel_context(self, channel_name, existing_channels):
+        """Находит канал в плейлисте и сохраняет его оригинальные данные"""
+        context = {
+            'name': channel_name,
+            'old_streams': [],
+            'group': None,
+            'tvg_id': None,
+            'tvg_logo': None
+        }
 
         for existing_name in existing_channels.keys():
             if existing_name.lower() == channel_name.lower():
-                final_channel_name = existing_name
-                old_streams = existing_channels[final_channel_name].copy()
+                context['name'] = existing_name
+                context['old_streams'] = existing_channels[existing_name].copy()
                 # Сохраняем оригинальные данные из первого стрима
-                if old_streams:
-                    original_group = old_streams[0].get('group', None)
-                    original_tvg_id = old_streams[0].get('tvg_id', '')
-                    original_tvg_logo = old_streams[0].get('tvg_logo', '')
+                if context['old_streams']:
+                    first_stream = context['old_streams'][0]
+                    context['group'] = first_stream.get('group', None)
+                    context['tvg_id'] = first_stream.get('tvg_id', '')
+                    context['tvg_logo'] = first_stream.get('tvg_logo', '')
                 break
 
         # Если не нашли оригинальный group-title, определяем из cartolog.txt
-        if not original_group:
-            original_group = self.get_channel_category(final_channel_name)
-            print(f"   ℹ️  Категория из cartolog.txt: '{original_group}'")
+        if not context['group']:
+            context['group'] = self.get_channel_category(context['name'])
+            print(f"   ℹ️  Категория из cartolog.txt: '{context['group']}'")
 
-        # Поиск новых ссылок
-        start_time = time.time()
-        all_streams = self.search_in_online_sources(final_channel_name)
+        return context
+
+    def build_channel_update(self, context, all_streams, working_streams, search_time):
+        """Формирует результат обновления канала (см. prepare_channel_update)"""
+        final_channel_name = context['name']
+        old_streams = context['old_streams']
+        original_group = context['group']
 
         if not all_streams:
             print("❌ Не найдено новых ссылок для проверки")
             if old_streams:
                 print("💡 Сохранены существующие рабочие ссылки")
-                return True
-            return False
-
-        # Проверка работоспособности с анализом качества
-        working_streams = self.check_streams(all_streams, final_channel_name)
-        search_time = time.time() - start_time
+                return True, final_channel_name, None
+            return False, final_channel_name, None
 
         if working_streams:
             # Применяем оригинальный group-title и другие данные ко всем стримам
             for stream in working_streams:
                 stream['group'] = original_group
                 # Восстанавливаем оригинальные данные если они были
-                if original_tvg_id:
-                    stream['tvg_id'] = original_tvg_id
-                if original_tvg_logo:
-                    stream['tvg_logo'] = original_tvg_logo
+                if context['tvg_id']:
+                    stream['tvg_id'] = context['tvg_id']
+                if context['tvg_logo']:
+                    stream['tvg_logo'] = context['tvg_logo']
 
                 # Добавляем дополнительную информацию о качестве в group
                 quality_info = ""
@@ -1415,24 +3775,65 @@ class OnlineM3UScanner:
             print(f"🎯 Группа: {original_group}")
             print(f"⏱️  Время поиска: {search_time:.1f} секунд")
             print("=" * 60)
-
-            # Обновляем канал
-            success = self.update_channel_in_playlist(final_channel_name, combined_streams)
-
-            if success:
-                print(f"\n🔄 КАНАЛ ОБНОВЛЕН: {final_channel_name}")
-                print(f"📺 Всего ссылок: {len(combined_streams)}")
-                print(f"📂 Группа: {original_group}")
-            return True
+            return True, final_channel_name, combined_streams
 
         else:
             print(f"\n❌ Для канала '{final_channel_name}' не найдено рабочих ссылок")
             if old_streams:
                 print("💡 Сохранены существующие рабочие ссылки")
-                return True
+                return True, final_channel_name, None
             else:
-                self.update_channel_in_playlist(final_channel_name, [])
-                return False
+                return False, final_channel_name, []
+
+    def commit_channel_update(self, channel_name, new_streams):
+        """Записывает результат поиска канала в плейлист"""
+        success = self.update_channel_in_playlist(channel_name, new_streams)
+
+        if success and new_streams:
+            print(f"\n🔄 КАНАЛ ОБНОВЛЕН: {channel_name}")
+            print(f"📺 Всего ссылок: {len(new_streams)}")
+            print(f"📂 Группа: {new_streams[0].get('group', '')}")
+        return success
+
+    def run_channel_pipeline(self, channel_names, worker, on_result):
+        """Обрабатывает каналы параллельно (channel_workers потоков).
+
+        worker(номер, имя) выполняется в пуле, on_result(номер, имя, результат, ошибка)
+        вызывается в текущем потоке по мере готовности - это единственное место,
+        где результаты применяются к плейлисту.
+        """
+        workers = max(1, min(self.channel_workers, len(channel_names)))
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(worker, i, channel_name): (i, channel_name)
+                    for i, channel_name in enumerate(channel_names, 1)
+                }
+                try:
+                    for future in as_completed(futures):
+                        i, channel_name = futures[future]
+                        try:
+                            result = future.result()
+                            error = None
+                        except Exception as e:
+                            result = None
+                            error = e
+                        on_result(i, channel_name, result, error)
+                except KeyboardInterrupt:
+                    self.cancel_pending(futures)
+                    raise
+        except KeyboardInterrupt:
+            # Уже примененные результаты сохраняются, прерывание идет дальше
+            self.interrupted.clear()
+            if self.get_playlist_model().dirty:
+                self.flush_playlist()
+            raise
+
+    def cancel_pending(self, futures):
+        """Ctrl-C: отменяет задачи пула из очереди, идущие проверки новых ссылок не начинают"""
+        self.interrupted.set()
+        for future in futures:
+            future.cancel()
 
     def merge_streams(self, old_streams, new_streams):
         """Объединяет ссылки с учетом качества"""
@@ -1446,146 +3847,208 @@ class OnlineM3UScanner:
 
         # Сначала новые с высоким качеством
         for stream in new_streams:
-            if (stream['url'] not in seen_urls and
+            if (canonical_stream_url(stream['url']) not in seen_urls and
                     stream.get('working', True) and
                     stream.get('quality_score', 0) >= 50):
                 # Если есть оригинальный group, используем его
                 if original_group and not stream.get('group'):
                     stream['group'] = original_group
                 merged.append(stream)
-                seen_urls.add(stream['url'])
+                seen_urls.add(canonical_stream_url(stream['url']))
 
         # Затем старые стабильные (сохраняем оригинальные группы)
         for stream in old_streams:
-            if (stream['url'] not in seen_urls and
+            if (canonical_stream_url(stream['url']) not in seen_urls and
                     stream.get('working', True) and
                     stream.get('stable', False)):
                 merged.append(stream)
-                seen_urls.add(stream['url'])
+                seen_urls.add(canonical_stream_url(stream['url']))
 
         # Затем остальные новые
         for stream in new_streams:
-            if stream['url'] not in seen_urls and stream.get('working', True):
+            if canonical_stream_url(stream['url']) not in seen_urls and stream.get('working', True):
                 # Если есть оригинальный group, используем его
                 if original_group and not stream.get('group'):
                     stream['group'] = original_group
                 merged.append(stream)
-                seen_urls.add(stream['url'])
+                seen_urls.add(canonical_stream_url(stream['url']))
 
         return merged[:10]  # Ограничиваем количество ссылок
 
-    def update_channel_in_playlist(self, channel_name, new_streams):
-        """Обновляет канал в плейлисте"""
-        existing_channels = self.load_existing_channels()
+    def update_channel_in_playlist(self, channel_name, new_streams, flush=True):
+        """Обновляет канал в плейлисте (в памяти, запись на диск - flush_playlist)"""
+        model = self.get_playlist_model()
 
-        if new_streams:
-            existing_channels[channel_name] = new_streams
-            print(f"🔄 Обновлен канал: {channel_name} ({len(new_streams)} ссылок)")
-        else:
-            if channel_name in existing_channels:
-                del existing_channels[channel_name]
-                print(f"🗑️ Удален канал: {channel_name}")
+        with model.lock:
+            if new_streams:
+                model.channels[channel_name] = new_streams
+                model.dirty = True
+                print(f"🔄 Обновлен канал: {channel_name} ({len(new_streams)} ссылок)")
+            else:
+                if channel_name in model.channels:
+                    del model.channels[channel_name]
+                    model.dirty = True
+                    print(f"🗑️ Удален канал: {channel_name}")
+
+        if flush:
+            return self.flush_playlist()
+        return self.flush_playlist_if_due()
+
+    def get_playlist_model(self):
+        """Плейлист в памяти; перечитывается, если файл изменили извне и несохраненных правок нет"""
+        with self._playlist_model_guard:
+            model = self.playlist_model
+            mtime = self.get_playlist_mtime()
+            if model is not None and (model.dirty or model.file_mtime == mtime):
+                return model
+
+            static_content = None
+            channels = {}
+            if mtime is not None:
+                try:
+                    with open(self.playlist_file, 'r', encoding='utf-8') as f:
+                        static_content, channels = self.read_playlist(f)
+                except Exception as e:
+                    print(f"❌ Ошибка загрузки плейлиста: {e}")
+
+            self.playlist_model = PlaylistModel(
+                static_content or self.create_default_static_content(), channels, mtime
+            )
+            return self.playlist_model
 
-        return self.save_full_playlist(existing_channels)
+    def get_playlist_mtime(self):
+        """Время изменения файла плейлиста (нс) или None, если файла нет"""
+        try:
+            return os.stat(self.playlist_file).st_mtime_ns
+        except OSError:
+            return None
 
     def load_existing_channels(self):
         """Загружает существующие каналы"""
+        return self.get_playlist_model().snapshot()
+
+    def read_playlist(self, lines):
+        """Потоково читает плейлист: (статическая часть или None, словарь каналов).
+
+        Статическая часть - все до второго разделителя, каналы - после него.
+        """
+        separator = '#############################'
+        static_lines = []
+        separators_seen = 0
+
+        def dynamic_lines():
+            nonlocal separators_seen
+            for line in lines:
+                if separators_seen < 2:
+                    if line.strip() == separator:
+                        separators_seen += 1
+                        if separators_seen == 2:
+                            continue
+                    static_lines.append(line)
+                    continue
+                if line.strip() == separator:
+                    break
+                yield line
+
+        channels = self.parse_playlist_channels(dynamic_lines())
+        static_content = None
+        if separators_seen >= 2:
+            static_content = ''.join(static_lines) + separator + '\n\n'
+        return static_content, channels
+
+    def parse_playlist_channels(self, lines):
+        """Разбирает строки динамической части плейлиста в словарь каналов"""
         channels = {}
-        if os.path.exists(self.playlist_file):
-            try:
-                with open(self.playlist_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-
-                # Динамическая часть (после разделителя)
-                parts = content.split('#############################')
-                if len(parts) > 2:
-                    dynamic_content = parts[2]
-                    lines = dynamic_content.split('\n')
-
-                    i = 0
-                    current_stream = None
-
-                    while i < len(lines):
-                        line = lines[i].strip()
-                        if line.startswith('#EXTINF:'):
-                            channel_info = self.parse_extinf_line(line)
-                            current_stream = channel_info
-
-                            if i + 1 < len(lines):
-                                url_line = lines[i + 1].strip()
-                                if url_line.startswith('http'):
-                                    channel_name = current_stream.get('name', 'Unknown')
-                                    if channel_name not in channels:
-                                        channels[channel_name] = []
-
-                                    channels[channel_name].append({
-                                        'name': current_stream.get('name', 'Unknown'),
-                                        'url': url_line,
-                                        'group': current_stream.get('group-title', 'Общие'),
-                                        'tvg_id': current_stream.get('tvg-id', ''),
-                                        'tvg_logo': current_stream.get('tvg-logo', ''),
-                                        'quality': 'medium'
-                                    })
-                                    i += 1
-                        i += 1
+        for channel_info, url in self.iter_playlist_entries(lines):
+            if not url.startswith('http'):
+                continue
 
-            except Exception as e:
-                print(f"❌ Ошибка загрузки плейлиста: {e}")
+            channel_name = channel_info.get('name', 'Unknown')
+            if channel_name not in channels:
+                channels[channel_name] = []
+
+            channels[channel_name].append({
+                'name': channel_name,
+                'url': url,
+                'group': channel_info.get('group-title', 'Общие'),
+                'tvg_id': channel_info.get('tvg-id', ''),
+                'tvg_logo': channel_info.get('tvg-logo', ''),
+                'quality': 'medium'
+            })
 
         return channels
 
     def save_full_playlist(self, channels_dict):
-        """Сохраняет плейлист с информацией о качестве"""
-        try:
-            os.makedirs(os.path.dirname(self.playlist_file), exist_ok=True)
-
-            # Статическая часть
-            static_content = ""
-            if os.path.exists(self.playlist_file):
-                with open(self.playlist_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    parts = content.split('#############################')
-                    if len(parts) >= 2:
-                        static_content = '#############################'.join(parts[:2]) + '#############################\n\n'
-                    else:
-                        static_content = self.create_default_static_content()
-            else:
-                static_content = self.create_default_static_content()
-
-            # Записываем плейлист
-            with open(self.playlist_file, 'w', encoding='utf-8') as f:
-                f.write(static_content)
-                for channel_name, streams in channels_dict.items():
-                    for stream in streams:
-                        extinf_parts = ['#EXTINF:-1']
-                        if stream.get('tvg_id'):
-                            extinf_parts.append(f'tvg-id="{stream["tvg_id"]}"')
-                        if stream.get('tvg_logo'):
-                            extinf_parts.append(f'tvg-logo="{stream["tvg_logo"]}"')
-                        if stream.get('group'):
-                            extinf_parts.append(f'group-title="{stream["group"]}"')
-                        if stream.get('quality'):
-                            extinf_parts.append(f'quality="{stream["quality"]}"')
-                        if stream.get('stable'):
-                            extinf_parts.append(f'stable="{stream["stable"]}"')
-                        if stream.get('quality_score'):
-                            extinf_parts.append(f'quality-score="{stream["quality_score"]}"')
-
-                        # Добавляем информацию о разрешении если есть
-                        if stream.get('video_info') and stream['video_info'].get('resolution'):
-                            extinf_parts.append(f'resolution="{stream["video_info"]["resolution"]}"')
-
-                        extinf_parts.append(f', {stream["name"]}')
-                        f.write(' '.join(extinf_parts) + '\n')
-                        f.write(f'{stream["url"]}\n')
-
-            print(f"💾 Плейлист сохранен: {self.playlist_file}")
-            print(f"📊 Всего каналов: {len(channels_dict)}")
-            return True
+        """Заменяет все каналы и сразу сохраняет плейлист"""
+        model = self.get_playlist_model()
+        with model.lock:
+            model.channels = channels_dict
+            model.dirty = True
+        return self.flush_playlist()
+
+    def flush_playlist_if_due(self):
+        """Сохраняет плейлист, если с прошлого сохранения прошло playlist_flush_interval"""
+        model = self.get_playlist_model()
+        if model.dirty and time.time() - model.last_flush >= self.playlist_flush_interval:
+            return self.flush_playlist()
+        return True
+
+    def flush_playlist(self):
+        """Атомарно записывает плейлист: временный файл + замена"""
+        model = self.get_playlist_model()
+        with model.lock, self.metrics.timer('write'):
+            try:
+                playlist_dir = os.path.dirname(self.playlist_file) or '.'
+                os.makedirs(playlist_dir, exist_ok=True)
 
-        except Exception as e:
-            print(f"❌ Ошибка сохранения: {e}")
-            return False
+                fd, tmp_path = tempfile.mkstemp(dir=playlist_dir, prefix='.playlist-', suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                        f.write(model.static_content)
+                        for channel_name, streams in model.channels.items():
+                            for stream in streams:
+                                f.write(self.format_playlist_entry(stream))
+                    # mkstemp создает файл с правами 0600 - возвращаем права плейлиста
+                    os.chmod(tmp_path, replacement_file_mode(self.playlist_file))
+                    os.replace(tmp_path, self.playlist_file)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+
+                model.dirty = False
+                model.last_flush = time.time()
+                model.file_mtime = self.get_playlist_mtime()
+                print(f"💾 Плейлист сохранен: {self.playlist_file}")
+                print(f"📊 Всего каналов: {len(model.channels)}")
+                return True
+
+            except Exception as e:
+                print(f"❌ Ошибка сохранения: {e}")
+                return False
+
+    def format_playlist_entry(self, stream):
+        """Строки EXTINF и URL для одной ссылки"""
+        extinf_parts = ['#EXTINF:-1']
+        if stream.get('tvg_id'):
+            extinf_parts.append(f'tvg-id="{stream["tvg_id"]}"')
+        if stream.get('tvg_logo'):
+            extinf_parts.append(f'tvg-logo="{stream["tvg_logo"]}"')
+        if stream.get('group'):
+            extinf_parts.append(f'group-title="{stream["group"]}"')
+        if stream.get('quality'):
+            extinf_parts.append(f'quality="{stream["quality"]}"')
+        if stream.get('stable'):
+            extinf_parts.append(f'stable="{stream["stable"]}"')
+        if stream.get('quality_score'):
+            extinf_parts.append(f'quality-score="{stream["quality_score"]}"')
+
+        # Добавляем информацию о разрешении если есть
+        if stream.get('video_info') and stream['video_info'].get('resolution'):
+            extinf_parts.append(f'resolution="{stream["video_info"]["resolution"]}"')
+
+        extinf_parts.append(f', {stream["name"]}')
+        return ' '.join(extinf_parts) + '\n' + f'{stream["url"]}\n'
 
     def create_default_static_content(self):
         """Создает статическую часть плейлиста"""
@@ -1615,63 +4078,76 @@ https://edge1.1internet.tv/
             return
 
         print(f"📊 Найдено каналов: {len(existing_channels)}")
-        updated_count = 0
-        failed_count = 0
+        print(f"🧵 Параллельно каналов: {self.channel_workers}")
+        counters = self.run_counters = {'updated': 0, 'failed': 0}
+        channel_names = list(existing_channels.keys())
+        snapshot = {name: list(streams) for name, streams in existing_channels.items()}
+
+        self.verification_memo.clear()
+        self.prepare_batch_search(channel_names)
 
-        for channel_name in list(existing_channels.keys()):
+        def refresh_channel(i, channel_name):
             print(f"\n{'='*60}")
-            print(f"🔄 ОБНОВЛЕНИЕ: {channel_name}")
+            print(f"🔄 [{i}/{len(channel_names)}] ОБНОВЛЕНИЕ: {channel_name}")
             print(f"{'='*60}")
 
-            try:
-                # Сохраняем ВСЮ оригинальную информацию
-                original_name = channel_name
-                original_group = None
-                original_tvg_id = ""
-                original_tvg_logo = ""
-
-                if existing_channels[channel_name]:
-                    first_stream = existing_channels[channel_name][0]
-                    original_group = first_stream.get('group', None)
-                    original_tvg_id = first_stream.get('tvg_id', '')
-                    original_tvg_logo = first_stream.get('tvg_logo', '')
-
-                # Если нет оригинальной группы, определяем из cartolog.txt
-                if not original_group:
-                    original_group = self.get_channel_category(channel_name)
-                    print(f"   ℹ️  Категория из cartolog.txt: '{original_group}'")
-
-                working_streams = self.search_channel_online(channel_name)
-
-                if working_streams:
-                    # Восстанавливаем ВСЮ оригинальную информацию
-                    for stream in working_streams:
-                        stream['name'] = original_name
-                        stream['group'] = original_group  # Важно: сохраняем оригинальную группу
-                        if original_tvg_id:
-                            stream['tvg_id'] = original_tvg_id
-                        if original_tvg_logo:
-                            stream['tvg_logo'] = original_tvg_logo
-
-                    existing_channels[channel_name] = working_streams
-                    updated_count += 1
-                    print(f"✅ ОБНОВЛЕН: {original_name} (группа: {original_group})")
-                else:
-                    del existing_channels[channel_name]
-                    failed_count += 1
-                    print(f"❌ УДАЛЕН: {channel_name}")
+            # Сохраняем ВСЮ оригинальную информацию
+            original_group = None
+            original_tvg_id = ""
+            original_tvg_logo = ""
 
-                time.sleep(2)
+            if snapshot[channel_name]:
+                first_stream = snapshot[channel_name][0]
+                original_group = first_stream.get('group', None)
+                original_tvg_id = first_stream.get('tvg_id', '')
+                original_tvg_logo = first_stream.get('tvg_logo', '')
 
-            except Exception as e:
-                print(f"💥 ОШИБКА: {e}")
-                failed_count += 1
-                continue
+            # Если нет оригинальной группы, определяем из cartolog.txt
+            if not original_group:
+                original_group = self.get_channel_category(channel_name)
+                print(f"   ℹ️  Категория из cartolog.txt: '{original_group}'")
 
-        if self.save_full_playlist(existing_channels):
+            working_streams = self.search_channel_online(channel_name)
+
+            # Восстанавливаем ВСЮ оригинальную информацию
+            for stream in working_streams:
+                stream['name'] = channel_name
+                stream['group'] = original_group  # Важно: сохраняем оригинальную группу
+                if original_tvg_id:
+                    stream['tvg_id'] = original_tvg_id
+                if original_tvg_logo:
+                    stream['tvg_logo'] = original_tvg_logo
+
+            return working_streams, original_group
+
+        def apply_result(i, channel_name, result, error):
+            if error is not None:
+                print(f"💥 ОШИБКА: {channel_name}: {error}")
+                counters['failed'] += 1
+                self.report_progress('channel', index=i, total=len(channel_names), name=channel_name,
+                                     status='error', error=str(error))
+                return
+
+            working_streams, original_group = result
+            self.update_channel_in_playlist(channel_name, working_streams, flush=False)
+            if working_streams:
+                counters['updated'] += 1
+                print(f"✅ ОБНОВЛЕН: {channel_name} (группа: {original_group})")
+            else:
+                counters['failed'] += 1
+                print(f"❌ УДАЛЕН: {channel_name}")
+            self.report_progress('channel', index=i, total=len(channel_names), name=channel_name,
+                                 status='updated' if working_streams else 'removed',
+                                 streams=len(working_streams))
+
+        self.run_channel_pipeline(channel_names, refresh_channel, apply_result)
+
+        if self.flush_playlist():
             print(f"\n🎉 ОБНОВЛЕНИЕ ЗАВЕРШЕНО!")
-            print(f"✅ Обновлено: {updated_count}")
-            print(f"❌ Удалено: {failed_count}")
+            print(f"✅ Обновлено: {counters['updated']}")
+            print(f"❌ Удалено: {counters['failed']}")
+        self.export_metrics()
+        return counters
 
     def search_channel_online(self, channel_name):
         """Поиск канала"""
@@ -1713,39 +4189,116 @@ https://edge1.1internet.tv/
 
         print(f"🎯 ПОИСК ПО СПИСКУ ИЗ {len(self.channels_list)} КАНАЛОВ...")
         print(f"⚙️  Настройки: Глубокая проверка={'ВКЛ' if self.enable_deep_check else 'ВЫКЛ'}")
-        success_count = 0
-        failed_count = 0
+        print(f"🧵 Параллельно каналов: {self.channel_workers}")
+        counters = self.run_counters = {'success': 0, 'failed': 0}
+
+        existing_channels = self.load_existing_channels()
+        snapshot = {name: list(streams) for name, streams in existing_channels.items()}
 
-        for i, channel_name in enumerate(self.channels_list, 1):
+        self.verification_memo.clear()
+        self.prepare_batch_search(self.channels_list)
+
+        def search_channel(i, channel_name):
             print(f"\n{'='*70}")
             print(f"📺 [{i}/{len(self.channels_list)}] ПОИСК: {channel_name}")
             print(f"{'='*70}")
+            return self.prepare_channel_update(channel_name, snapshot)
+
+        def apply_result(i, channel_name, result, error):
+            if error is not None:
+                print(f"💥 ОШИБКА: {channel_name}: {error}")
+                counters['failed'] += 1
+                self.report_progress('channel', index=i, total=len(self.channels_list), name=channel_name,
+                                     status='error', error=str(error))
+                return
 
-            try:
-                if self.search_and_update_channel(channel_name):
-                    success_count += 1
-                    print(f"✅ УСПЕХ: {channel_name}")
-                else:
-                    failed_count += 1
-                    print(f"❌ НЕ УДАЛОСЬ: {channel_name}")
+            success, final_channel_name, new_streams = result
+            if new_streams is not None:
+                self.update_channel_in_playlist(final_channel_name, new_streams, flush=False)
 
-                if i < len(self.channels_list):
-                    time.sleep(3)
+            if success:
+                counters['success'] += 1
+                print(f"✅ УСПЕХ: {channel_name}")
+            else:
+                counters['failed'] += 1
+                print(f"❌ НЕ УДАЛОСЬ: {channel_name}")
+            self.report_progress('channel', index=i, total=len(self.channels_list), name=final_channel_name,
+                                 status='found' if success else 'not_found',
+                                 streams=len(new_streams or []))
 
-            except Exception as e:
-                print(f"💥 ОШИБКА: {e}")
-                failed_count += 1
-                continue
+        self.run_channel_pipeline(self.channels_list, search_channel, apply_result)
+        self.flush_playlist()
 
         print(f"\n🎉 ПОИСК ЗАВЕРШЕН!")
-        print(f"✅ Найдено: {success_count} каналов")
-        print(f"❌ Не найдено: {failed_count} каналов")
+        print(f"✅ Найдено: {counters['success']} каналов")
+        print(f"❌ Не найдено: {counters['failed']} каналов")
 
         # Выводим статистику качества
         if self.stats['quality_checks'] > 0:
             print(f"\n📊 СТАТИСТИКА КАЧЕСТВА:")
             print(f"   🔍 Проверок качества: {self.stats['quality_checks']}")
             print(f"   ❌ Неудачных проверок: {self.stats['failed_quality_checks']}")
+        self.export_metrics()
+        return counters
+
+    def verify_playlist(self, playlist_path):
+        """Проверяет все ссылки плейлиста, не изменяя его: {'working': N, 'failed': N}"""
+        with open(playlist_path, 'r', encoding='utf-8', errors='ignore') as f:
+            streams = [
+                {
+                    'name': channel_info.get('name', 'Unknown'),
+                    'url': url,
+                    'group': channel_info.get('group-title', 'Общие'),
+                    'tvg_id': channel_info.get('tvg-id', ''),
+                    'tvg_logo': channel_info.get('tvg-logo', '')
+                }
+                for channel_info, url in self.iter_playlist_entries(f)
+                if url.startswith('http')
+            ]
+
+        print(f"🔧 ПРОВЕРКА ПЛЕЙЛИСТА: {playlist_path} ({len(streams)} ссылок)")
+        counters = self.run_counters = {'working': 0, 'failed': 0}
+        self.verification_memo.clear()
+
+        def check_with_host_limit(stream):
+            if self.interrupted.is_set():
+                return None
+            with self.host_limiter.slot(stream['url']):
+                return self.check_single_stream_improved(stream)
+
+        if streams:
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+                    futures = {executor.submit(check_with_host_limit, stream): i
+                               for i, stream in enumerate(streams, 1)}
+                    try:
+                        for future in as_completed(futures):
+                            i = futures[future]
+                            try:
+                                result = future.result()
+                            except Exception as e:
+                                print(f"  [{i}/{len(streams)}] ❌ Ошибка проверки - {e}")
+                                result = None
+                            if self.report_check_result(i, len(streams), result):
+                                counters['working'] += 1
+                            else:
+                                counters['failed'] += 1
+                                if not result:
+                                    self.report_progress('stream', url=streams[i - 1]['url'],
+                                                         name=streams[i - 1]['name'],
+                                                         working=False, status='не проверена')
+                    except KeyboardInterrupt:
+                        self.cancel_pending(futures)
+                        raise
+            except KeyboardInterrupt:
+                self.interrupted.clear()
+                raise
+
+        print(f"\n🎉 ПРОВЕРКА ЗАВЕРШЕНА!")
+        print(f"✅ Работают: {counters['working']}")
+        print(f"❌ Не работают: {counters['failed']}")
+        self.export_metrics()
+        return counters
 
     def show_quality_settings(self):
         """Показывает текущие настройки качества"""
@@ -1756,6 +4309,8 @@ https://edge1.1internet.tv/
         print(f"   📏 Минимальное разрешение: {self.min_video_resolution}p")
         print(f"   ⚡ Минимальный FPS: {self.required_fps}")
         print(f"   ⏰ Таймаут проверки: {self.check_timeout} секунд")
+        print(f"   🧵 Параллельных проверок: {self.max_workers} (на хост: {self.max_streams_per_host})")
+        print(f"   📺 Параллельно каналов: {self.channel_workers}")
 
     def update_quality_settings(self):
         """Обновляет настройки качества"""
@@ -1782,6 +4337,18 @@ https://edge1.1internet.tv/
             if bitrate.isdigit() and 100 <= int(bitrate) <= 10000:
                 self.required_bitrate = int(bitrate)
 
+            workers = input("Параллельных проверок (текущее: {}): ".format(
+                self.max_workers
+            )).strip()
+            if workers.isdigit() and 1 <= int(workers) <= 32:
+                self.max_workers = int(workers)
+
+            channel_workers = input("Параллельно каналов (текущее: {}): ".format(
+                self.channel_workers
+            )).strip()
+            if channel_workers.isdigit() and 1 <= int(channel_workers) <= 32:
+                self.channel_workers = int(channel_workers)
+
             print("✅ Настройки обновлены")
         except:
             print("❌ Ошибка обновления настроек")
@@ -1880,6 +4447,24 @@ def interactive_mode():
                 print(f"   ✅ Успешных: {scanner.stats['successful_requests']}")
                 print(f"   ❌ Неудачных: {scanner.stats['failed_requests']}")
                 print(f"   ⏱️  Среднее время: {scanner.stats['avg_response_time']:.2f}с")
+                print(f"   💾 Кэш плейлистов: {len(scanner.playlist_cache)} шт., "
+                      f"попаданий {scanner.playlist_cache.hits}, промахов {scanner.playlist_cache.misses}")
+                print(f"   💾 Кэш проверок: {len(scanner.quality_cache)} шт., "
+                      f"попаданий {scanner.quality_cache.hits}, промахов {scanner.quality_cache.misses}")
+                print(f"   🔁 Проверено за запуск: {len(scanner.verification_memo)} потоков, "
+                      f"повторов без проверки: {scanner.verification_memo.hits}, "
+                      f"ожидали идущую проверку: {scanner.verification_memo.coalesced}")
+                print(f"   💾 Источники с валидаторами: {len(scanner.source_validators)} шт., "
+                      f"не изменились (304): {scanner.source_validators.hits}")
+                print(f"   🔌 Недоступных хостов: {len(scanner.circuit_breaker.open_hosts())}, "
+                      f"пропущено запросов: {scanner.circuit_breaker.rejected}")
+                probes = scanner.probe_manager.stats()
+                print(f"   🎬 Процессы FFmpeg: лимит {probes['max_processes']}, "
+                      f"очередь до {probes['max_queue_depth']}, завершено {probes['completed']}, "
+                      f"таймаутов {probes['timeouts']}, ошибок {probes['failures']}")
+                print(f"   ⏱️  Ожидание p50/p95: {probes['wait_p50']:.2f}/{probes['wait_p95']:.2f}с, "
+                      f"проверка p50/p95: {probes['latency_p50']:.2f}/{probes['latency_p95']:.2f}с")
+                scanner.print_metrics()
 
                 if scanner.stats['quality_checks'] > 0:
                     print(f"\n📊 СТАТИСТИКА КАЧЕСТВА:")
@@ -1910,20 +4495,169 @@ def setup_global_ffmpeg_path():
 
 setup_global_ffmpeg_path()
 
-def main():
-    if len(sys.argv) == 1:
-        interactive_mode()
-    elif len(sys.argv) > 1 and sys.argv[1] == "--gui":
+# Коды завершения пакетного режима
+EXIT_OK = 0  # Все каналы/ссылки обработаны успешно
+EXIT_PARTIAL = 1  # Часть каналов/ссылок не найдена или не работает
+EXIT_USAGE = 2  # Неверные аргументы (argparse)
+EXIT_FAILED = 3  # Ничего не найдено или запуск невозможен
+EXIT_INTERRUPTED = 130
+
+
+class JsonLinesReporter:
+    """События выполнения в формате JSON Lines: одна строка - одно событие"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def __call__(self, event, fields):
+        self.emit(event, **fields)
+
+    def emit(self, event, **fields):
+        record = {'event': event, 'elapsed': round(time.time() - self.started, 3), **fields}
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+def build_cli_parser():
+    """Аргументы командной строки: интерактивный режим, --gui и пакетные команды"""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--workers', type=int, help='параллельных проверок ссылок')
+    common.add_argument('--channel-workers', type=int, help='параллельно обрабатываемых каналов')
+    common.add_argument('--timeout', type=int, help='таймаут HTTP запроса, секунд')
+    common.add_argument('--check-timeout', type=int, help='таймаут проверки FFmpeg, секунд')
+    common.add_argument('--check-duration', type=int, help='сколько секунд потока проверять')
+    common.add_argument('--deep-check', dest='deep_check', action='store_true', default=None,
+                        help='глубокая проверка качества через FFmpeg')
+    common.add_argument('--no-deep-check', dest='deep_check', action='store_false',
+                        help='только проверка доступности ссылок, без FFmpeg')
+    common.add_argument('--cache-dir', default='cache', help='папка постоянных кэшей (по умолчанию: cache)')
+    common.add_argument('--files-dir', default='files',
+                        help='папка с site.txt, cartolog.txt, Channels.txt (по умолчанию: files)')
+    common.add_argument('--playlist', help='файл плейлиста (по умолчанию: playlist/playlist.m3u)')
+    common.add_argument('--metrics', help='сохранить метрики после запуска: .prom - Prometheus, иначе JSON')
+
+    parser = argparse.ArgumentParser(
+        prog='M3UScanner.py',
+        description='Smart M3U Scanner с анализом качества. Без аргументов - консольный режим.',
+        epilog='Пакетные команды выводят события в stdout в формате JSON Lines, лог - в stderr. '
+               f'Коды завершения: {EXIT_OK} - успех, {EXIT_PARTIAL} - частично, '
+               f'{EXIT_USAGE} - неверные аргументы, {EXIT_FAILED} - ничего не найдено или ошибка.'
+    )
+    parser.add_argument('--gui', action='store_true', help='графический интерфейс')
+    commands = parser.add_subparsers(dest='command', metavar='команда')
+    commands.add_parser('scan', parents=[common], help='поиск по списку из Channels.txt')
+    commands.add_parser('refresh', parents=[common], help='обновить все каналы плейлиста')
+    search = commands.add_parser('search', parents=[common], help='поиск и обновление одного канала')
+    search.add_argument('name', nargs='+', help='название канала')
+    verify = commands.add_parser('verify', parents=[common], help='проверить ссылки плейлиста без изменений')
+    verify.add_argument('playlist_path', metavar='playlist', help='файл M3U для проверки')
+    return parser
+
+
+def apply_cli_settings(scanner, args):
+    """Переносит настройки из аргументов командной строки в сканер"""
+    if args.workers:
+        scanner.max_workers = args.workers
+    if args.channel_workers:
+        scanner.channel_workers = args.channel_workers
+    if args.timeout:
+        scanner.timeout = args.timeout
+    if args.check_timeout:
+        scanner.check_timeout = args.check_timeout
+    if args.check_duration:
+        scanner.check_duration = args.check_duration
+    if args.deep_check is not None:
+        scanner.enable_deep_check = args.deep_check
+    if args.playlist:
+        scanner.playlist_file = args.playlist
+    if args.metrics:
+        scanner.metrics_file = args.metrics
+
+
+def cli_exit_code(succeeded, failed):
+    if not succeeded:
+        return EXIT_FAILED
+    return EXIT_PARTIAL if failed else EXIT_OK
+
+
+def run_cli_command(scanner, args):
+    """Выполняет пакетную команду: (код завершения, итоговые поля)"""
+    if args.command == 'search':
+        channel_name = ' '.join(args.name)
+        success = scanner.search_and_update_channel(channel_name)
+        return (EXIT_OK if success else EXIT_FAILED), {'channel': channel_name, 'found': bool(success)}
+
+    if args.command == 'verify':
+        counters = scanner.verify_playlist(args.playlist_path)
+        return cli_exit_code(counters['working'], counters['failed']), counters
+
+    if args.command == 'scan':
+        counters = scanner.search_from_channels_list()
+        if counters is None:
+            return EXIT_FAILED, {'error': f'нет каналов в {scanner.channels_file}'}
+        return cli_exit_code(counters['success'], counters['failed']), counters
+
+    counters = scanner.refresh_all_channels()
+    if counters is None:
+        return EXIT_FAILED, {'error': f'нет каналов в {scanner.playlist_file}'}
+    return cli_exit_code(counters['updated'], counters['failed']), counters
+
+
+def run_cli(argv):
+    """Пакетный режим: события JSON Lines в stdout, вывод сканера - в stderr"""
+    args = build_cli_parser().parse_args(argv)
+    if args.gui:
         try:
             from Interface import main as gui_main
             gui_main()
         except ImportError:
             print("❌ Графический интерфейс не найден")
+            return EXIT_FAILED
+        return EXIT_OK
+    if not args.command:
+        interactive_mode()
+        return EXIT_OK
+
+    reporter = JsonLinesReporter(sys.stdout)
+    summary = {}
+    scanner = None
+    with redirect_stdout(sys.stderr):
+        try:
+            scanner = OnlineM3UScanner(cache_dir=args.cache_dir, files_dir=args.files_dir)
+            apply_cli_settings(scanner, args)
+            scanner.progress_callback = reporter
+            reporter.emit('start', command=args.command, deep_check=scanner.enable_deep_check,
+                          workers=scanner.max_workers, channel_workers=scanner.channel_workers)
+            code, summary = run_cli_command(scanner, args)
+            summary.update(
+                requests=scanner.stats['total_requests'],
+                failed_requests=scanner.stats['failed_requests'],
+                quality_checks=scanner.stats['quality_checks'],
+                reused_checks=scanner.verification_memo.hits + scanner.verification_memo.coalesced,
+                stages=scanner.metrics.snapshot()['stages']
+            )
+        except KeyboardInterrupt:
+            code = EXIT_INTERRUPTED
+            # Счетчики уже обработанных каналов/ссылок
+            summary = {'error': 'прервано', **(scanner.run_counters if scanner else {})}
+        except Exception as e:
+            print(f"💥 Ошибка: {e}")
+            code = EXIT_FAILED
+            summary = {'error': str(e)}
+
+    reporter.emit('summary', command=args.command, exit_code=code, **summary)
+    return code
+
+
+def main():
+    if len(sys.argv) == 1:
+        interactive_mode()
     else:
-        print("🌐 Smart M3U Scanner с анализом качества")
-        print("Использование:")
-        print("  python M3UScanner.py          - Консольный режим")
-        print("  python M3UScanner.py --gui    - Графический интерфейс")
+        sys.exit(run_cli(sys.argv[1:]))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from M3UScanner import HostCircuitBreaker
+
+
+class HostCircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.breaker = HostCircuitBreaker(os.path.join(self.tmp.name, 'hosts.db'),
+                                          failure_threshold=2, cooldown=600)
+        self.addCleanup(self.breaker._conn.close)
+        self.addCleanup(self.tmp.cleanup)
+
+    def open_circuit(self, url):
+        self.breaker.failure(url)
+        self.assertTrue(self.breaker.failure(url))
+
+    def end_cooldown(self, url):
+        self.breaker._hosts[self.breaker._host(url)][1] = time.time() - 1
+
+    def test_opens_after_threshold(self):
+        url = 'http://a.example/1.m3u8'
+        self.assertFalse(self.breaker.failure(url))
+        self.assertTrue(self.breaker.allow(url))
+        self.assertTrue(self.breaker.failure(url))
+        self.assertFalse(self.breaker.allow('http://a.example/2.m3u8'))
+        self.assertTrue(self.breaker.allow('http://b.example/1.m3u8'))
+        self.assertEqual(self.breaker.open_hosts(), ['a.example'])
+
+    def test_half_open_admits_single_probe(self):
+        url = 'http://a.example/1.m3u8'
+        self.open_circuit(url)
+        self.end_cooldown(url)
+
+        self.assertTrue(self.breaker.allow(url))
+        self.assertFalse(self.breaker.allow(url))
+        self.assertFalse(self.breaker.allow(url))
+
+        self.breaker.success(url)
+        self.assertTrue(self.breaker.allow(url))
+        self.assertTrue(self.breaker.allow(url))
+
+    def test_failed_probe_reopens(self):
+        url = 'http://a.example/1.m3u8'
+        self.open_circuit(url)
+        self.end_cooldown(url)
+
+        self.assertTrue(self.breaker.allow(url))
+        self.assertTrue(self.breaker.failure(url))
+        self.assertFalse(self.breaker.allow(url))
+
+    def test_lost_probe_expires(self):
+        url = 'http://a.example/1.m3u8'
+        self.open_circuit(url)
+        self.end_cooldown(url)
+
+        self.assertTrue(self.breaker.allow(url))
+        self.breaker._hosts['a.example'][2] -= self.breaker.probe_timeout
+        self.assertTrue(self.breaker.allow(url))
+
+    def test_open_state_survives_restart(self):
+        url = 'http://a.example/1.m3u8'
+        self.open_circuit(url)
+        restarted = HostCircuitBreaker(os.path.join(self.tmp.name, 'hosts.db'), failure_threshold=2)
+        self.addCleanup(restarted._conn.close)
+        self.assertFalse(restarted.allow(url))
+
+
+if __name__ == '__main__':
+    unittest.main()
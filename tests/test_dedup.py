@@ -0,0 +1,127 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from M3UScanner import CandidateSet, VerificationMemo, canonical_stream_url
+
+
+class CanonicalStreamUrlTest(unittest.TestCase):
+    def test_host_case_www_and_default_port(self):
+        key = canonical_stream_url('http://cdn.example.com/live/1.m3u8')
+        self.assertEqual(canonical_stream_url('http://WWW.CDN.Example.com:80/live/1.m3u8'), key)
+        self.assertEqual(canonical_stream_url('https://cdn.example.com:443/a'),
+                         canonical_stream_url('https://cdn.example.com/a'))
+
+    def test_scheme_is_kept(self):
+        self.assertNotEqual(canonical_stream_url('http://cdn.example.com/live/1.m3u8'),
+                            canonical_stream_url('https://cdn.example.com/live/1.m3u8'))
+
+    def test_other_port_is_kept(self):
+        self.assertNotEqual(canonical_stream_url('http://cdn.example.com:8080/live/1.m3u8'),
+                            canonical_stream_url('http://cdn.example.com/live/1.m3u8'))
+
+    def test_hls_names_are_different_streams(self):
+        keys = {canonical_stream_url(f'http://cdn.example.com/live/{name}')
+                for name in ('master.m3u8', 'chunklist.m3u8', 'index.m3u8', 'playlist.m3u8')}
+        self.assertEqual(len(keys), 4)
+
+    def test_query_is_kept(self):
+        for param in ('e', 'st', 'key', 'hash', 'sid', 'token'):
+            self.assertNotEqual(canonical_stream_url(f'http://cdn.example.com/live.m3u8?{param}=1'),
+                                canonical_stream_url(f'http://cdn.example.com/live.m3u8?{param}=2'))
+
+    def test_host_rules(self):
+        self.assertEqual(canonical_stream_url('https://github.com/u/r/blob/main/list.m3u'),
+                         canonical_stream_url('https://raw.githubusercontent.com/u/r/main/list.m3u?token=ABC'))
+        self.assertEqual(canonical_stream_url('https://youtu.be/abc'),
+                         canonical_stream_url('https://www.youtube.com/watch?v=abc&t=10'))
+
+    def test_non_http_is_unchanged(self):
+        self.assertEqual(canonical_stream_url('rtmp://cdn.example.com/live'), 'rtmp://cdn.example.com/live')
+
+
+class CandidateSetTest(unittest.TestCase):
+    def test_duplicate_keeps_best_and_merges_fields(self):
+        candidates = CandidateSet()
+        self.assertTrue(candidates.add({'url': 'http://cdn.example.com/1.m3u8', 'stability_score': 1,
+                                        'group': 'Новости'}))
+        self.assertFalse(candidates.add({'url': 'http://WWW.cdn.example.com/1.m3u8', 'stability_score': 5}))
+
+        self.assertEqual(len(candidates), 1)
+        self.assertEqual(candidates.duplicates, 1)
+        stream = candidates.streams()[0]
+        self.assertEqual(stream['stability_score'], 5)
+        self.assertEqual(stream['group'], 'Новости')
+
+    def test_order_and_contains(self):
+        candidates = CandidateSet()
+        added = candidates.extend([
+            {'url': 'http://a.example/1.m3u8'},
+            {'url': 'https://a.example/1.m3u8'},
+            {'url': 'http://a.example/1.m3u8'},
+            {'url': ''},
+        ])
+        self.assertEqual(added, 2)
+        self.assertEqual([s['url'] for s in candidates.streams()],
+                         ['http://a.example/1.m3u8', 'https://a.example/1.m3u8'])
+        self.assertIn('http://www.a.example/1.m3u8', candidates)
+
+
+class VerificationMemoTest(unittest.TestCase):
+    def test_check_runs_once(self):
+        memo = VerificationMemo()
+        calls = []
+        first = memo.get_or_run('http://a.example/1.m3u8', lambda: calls.append(1) or {'working': True})
+        second = memo.get_or_run('http://www.a.example/1.m3u8', lambda: calls.append(2) or {'working': False})
+        self.assertEqual(first, second)
+        self.assertEqual(calls, [1])
+        self.assertEqual(memo.hits, 1)
+        self.assertEqual(len(memo), 1)
+
+    def test_concurrent_requests_are_coalesced(self):
+        memo = VerificationMemo()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def check():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'working': True}
+
+        results = []
+        owner = threading.Thread(target=lambda: results.append(memo.get_or_run('http://a.example/x', check)))
+        owner.start()
+        started.wait(5)
+        waiter = threading.Thread(target=lambda: results.append(memo.get_or_run('http://a.example/x', check)))
+        waiter.start()
+        while memo.coalesced == 0 and waiter.is_alive():
+            threading.Event().wait(0.01)
+        release.set()
+        owner.join(5)
+        waiter.join(5)
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(memo.coalesced, 1)
+        self.assertEqual(results, [{'working': True}] * 2)
+
+    def test_failed_check_can_be_retried(self):
+        memo = VerificationMemo()
+
+        def fail():
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError):
+            memo.get_or_run('http://a.example/x', fail)
+        self.assertEqual(memo.get_or_run('http://a.example/x', lambda: 'ok'), 'ok')
+
+        memo.clear()
+        self.assertEqual(len(memo), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
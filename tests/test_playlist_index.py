@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from M3UScanner import PlaylistEntry, PlaylistIndex
+
+
+def make_entry(name, url):
+    return PlaylistEntry(name=name, url=url, group='Общие', tvg_id='', tvg_logo='',
+                         quality_score=0, stability_score=0)
+
+
+class PlaylistIndexEntriesTest(unittest.TestCase):
+    def test_round_trip(self):
+        index = PlaylistIndex()
+        index.add(make_entry('Первый HD', 'http://a.example/1.m3u8'))
+        index.add(make_entry('Второй', 'http://a.example/2.m3u8'))
+
+        restored = PlaylistIndex.from_entries(index.to_entries())
+        self.assertEqual(restored.entries, index.entries)
+
+    def test_old_format_is_rejected(self):
+        index = PlaylistIndex()
+        index.add(make_entry('Первый HD', 'http://a.example/1.m3u8'))
+        rows = index.to_entries()['entries']
+
+        with self.assertRaises(ValueError):
+            PlaylistIndex.from_entries(rows)
+        with self.assertRaises(ValueError):
+            PlaylistIndex.from_entries(dict(index.to_entries(), version=PlaylistIndex.FORMAT_VERSION + 1))
+        with self.assertRaises(ValueError):
+            PlaylistIndex.from_entries(None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from M3UScanner import FfmpegOutputWatcher, ProbeProcessManager
+
+
+class ProbeProcessManagerTest(unittest.TestCase):
+    def test_on_finish_excludes_queue_wait(self):
+        manager = ProbeProcessManager(max_processes=1)
+        cmd = [sys.executable, '-c', 'import time; time.sleep(0.3)']
+        latencies = []
+        threads = [threading.Thread(target=manager.run, args=(cmd, 10),
+                                    kwargs={'on_finish': latencies.append}) for _ in range(2)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(manager.completed, 2)
+        self.assertGreaterEqual(time.time() - started, 0.6)
+        self.assertEqual(len(latencies), 2)
+        # Второй запуск ждал слот ~0.3 с, но в его время это не входит
+        self.assertLess(max(latencies), 0.55)
+
+    def test_timeout_kills_process(self):
+        manager = ProbeProcessManager(max_processes=1)
+        latencies = []
+        cmd = [sys.executable, '-c', 'import time; time.sleep(10)']
+        with self.assertRaises(subprocess.TimeoutExpired):
+            manager.run(cmd, 0.2, on_finish=latencies.append)
+        self.assertEqual(manager.timeouts, 1)
+        self.assertEqual(manager.running, 0)
+        self.assertEqual(len(latencies), 1)
+
+    def run_watched(self, stderr_text):
+        manager = ProbeProcessManager(max_processes=1)
+        watcher = FfmpegOutputWatcher(wait_first_frame=False)
+        script = f'import sys, time; sys.stderr.write({stderr_text!r}); sys.stderr.flush(); time.sleep(10)'
+        manager.run([sys.executable, '-c', script], 10, watcher)
+        return manager, watcher
+
+    def test_watcher_failure_is_error(self):
+        manager, watcher = self.run_watched('tcp://a.example: Connection refused\n')
+        self.assertTrue(watcher.failed)
+        self.assertEqual((manager.completed, manager.failures), (0, 1))
+
+    def test_watcher_early_stop_is_ok(self):
+        manager, watcher = self.run_watched('Stream #0:0: Video: h264, yuv420p, 1280x720, 25 fps\n')
+        self.assertTrue(watcher.complete)
+        self.assertEqual((manager.completed, manager.failures), (1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from M3UScanner import HostRateLimiter
+
+
+class HostRateLimiterTest(unittest.TestCase):
+    def test_burst_is_free(self):
+        limiter = HostRateLimiter(rate=1.0, burst=3)
+        delays = [limiter.reserve('http://a.example/x') for _ in range(3)]
+        self.assertEqual(delays, [0.0, 0.0, 0.0])
+        self.assertGreater(limiter.reserve('http://a.example/x'), 0.0)
+
+    def test_hosts_are_independent(self):
+        limiter = HostRateLimiter(rate=1.0, burst=1)
+        limiter.reserve('http://a.example/x')
+        self.assertEqual(limiter.reserve('http://b.example/x'), 0.0)
+
+    def test_refusal_does_not_take_token(self):
+        limiter = HostRateLimiter(rate=1.0, burst=1)
+        limiter.failure('http://a.example/x', retry_after=120)
+        for _ in range(100):
+            self.assertIsNone(limiter.reserve('http://a.example/x', max_wait=60))
+            self.assertFalse(limiter.acquire('http://a.example/x', max_wait=60))
+
+        # После паузы хост снова доступен без накопленного долга
+        limiter._hosts['a.example'][2] = 0.0
+        self.assertEqual(limiter.reserve('http://a.example/x', max_wait=60), 0.0)
+
+    def test_failure_backoff_grows(self):
+        limiter = HostRateLimiter(backoff_base=1.0, backoff_max=60.0)
+        first = limiter.failure('http://a.example/x')
+        second = limiter.failure('http://a.example/x')
+        self.assertLessEqual(first, 1.0)
+        self.assertLessEqual(second, 2.0)
+        self.assertGreater(second, 0.5)
+        limiter.success('http://a.example/x')
+        self.assertEqual(limiter._hosts['a.example'][3], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from M3UScanner import StreamCheckCache
+
+
+class StreamCheckCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db_path = os.path.join(self.tmp.name, 'stream_checks.db')
+
+    def open_cache(self, **kwargs):
+        cache = StreamCheckCache(self.db_path, **kwargs)
+        self.addCleanup(cache._conn.close)
+        return cache
+
+    def test_settings_must_match(self):
+        cache = self.open_cache()
+        cache.put('http://a.example/1.m3u8', {'working': True}, True, settings='500kbps')
+
+        self.assertEqual(cache.get('http://a.example/1.m3u8', settings='500kbps'), {'working': True})
+        self.assertIsNone(cache.get('http://a.example/1.m3u8', settings='2000kbps'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        cache.put('http://a.example/1.m3u8', {'working': False}, False, settings='2000kbps')
+        self.assertEqual(cache.get('http://a.example/1.m3u8', settings='2000kbps'), {'working': False})
+        self.assertEqual(len(cache), 1)
+
+    def test_kinds_are_separate(self):
+        cache = self.open_cache()
+        cache.put('http://a.example/1.m3u8', {'working': True}, True)
+        self.assertIsNone(cache.get('http://a.example/1.m3u8', kind='quality'))
+
+    def test_expired_entry_is_dropped(self):
+        cache = self.open_cache(negative_ttl=-1)
+        cache.put('http://a.example/1.m3u8', {'working': False}, False)
+        self.assertIsNone(cache.get('http://a.example/1.m3u8'))
+        self.assertEqual(len(cache), 0)
+
+    def test_old_database_is_migrated(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            'CREATE TABLE stream_checks (kind TEXT NOT NULL, url TEXT NOT NULL, result TEXT NOT NULL, '
+            'working INTEGER NOT NULL, checked_at REAL NOT NULL, last_access REAL NOT NULL, '
+            'PRIMARY KEY (kind, url))'
+        )
+        conn.execute("INSERT INTO stream_checks VALUES ('check', 'http://a.example/1.m3u8', '{}', 1, 1e12, 1e12)")
+        conn.commit()
+        conn.close()
+
+        cache = self.open_cache()
+        self.assertIsNone(cache.get('http://a.example/1.m3u8', settings='500kbps'))
+        cache.put('http://a.example/1.m3u8', {'working': True}, True, settings='500kbps')
+        self.assertEqual(cache.get('http://a.example/1.m3u8', settings='500kbps'), {'working': True})
+
+
+if __name__ == '__main__':
+    unittest.main()